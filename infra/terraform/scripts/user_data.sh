@@ -33,6 +33,12 @@ DB_USER=${db_user}
 DB_PASSWORD=${db_password}
 DB_HOST=db
 DB_PORT=5432
+DB_POOL_MIN_SIZE=2
+DB_POOL_MAX_SIZE=10
+DB_POOL_MAX_IDLE=300
+DB_POOL_CHECK=1
+MODO_SERVIDOR=wsgi
+REDIS_URL=redis://redis:6379/0
 DJANGO_SECRET_KEY=${django_secret_key}
 DOCKER_IMAGE=${docker_image}
 EOF
@@ -56,19 +62,31 @@ services:
       timeout: 5s
       retries: 5
 
+  redis:
+    image: redis:7-alpine
+    restart: always
+    command: redis-server --save "" --appendonly no --maxmemory 256mb --maxmemory-policy allkeys-lru
+    healthcheck:
+      test: ["CMD", "redis-cli", "ping"]
+      interval: 10s
+      timeout: 5s
+      retries: 5
+
   app:
     image: ${docker_image}
     restart: always
     depends_on:
       db:
         condition: service_healthy
+      redis:
+        condition: service_healthy
     env_file:
       - .env
     ports:
       - "80:8000"
     command: >
       sh -c "python manage.py migrate --noinput &&
-             gunicorn --bind 0.0.0.0:8000 servicio_usuario.wsgi:application"
+             exec gunicorn -c python:servicio_usuario.gunicorn_conf"
 
 volumes:
   postgres_data:
@@ -0,0 +1,69 @@
+"""
+Backend PostgreSQL (psycopg 3) con pool de conexiones instrumentado.
+
+Es `django.db.backends.postgresql` tal cual (el pool lo configura
+`OPTIONS['pool']`), pero mide cuánto espera cada petición para obtener una
+conexión del pool. Sin pool se comporta exactamente igual que el original.
+"""
+import threading
+import time
+
+from django.db.backends.postgresql import base
+
+from usuario import timing
+
+
+class EstadisticasCheckout:
+    """Contadores de espera al sacar conexiones del pool, por alias de BD."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_alias = {}
+
+    def registrar(self, alias, espera, error=False):
+        with self._lock:
+            datos = self._por_alias.setdefault(alias, {
+                'checkouts': 0,
+                'errores': 0,
+                'espera_total_s': 0.0,
+                'espera_maxima_s': 0.0,
+            })
+            datos['checkouts'] += 1
+            datos['espera_total_s'] += espera
+            if error:
+                datos['errores'] += 1
+            if espera > datos['espera_maxima_s']:
+                datos['espera_maxima_s'] = espera
+
+    def obtener(self, alias):
+        with self._lock:
+            return dict(self._por_alias.get(alias, {}))
+
+
+estadisticas_checkout = EstadisticasCheckout()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        if not self.pool:
+            return super().get_new_connection(conn_params)
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return super().get_new_connection(conn_params)
+        except Exception:
+            # Incluye PoolTimeout: el pool estaba agotado durante todo `timeout`.
+            error = True
+            raise
+        finally:
+            espera = time.perf_counter() - inicio
+            estadisticas_checkout.registrar(self.alias, espera, error)
+            timing.acumular('db_checkout', espera)
+
+    def estadisticas_pool(self):
+        """Checkouts medidos por este proceso + estadísticas propias de psycopg_pool."""
+        datos = estadisticas_checkout.obtener(self.alias)
+        if self.pool:
+            datos.update(self.pool.get_stats())
+        return datos
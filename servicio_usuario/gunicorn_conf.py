@@ -0,0 +1,66 @@
+"""
+Configuración de gunicorn del servicio.
+
+    gunicorn -c python:servicio_usuario.gunicorn_conf
+    WEB_CONCURRENCY=4 MODO_SERVIDOR=asgi gunicorn -c python:servicio_usuario.gunicorn_conf
+
+- La aplicación (wsgi o asgi con workers uvicorn) sale de MODO_SERVIDOR.
+- `preload_app`: Django, DRF, simplejwt y corsheaders (y el URLconf con las
+  vistas) se importan una sola vez en el master y los workers comparten esas
+  páginas copy-on-write.
+- Cada worker se calienta (usuario/arranque.py) antes de aceptar peticiones.
+- El master registra el tiempo de importación por paquete y cada worker su
+  tiempo hasta quedar listo, en el logger 'usuario.arranque'.
+
+El número de workers lo fija gunicorn con WEB_CONCURRENCY (o --workers), y
+cualquier opción de la línea de comandos tiene prioridad sobre este archivo.
+"""
+import glob
+import os
+import time
+
+from usuario.arranque import MedidorImportaciones, calentar, precargar, registrar_master, registrar_worker
+
+
+INICIO = time.monotonic()
+medidor = MedidorImportaciones.instalar()
+
+# Las métricas multiproceso (usuario/metricas.py) crean sus archivos al
+# importarse, durante la precarga: el directorio tiene que existir y no
+# conservar valores de procesos de un arranque anterior.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    for archivo in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+        os.remove(archivo)
+
+MODO_SERVIDOR = os.environ.get('MODO_SERVIDOR', 'wsgi')
+CALENTAR = os.environ.get('GUNICORN_CALENTAR', '1') == '1'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+if MODO_SERVIDOR == 'asgi':
+    wsgi_app = 'servicio_usuario.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'servicio_usuario.wsgi:application'
+
+
+def when_ready(server):
+    # Último hook del master antes del primer fork. Sin preload (--no-preload)
+    # Django no está configurado aquí y cada worker lo hace todo.
+    pasos = precargar() if server.cfg.preload_app else {}
+    medidor.desinstalar()
+    # Una conexión abierta en el master acabaría compartida por todos los workers.
+    from django.db import connections
+    connections.close_all()
+    registrar_master(medidor, pasos, time.monotonic() - INICIO)
+
+
+def post_fork(server, worker):
+    worker.inicio_arranque = time.monotonic()
+
+
+def post_worker_init(worker):
+    pasos = calentar() if CALENTAR else {}
+    ahora = time.monotonic()
+    registrar_worker(worker.pid, pasos, ahora - worker.inicio_arranque, ahora - INICIO)
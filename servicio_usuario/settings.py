@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/dev/ref/settings/
 """
 
+import json
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware', # Debe estar al inicio
+    'usuario.middleware.ServerTimingMiddleware', # Cabecera Server-Timing y log por petición
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,8 +67,20 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWT sin consultas: claims del token + instantánea cacheada (usuario/authentication.py)
+        'usuario.authentication.SnapshotJWTAuthentication',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        # JSONParser que mide el parseo para Server-Timing
+        'usuario.parsers.JSONParserMedido',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
+    # Proxies de confianza delante del servicio. La IP del límite de logins
+    # (usuario/throttling.py) sale de X-Forwarded-For solo si hay proxies; con
+    # 0 (el despliegue con el puerto publicado directamente) se usa REMOTE_ADDR,
+    # que el cliente no puede falsear.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
 }
 
 ROOT_URLCONF = 'servicio_usuario.urls'
@@ -92,20 +107,44 @@ WSGI_APPLICATION = 'servicio_usuario.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/dev/ref/settings/#databases
 
-import os
-
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # PostgreSQL (psycopg 3) con medición de la espera al obtener conexiones del pool
+        'ENGINE': 'servicio_usuario.db',
         'NAME': os.environ.get('DB_NAME', 'usuario_db_ecommerce'),
         'USER': os.environ.get('DB_USER', 'postgres'),
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         # IMPORTANTE: En Docker, el host es el nombre del servicio definido en compose
         'HOST': os.environ.get('DB_HOST', 'db'), 
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Comprueba la conexión antes de entregarla (con pool: al hacer checkout)
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_POOL_CHECK', '1') == '1',
+        'OPTIONS': {},
     }
 }
 
+# Pool de conexiones de psycopg_pool (un pool por worker de gunicorn).
+# DB_POOL=0 vuelve a conexiones por petición, reutilizables con DB_CONN_MAX_AGE.
+if os.environ.get('DB_POOL', '1') == '1':
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+        'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', '300')),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '0'))
+
+# DB_ENGINE=sqlite: base local en un archivo (desarrollo y benchmarks sin PostgreSQL)
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {'timeout': 20},
+        }
+    }
+
 import sys
 
 # Si el comando ejecutado es 'test', forzamos el uso de SQLite
@@ -138,6 +177,31 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = "usuario.Usuario"
 
+# Hashers de contraseñas: el primero es el preferido. PBKDF2 con las iteraciones
+# calibradas para este nodo (manage.py calibrar_hasher escribe HASHER_CONFIG).
+PASSWORD_HASHERS = [
+    'usuario.hashers.PBKDF2CalibradoHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+HASHER_CONFIG = Path(os.environ.get('HASHER_CONFIG', BASE_DIR / 'hasher_config.json'))
+
+# PBKDF2_ITERACIONES en el entorno tiene prioridad sobre el archivo calibrado;
+# sin ninguno de los dos se usa el valor por defecto de Django.
+if os.environ.get('PBKDF2_ITERACIONES'):
+    PBKDF2_ITERACIONES = int(os.environ['PBKDF2_ITERACIONES'])
+elif HASHER_CONFIG.exists():
+    PBKDF2_ITERACIONES = json.loads(HASHER_CONFIG.read_text())['iteraciones']
+else:
+    PBKDF2_ITERACIONES = None
+
+# En tests basta con un hash barato
+if 'test' in sys.argv:
+    PBKDF2_ITERACIONES = 1000
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/dev/topics/i18n/
@@ -160,3 +224,143 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/dev/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Workers de gunicorn del nodo (gunicorn lee la misma variable; por defecto 1)
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Pool de hashing de contraseñas (usuario/hashing.py)
+# WORKERS: procesos dedicados a PBKDF2 por worker de gunicorn (0 = en el mismo proceso).
+#   Por defecto los CPUs del nodo repartidos entre los WEB_CONCURRENCY workers,
+#   para no tener más procesos de hash que CPUs en el nodo.
+# MAX_COLA: peticiones que pueden esperar; por encima se responde 503 + Retry-After.
+
+USUARIO_HASH_POOL = {
+    'WORKERS': 0 if 'test' in sys.argv else int(
+        os.environ.get('HASH_POOL_WORKERS', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY))
+    ),
+    'MAX_COLA': int(os.environ.get('HASH_POOL_MAX_COLA', '16')),
+    'RETRY_AFTER': int(os.environ.get('HASH_POOL_RETRY_AFTER', '1')),
+}
+
+
+# Caché
+# Con REDIS_URL se comparte entre workers y nodos (docker-compose levanta el
+# servicio `redis`); sin ella se usa locmem, que es por proceso: solo para
+# desarrollo y tests (ver USUARIO_CACHE y LOGIN_THROTTLE).
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'servicio-usuario',
+        }
+    }
+
+# Caché de lectura de usuarios (usuario/cache.py). TTL_LOCAL acota cuánto puede
+# tardar otro worker en ver una escritura (con locmem, TTL_COMPARTIDO y
+# TTL_SNAPSHOT se reducen a TTL_LOCAL). Desactivada en tests: cada test
+# reutiliza ids tras el rollback.
+USUARIO_CACHE = {
+    'ACTIVA': 'test' not in sys.argv and os.environ.get('USUARIO_CACHE_ACTIVA', '1') == '1',
+    'MAX_ENTRADAS': int(os.environ.get('USUARIO_CACHE_MAX_ENTRADAS', '10000')),
+    'TTL_LOCAL': int(os.environ.get('USUARIO_CACHE_TTL_LOCAL', '5')),
+    'TTL_COMPARTIDO': int(os.environ.get('USUARIO_CACHE_TTL_COMPARTIDO', '300')),
+    # Máximo tiempo que un usuario desactivado puede seguir autenticándose con su JWT
+    'TTL_SNAPSHOT': int(os.environ.get('USUARIO_CACHE_TTL_SNAPSHOT', '30')),
+}
+
+
+# Límite de logins fallidos (usuario/throttling.py): ventana deslizante en segundos
+# y fallos permitidos por email y por IP. Los contadores viven en la caché
+# 'default': con REDIS_URL son de todo el servicio; con locmem son de cada
+# worker y se pierden al reiniciar. Desactivado en tests salvo override.
+LOGIN_THROTTLE = {
+    'ACTIVO': 'test' not in sys.argv and os.environ.get('LOGIN_THROTTLE_ACTIVO', '1') == '1',
+    'VENTANA': int(os.environ.get('LOGIN_THROTTLE_VENTANA', '300')),
+    'MAX_FALLOS_EMAIL': int(os.environ.get('LOGIN_THROTTLE_MAX_FALLOS_EMAIL', '5')),
+    'MAX_FALLOS_IP': int(os.environ.get('LOGIN_THROTTLE_MAX_FALLOS_IP', '50')),
+    # Workers de gunicorn del nodo. Sin REDIS_URL (locmem) cada worker cuenta
+    # solo sus fallos y los límites de arriba se reparten entre ellos.
+    'PROCESOS': WEB_CONCURRENCY,
+}
+
+# Refresh tokens rotados (usuario/revocacion.py): filtro de Bloom por worker
+# dimensionado para CAPACIDAD revocaciones vigentes con esa tasa de falsos
+# positivos; cada SINCRONIZAR_CADA segundos incorpora las de otros workers.
+USUARIO_REVOCACION = {
+    'CAPACIDAD': int(os.environ.get('REVOCACION_CAPACIDAD', '100000')),
+    'TASA_FALSOS_POSITIVOS': float(os.environ.get('REVOCACION_TASA_FALSOS_POSITIVOS', '0.001')),
+    'SINCRONIZAR_CADA': int(os.environ.get('REVOCACION_SINCRONIZAR_CADA', '5')),
+}
+
+# Eventos de cambios de usuarios (usuario/eventos.py) que reparte
+# `manage.py despachar_eventos`. SINK: 'webhook' (POST de cada lote a
+# WEBHOOK_URL), 'archivo' (NDJSON en ARCHIVO), 'memoria' o la ruta de una clase.
+# Los eventos ya entregados se borran pasadas RETENCION_HORAS.
+USUARIO_EVENTOS = {
+    'SINK': os.environ.get('EVENTOS_SINK', 'webhook' if os.environ.get('EVENTOS_WEBHOOK_URL') else 'archivo'),
+    'WEBHOOK_URL': os.environ.get('EVENTOS_WEBHOOK_URL', ''),
+    'WEBHOOK_TIMEOUT': float(os.environ.get('EVENTOS_WEBHOOK_TIMEOUT', '10')),
+    'ARCHIVO': os.environ.get('EVENTOS_ARCHIVO', str(BASE_DIR / 'eventos.ndjson')),
+    'LOTE': int(os.environ.get('EVENTOS_LOTE', '500')),
+    'ESPERA': float(os.environ.get('EVENTOS_ESPERA', '1')),
+    'RETENCION_HORAS': int(os.environ.get('EVENTOS_RETENCION_HORAS', '24')),
+}
+
+# Purga de usuarios dados de baja (`manage.py purgar_usuarios`): LOTE usuarios
+# por transacción y PAUSA segundos entre lotes para no acaparar la BD; solo las
+# bajas de hace más de ANTIGUEDAD_HORAS. En PostgreSQL un lote que espera más
+# de BLOQUEO_MAX_MS por un bloqueo se aborta y se reintenta tras la pausa.
+USUARIO_PURGA = {
+    'LOTE': int(os.environ.get('PURGA_LOTE', '500')),
+    'PAUSA': float(os.environ.get('PURGA_PAUSA', '0.2')),
+    'ANTIGUEDAD_HORAS': float(os.environ.get('PURGA_ANTIGUEDAD_HORAS', '0')),
+    'BLOQUEO_MAX_MS': int(os.environ.get('PURGA_BLOQUEO_MAX_MS', '2000')),
+}
+
+# Modo del servidor: 'wsgi' (gunicorn con workers síncronos) o 'asgi' (workers
+# uvicorn con servicio_usuario.asgi y las vistas asíncronas de login y registro).
+MODO_SERVIDOR = os.environ.get('MODO_SERVIDOR', 'wsgi')
+VISTAS_ASYNC = MODO_SERVIDOR == 'asgi'
+
+# Desglose de tiempos por petición (usuario/middleware.py): una línea de log
+# en 'usuario.timing' y, con SERVER_TIMING_CABECERA, la cabecera Server-Timing.
+# La cabecera va a cualquier cliente y la fase hash del login delata si el
+# email existe: solo para desarrollo y benchmarks, no en un despliegue público.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+SERVER_TIMING_CABECERA = os.environ.get('SERVER_TIMING_CABECERA', '0') == '1'
+
+# Métricas Prometheus en /metrics (usuario/metricas.py). Con varios workers hay
+# que exportar PROMETHEUS_MULTIPROC_DIR (directorio vacío) antes de arrancar gunicorn.
+METRICAS = os.environ.get('METRICAS', '1') == '1'
+# /metrics sale por el mismo puerto que la API: solo responde a las redes de
+# METRICAS_REDES (por defecto loopback) o con "Authorization: Bearer
+# <METRICAS_TOKEN>". Con los puertos publicados por Docker los clientes
+# externos pueden llegar con la IP del gateway del bridge, así que para un
+# Prometheus en otro contenedor o host es mejor el token que abrir esas redes.
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+METRICAS_REDES = [
+    red.strip() for red in os.environ.get('METRICAS_REDES', '127.0.0.1/32,::1/128').split(',') if red.strip()
+]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'usuario': {
+            'handlers': ['console'],
+            'level': os.environ.get('USUARIO_LOG_LEVEL', 'WARNING' if 'test' in sys.argv else 'INFO'),
+        },
+    },
+}
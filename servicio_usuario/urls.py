@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from usuario.views import metricas_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('usuario.urls')),
+    path('metrics', metricas_view, name='metricas'),  # Prometheus (agregado entre workers)
 ]
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class UsuarioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'usuario'
+
+    def ready(self):
+        from usuario import permisos, timing
+
+        # Mide cada consulta para Server-Timing (usuario/middleware.py)
+        connection_created.connect(timing.instalar_en_conexion, dispatch_uid='usuario.timing')
+        # Bit de cada permiso nuevo para los bitsets de los tokens (usuario/permisos.py).
+        # Sin `sender`: se llama tras el post_migrate de auth de cada app, con sus permisos ya creados.
+        post_migrate.connect(permisos.al_migrar, dispatch_uid='usuario.permisos')
@@ -0,0 +1,175 @@
+"""
+Arranque de los workers de gunicorn (servicio_usuario/gunicorn_conf.py).
+
+`MedidorImportaciones` mide en el master cuánto tarda cada import mientras
+gunicorn precarga la aplicación (`preload_app`), agrupado por paquete raíz.
+`precargar()` corre también en el master: importa el URLconf con las vistas e
+inicializa el hasher y el firmador JWT. `calentar()` corre en cada worker
+antes de aceptar peticiones y además abre la conexión a la BD, los procesos
+del pool de hashing y el filtro de tokens revocados, para que nada de eso
+recaiga en la primera petición.
+
+Ambos informes se escriben en el logger 'usuario.arranque' con el mismo
+formato clave=valor que 'usuario.timing'.
+
+Este módulo se importa desde la configuración de gunicorn, antes de que
+Django esté configurado: nada de Django a nivel de módulo.
+"""
+import logging
+import sys
+import time
+from collections import defaultdict
+
+
+logger = logging.getLogger('usuario.arranque')
+
+# Paquetes que se detallan en el informe de importaciones; el resto se suma en 'otros'
+MAX_PAQUETES = 15
+
+
+class MedidorImportaciones:
+    """
+    Finder de `sys.meta_path` que no resuelve nada por sí mismo: deja que los
+    demás finders encuentren el módulo y envuelve `exec_module` del loader
+    para medir el tiempo propio de cada módulo (sin contar los imports que
+    hace a su vez, como `python -X importtime`).
+    """
+
+    def __init__(self):
+        self.por_paquete = defaultdict(float)
+        self._pila = []
+
+    @classmethod
+    def instalar(cls):
+        medidor = cls()
+        sys.meta_path.insert(0, medidor)
+        return medidor
+
+    def desinstalar(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, nombre, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(nombre, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # Los loaders de módulos builtin/frozen son clases compartidas: no se tocan.
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+            loader.exec_module = self._medir(loader.exec_module, nombre.partition('.')[0])
+        return spec
+
+    def _medir(self, exec_module, paquete):
+        def exec_module_medido(modulo):
+            self._pila.append(0.0)
+            inicio = time.perf_counter()
+            try:
+                exec_module(modulo)
+            finally:
+                total = time.perf_counter() - inicio
+                hijos = self._pila.pop()
+                self.por_paquete[paquete] += total - hijos
+                if self._pila:
+                    self._pila[-1] += total
+        return exec_module_medido
+
+    def informe(self, maximo=MAX_PAQUETES):
+        """{paquete: ms} de los `maximo` paquetes más lentos, más 'otros' y 'total'."""
+        ordenados = sorted(self.por_paquete.items(), key=lambda item: item[1], reverse=True)
+        datos = {paquete: round(segundos * 1000, 1) for paquete, segundos in ordenados[:maximo]}
+        datos['otros'] = round(sum(segundos for _, segundos in ordenados[maximo:]) * 1000, 1)
+        datos['total'] = round(sum(self.por_paquete.values()) * 1000, 1)
+        return datos
+
+
+def _ms(pasos):
+    return {paso: round(segundos * 1000, 1) for paso, segundos in pasos.items()}
+
+
+def precargar():
+    """
+    Lo que no abre conexiones ni procesos y puede hacerse en el master antes
+    del fork: importar el URLconf con sus vistas (DRF, simplejwt), construir
+    las tablas de reverse() y cargar el hasher y el firmador JWT. En el
+    worker, si ya se hizo en el master, no cuesta nada.
+    Devuelve los milisegundos de cada paso.
+    """
+    pasos = {}
+
+    inicio = time.perf_counter()
+    from django.urls import get_resolver, resolve, reverse
+    # reverse_dict construye las tablas de reverse(); resolve() importa las vistas.
+    get_resolver().reverse_dict
+    resolve(reverse('login'))
+    pasos['urls'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    from django.contrib.auth.hashers import get_hasher
+    get_hasher('default')
+    pasos['hasher'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    from rest_framework_simplejwt.state import token_backend
+    token_backend.decode(token_backend.encode({'calentamiento': True}))
+    pasos['jwt'] = time.perf_counter() - inicio
+
+    return _ms(pasos)
+
+
+def calentar():
+    """
+    Deja el worker listo para servir la primera petición sin trabajo diferido:
+    `precargar()` más la conexión a la BD, los procesos del pool de hashing y
+    el filtro de tokens revocados, que no pueden heredarse del master.
+    Devuelve los milisegundos de cada paso.
+    """
+    pasos = precargar()
+
+    inicio = time.perf_counter()
+    from django.db import connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if getattr(connection, 'pool', None):
+        # Con pool ya quedan abiertas min_size conexiones; esta vuelve al pool.
+        # Sin pool se mantiene si CONN_MAX_AGE lo permite.
+        connection.close()
+    bd = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    from usuario import hashing
+    hashing.obtener_pool().calentar()
+    pool_hash = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    from usuario import revocacion
+    revocacion.obtener_lista().sincronizar(forzar=True)
+    filtro_revocados = time.perf_counter() - inicio
+
+    pasos.update(_ms({'bd': bd, 'pool_hash': pool_hash, 'revocacion': filtro_revocados}))
+    return pasos
+
+
+def _registrar(campos):
+    logger.info(' '.join(f'{clave}={valor}' for clave, valor in campos.items()), extra={'arranque': campos})
+
+
+def registrar_master(medidor, pasos, segundos):
+    """Informe del master tras precargar la aplicación."""
+    campos = {'evento': 'master_listo', 'carga_s': round(segundos, 3)}
+    campos.update({f'precargar_{paso}_ms': ms for paso, ms in pasos.items()})
+    campos.update({f'import_{paquete}_ms': ms for paquete, ms in medidor.informe().items()})
+    _registrar(campos)
+
+
+def registrar_worker(pid, pasos, desde_fork, desde_arranque):
+    """Informe de un worker al terminar de calentar, justo antes de aceptar peticiones."""
+    campos = {'evento': 'worker_listo', 'pid': pid}
+    campos.update({f'calentar_{paso}_ms': ms for paso, ms in pasos.items()})
+    campos['desde_fork_ms'] = round(desde_fork * 1000, 1)
+    campos['desde_arranque_s'] = round(desde_arranque, 3)
+    _registrar(campos)
@@ -0,0 +1,83 @@
+"""
+Autenticación JWT sin consultas a la BD.
+
+`JWTAuthentication` de simplejwt carga la fila de `Usuario` en cada petición
+solo para construir `request.user`. Aquí el usuario se arma con los claims
+del token (`generar_tokens_para_usuario` añade `username`, `is_staff` y el
+bitset de permisos `perms`) y una instantánea cacheada de pocos campos.
+`has_perm` se resuelve con su bitset (usuario/permisos.py). La instantánea
+tiene un TTL corto (`USUARIO_CACHE['TTL_SNAPSHOT']`) y se invalida en cada
+escritura, de modo que una desactivación se aplica como mucho en ese tiempo.
+"""
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from usuario import cache
+from usuario import permisos
+from usuario.models import Usuario
+
+
+CAMPOS_SNAPSHOT = ('is_active', 'is_staff', 'is_superuser', 'username', 'permisos')
+
+
+def cargar_snapshot(id):
+    return Usuario.objects.filter(pk=id).values(*CAMPOS_SNAPSHOT).first()
+
+
+class UsuarioToken(TokenUser):
+    """`request.user` construido a partir del token y la instantánea cacheada."""
+
+    def __init__(self, token, snapshot):
+        super().__init__(token)
+        self.snapshot = snapshot
+
+    @property
+    def is_active(self):
+        return self.snapshot['is_active']
+
+    @cached_property
+    def is_staff(self):
+        return self.snapshot['is_staff']
+
+    @cached_property
+    def is_superuser(self):
+        return self.snapshot['is_superuser']
+
+    @cached_property
+    def username(self):
+        return self.snapshot['username']
+
+    @cached_property
+    def bitset(self):
+        # De la instantánea y no del claim: refleja cambios antes de que caduque el token
+        return permisos.decodificar(self.snapshot['permisos'])
+
+    def has_perm(self, perm, obj=None):
+        # Sin consultas ni permisos por objeto
+        if obj is not None or not self.is_active:
+            return False
+        return self.is_superuser or permisos.tiene(self.bitset, perm)
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+
+class SnapshotJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("El token no contiene un identificador de usuario")
+
+        snapshot = cache.obtener_snapshot(user_id, cargar_snapshot)
+        if snapshot is None:
+            raise AuthenticationFailed("Usuario no encontrado", code="user_not_found")
+        if not snapshot['is_active']:
+            raise AuthenticationFailed("Usuario inactivo", code="user_inactive")
+
+        return UsuarioToken(validated_token, snapshot)
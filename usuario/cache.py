@@ -0,0 +1,332 @@
+"""
+Caché de lectura de usuarios en dos niveles.
+
+1. LRU local por proceso con TTL corto: sin red ni serialización.
+2. Framework de caché de Django (Redis con REDIS_URL): compartido entre
+   workers, TTL más largo.
+
+Hay cuatro espacios de claves: el usuario completo (`obtener_usuario`), una
+instantánea mínima para autenticar peticiones con JWT (`obtener_snapshot`,
+con un TTL más corto: acota cuánto tarda en aplicarse una desactivación), la
+proyección de lectura para las consultas por lotes (`obtener_lecturas`) y la
+versión (`updated_at`) con la que se revalidan los ETag (`obtener_version`).
+
+Los fallos concurrentes para el mismo id dentro de un proceso se agrupan en
+una sola consulta (single-flight). Las escrituras invalidan ambos niveles; el
+nivel local de *otros* procesos expira por TTL, por lo que `TTL_LOCAL` es el
+máximo tiempo que un worker puede servir un usuario desactualizado.
+
+Eso solo vale si el segundo nivel es de verdad compartido. Con locmem (sin
+REDIS_URL) cada worker tiene el suyo y una escritura no lo invalida en los
+demás: en ese caso su TTL se reduce al local y la cota sigue siendo `TTL_LOCAL`.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+
+CONFIG_POR_DEFECTO = {
+    'ACTIVA': True,
+    'MAX_ENTRADAS': 10000,
+    'TTL_LOCAL': 5,
+    'TTL_COMPARTIDO': 300,
+    'TTL_SNAPSHOT': 30,
+    'ALIAS': 'default',
+    'ESPERA_SINGLE_FLIGHT': 5,
+}
+
+
+class LRUConTTL:
+    """Diccionario LRU acotado cuyas entradas caducan a los `ttl` segundos."""
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.desalojos = 0
+
+    def obtener(self, clave):
+        """Devuelve (encontrado, valor)."""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return False, None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                self.desalojos += 1
+                return False, None
+            self._datos.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.desalojos += 1
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class _Vuelo:
+    """Carga en curso para una clave: los demás hilos esperan su resultado."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        # Excepción de la carga: los que esperan la relanzan en vez de ver un None
+        self.error = None
+
+
+class CacheUsuarios:
+
+    def __init__(self, max_entradas, ttl_local, ttl_compartido, alias, espera_single_flight, prefijo='usuario'):
+        self.prefijo = prefijo
+        self.local = LRUConTTL(max_entradas, ttl_local)
+        self.ttl_compartido = ttl_compartido
+        self.alias = alias
+        self.espera_single_flight = espera_single_flight
+        self._vuelos = {}
+        self._lock = threading.Lock()
+        self._contadores = {
+            'aciertos_local': 0,
+            'aciertos_compartida': 0,
+            'fallos': 0,
+            'consultas_agrupadas': 0,
+            'invalidaciones': 0,
+        }
+
+    def clave(self, id):
+        return f'{self.prefijo}:{id}'
+
+    @property
+    def compartida(self):
+        return caches[self.alias]
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def obtener(self, id, cargar):
+        """
+        Devuelve una copia del valor para `id`, llamando a `cargar(id)` solo si
+        no está en ningún nivel. Los `None` (no encontrado) no se guardan.
+        """
+        clave = self.clave(id)
+        encontrado, usuario = self.local.obtener(clave)
+        if encontrado:
+            self._contar('aciertos_local')
+            return copy.copy(usuario)
+
+        usuario = self.compartida.get(clave)
+        if usuario is not None:
+            self._contar('aciertos_compartida')
+            self.local.guardar(clave, usuario)
+            return copy.copy(usuario)
+
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self._contadores['fallos'] += 1
+            else:
+                self._contadores['consultas_agrupadas'] += 1
+
+        if not lider:
+            if vuelo.evento.wait(self.espera_single_flight):
+                if vuelo.error is not None:
+                    raise vuelo.error
+                return copy.copy(vuelo.valor)
+            return cargar(id)
+
+        try:
+            try:
+                vuelo.valor = cargar(id)
+            except Exception as e:
+                vuelo.error = e
+                raise
+            if vuelo.valor is not None:
+                self.local.guardar(clave, vuelo.valor)
+                self.compartida.set(clave, vuelo.valor, self.ttl_compartido)
+            return copy.copy(vuelo.valor)
+        finally:
+            vuelo.evento.set()
+            with self._lock:
+                self._vuelos.pop(clave, None)
+
+    def obtener_muchos(self, ids, cargar):
+        """
+        {id: valor} de los `ids` que existen. Busca en la LRU local, después en
+        la compartida con un solo `get_many`, y lo que falte lo pide a
+        `cargar(ids)`, que devuelve {id: valor}. Pensado para valores inmutables
+        (se devuelven sin copiar) y sin single-flight: los lotes rara vez
+        coinciden entre peticiones.
+        """
+        encontrados = {}
+        faltan = []
+        for id in ids:
+            encontrado, valor = self.local.obtener(self.clave(id))
+            if encontrado:
+                encontrados[id] = valor
+            else:
+                faltan.append(id)
+        aciertos_local = len(encontrados)
+
+        if faltan:
+            claves = {self.clave(id): id for id in faltan}
+            for clave, valor in self.compartida.get_many(list(claves)).items():
+                encontrados[claves[clave]] = valor
+                self.local.guardar(clave, valor)
+        aciertos_compartida = len(encontrados) - aciertos_local
+
+        faltan = [id for id in faltan if id not in encontrados]
+        if faltan:
+            cargados = cargar(faltan)
+            for id, valor in cargados.items():
+                encontrados[id] = valor
+                self.local.guardar(self.clave(id), valor)
+            if cargados:
+                self.compartida.set_many(
+                    {self.clave(id): valor for id, valor in cargados.items()}, self.ttl_compartido
+                )
+
+        with self._lock:
+            self._contadores['aciertos_local'] += aciertos_local
+            self._contadores['aciertos_compartida'] += aciertos_compartida
+            self._contadores['fallos'] += len(faltan)
+        return encontrados
+
+    def invalidar(self, id):
+        clave = self.clave(id)
+        self._contar('invalidaciones')
+        self.local.eliminar(clave)
+        self.compartida.delete(clave)
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+        datos['desalojos'] = self.local.desalojos
+        datos['entradas_local'] = len(self.local)
+        return datos
+
+
+_caches = {}
+_cache_lock = threading.Lock()
+
+
+def _configuracion():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_CACHE', {})}
+
+
+def es_por_proceso(alias):
+    """True si la caché de Django `alias` vive en la memoria de cada proceso (locmem)."""
+    return isinstance(caches[alias], LocMemCache)
+
+
+def obtener_cache(prefijo='usuario'):
+    """Devuelve la caché del proceso para `prefijo`, o None si está desactivada."""
+    cache = _caches.get(prefijo)
+    if cache is None:
+        with _cache_lock:
+            conf = _configuracion()
+            if prefijo not in _caches and conf['ACTIVA']:
+                if prefijo == 'snapshot':
+                    ttl_local = min(conf['TTL_LOCAL'], conf['TTL_SNAPSHOT'])
+                    ttl_compartido = conf['TTL_SNAPSHOT']
+                else:
+                    ttl_local, ttl_compartido = conf['TTL_LOCAL'], conf['TTL_COMPARTIDO']
+                if es_por_proceso(conf['ALIAS']):
+                    # Nadie más la invalida: no puede durar más que la local
+                    ttl_compartido = ttl_local
+                _caches[prefijo] = CacheUsuarios(
+                    conf['MAX_ENTRADAS'],
+                    ttl_local,
+                    ttl_compartido,
+                    conf['ALIAS'],
+                    conf['ESPERA_SINGLE_FLIGHT'],
+                    prefijo=prefijo,
+                )
+            cache = _caches.get(prefijo)
+    return cache
+
+
+def reiniciar_cache():
+    with _cache_lock:
+        _caches.clear()
+
+
+@receiver(setting_changed)
+def _reiniciar_si_cambia_config(*, setting, **kwargs):
+    if setting in ('USUARIO_CACHE', 'CACHES'):
+        reiniciar_cache()
+
+
+# --- API pública ---
+
+def obtener_usuario(id, cargar):
+    cache = obtener_cache()
+    if cache is None:
+        return cargar(id)
+    return cache.obtener(id, cargar)
+
+
+def obtener_lecturas(ids, cargar):
+    """{id: UsuarioLectura} para el lote de `ids` (`cargar(ids)` con los que falten)."""
+    cache = obtener_cache('lectura')
+    if cache is None:
+        return cargar(ids)
+    return cache.obtener_muchos(ids, cargar)
+
+
+def obtener_snapshot(id, cargar):
+    cache = obtener_cache('snapshot')
+    if cache is None:
+        return cargar(id)
+    return cache.obtener(id, cargar)
+
+
+def obtener_version(id, cargar):
+    cache = obtener_cache('version')
+    if cache is None:
+        return cargar(id)
+    return cache.obtener(id, cargar)
+
+
+def invalidar_usuario(id):
+    """
+    Invalida el usuario, su instantánea, su proyección de lectura y su versión ya y de
+    nuevo al confirmar la transacción, para que una lectura concurrente no
+    vuelva a guardar la fila anterior mientras tanto.
+    """
+    for prefijo in ('usuario', 'snapshot', 'lectura', 'version'):
+        cache = obtener_cache(prefijo)
+        if cache is None:
+            return
+        cache.invalidar(id)
+        transaction.on_commit(lambda cache=cache: cache.invalidar(id))
+
+
+def estadisticas():
+    cache = obtener_cache()
+    return cache.estadisticas() if cache is not None else {}
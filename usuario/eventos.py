@@ -0,0 +1,250 @@
+"""
+Outbox transaccional de cambios de usuarios.
+
+Las escrituras del servicio (alta, alta masiva, actualización y borrado)
+insertan un `EventoUsuario` dentro de la misma transacción que el cambio: si
+se deshace, el evento también, y si confirma, el evento queda guardado aunque
+el proceso muera justo después. Los servicios que antes recorrían el listado
+completo para enterarse de los cambios reciben estos eventos.
+
+El evento se inserta después del INSERT/UPDATE/DELETE del usuario, cuando la
+fila ya está bloqueada: dos transacciones sobre el mismo usuario obtienen sus
+`id` de evento en el orden en que confirman.
+
+`Despachador` (`python manage.py despachar_eventos`) vacía la tabla por lotes
+hacia un sink:
+
+- Entrega al menos una vez: un lote se marca como despachado solo después de
+  que el sink lo acepta. Si el proceso muere entre medias, el lote se reenvía;
+  los consumidores deduplican por el `id` del evento.
+- Orden por usuario: los lotes salen en orden de `id` y un lote rechazado se
+  reintenta entero antes de enviar nada posterior. Con varios despachadores,
+  cada uno atiende una partición de usuarios (`user_id % total`), así que los
+  eventos de un usuario siempre los envía el mismo proceso.
+"""
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Mod
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from usuario import metricas
+from usuario import proyecciones
+from usuario.models import EventoUsuario
+
+
+logger = logging.getLogger('usuario.eventos')
+
+CONFIG_POR_DEFECTO = {
+    'SINK': 'archivo',
+    'WEBHOOK_URL': '',
+    'WEBHOOK_TIMEOUT': 10,
+    'ARCHIVO': 'eventos.ndjson',
+    'LOTE': 500,
+    'ESPERA': 1,
+    'RETENCION_HORAS': 24,
+}
+
+# Ids por UPDATE ... WHERE id IN (...) al marcar un lote (límite de parámetros de SQLite)
+TAM_LOTE_IN = 500
+
+
+def obtener_config():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_EVENTOS', {})}
+
+
+# --- Escritura (dentro de la transacción del cambio) ---
+
+def registrar_creados(usuarios):
+    EventoUsuario.objects.bulk_create([
+        EventoUsuario(user_id=usuario.pk, event_type=EventoUsuario.CREADO,
+                      payload=proyecciones.desde_modelo(usuario)._asdict())
+        for usuario in usuarios
+    ])
+
+
+def registrar_actualizado(usuario):
+    EventoUsuario.objects.create(
+        user_id=usuario.pk, event_type=EventoUsuario.ACTUALIZADO, payload=proyecciones.desde_modelo(usuario)._asdict()
+    )
+
+
+def registrar_eliminado(id):
+    EventoUsuario.objects.create(user_id=id, event_type=EventoUsuario.ELIMINADO, payload={'id': id})
+
+
+# --- Sinks ---
+
+class ErrorEntrega(Exception):
+    """El sink no aceptó el lote; se reintentará entero."""
+
+
+class SinkWebhook:
+    """POST de cada lote como {"events": [...]} a `url`; cualquier 2xx lo confirma."""
+
+    def __init__(self, url, timeout=10):
+        if not url:
+            raise ValueError("El sink webhook necesita USUARIO_EVENTOS['WEBHOOK_URL']")
+        self.url = url
+        self.timeout = timeout
+
+    def enviar(self, eventos):
+        peticion = urllib.request.Request(
+            self.url,
+            data=json.dumps({'events': eventos}, ensure_ascii=False).encode(),
+            method='POST',
+            headers={
+                'Content-Type': 'application/json',
+                # El mismo lote reenviado lleva la misma clave
+                'Idempotency-Key': f"eventos-{eventos[0]['id']}-{eventos[-1]['id']}",
+            },
+        )
+        try:
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                respuesta.read()
+        except (urllib.error.URLError, OSError) as e:
+            # HTTPError (4xx/5xx) es subclase de URLError
+            raise ErrorEntrega(f'{self.url}: {e}') from e
+
+
+class SinkArchivo:
+    """Añade cada evento como una línea JSON a `ruta` y hace fsync antes de confirmar."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def enviar(self, eventos):
+        lineas = ''.join(json.dumps(evento, ensure_ascii=False) + '\n' for evento in eventos)
+        try:
+            with open(self.ruta, 'a', encoding='utf-8') as archivo:
+                archivo.write(lineas)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+        except OSError as e:
+            raise ErrorEntrega(f'{self.ruta}: {e}') from e
+
+
+class SinkMemoria:
+    """Guarda los eventos en `entregados`; `fallos` lotes seguidos se rechazan antes (tests)."""
+
+    def __init__(self, fallos=0):
+        self.entregados = []
+        self.fallos = fallos
+
+    def enviar(self, eventos):
+        if self.fallos:
+            self.fallos -= 1
+            raise ErrorEntrega('fallo simulado')
+        self.entregados.extend(eventos)
+
+
+def crear_sink(nombre=None):
+    """Sink por nombre ('webhook', 'archivo', 'memoria') o ruta de una clase sin argumentos."""
+    conf = obtener_config()
+    nombre = nombre or conf['SINK']
+    if nombre == 'webhook':
+        return SinkWebhook(conf['WEBHOOK_URL'], conf['WEBHOOK_TIMEOUT'])
+    if nombre == 'archivo':
+        return SinkArchivo(conf['ARCHIVO'])
+    if nombre == 'memoria':
+        return SinkMemoria()
+    return import_string(nombre)()
+
+
+# --- Despacho ---
+
+def a_dict(fila):
+    """Forma en que sale cada evento hacia el sink."""
+    return {
+        'id': fila['id'],
+        'type': fila['event_type'],
+        'user_id': fila['user_id'],
+        'data': fila['payload'],
+        'created_at': fila['created_at'].isoformat(),
+    }
+
+
+class Despachador:
+
+    def __init__(self, sink, lote=500, particion=0, particiones=1):
+        self.sink = sink
+        self.lote = lote
+        self.particion = particion
+        self.particiones = particiones
+        self.totales = {'lotes': 0, 'eventos': 0, 'fallos': 0, 'segundos_envio': 0.0, 'retraso_max_s': 0.0}
+
+    def pendientes(self):
+        eventos = EventoUsuario.objects.pendientes()
+        if self.particiones > 1:
+            eventos = eventos.alias(particion=Mod('user_id', self.particiones)).filter(particion=self.particion)
+        return eventos
+
+    def despachar_lote(self):
+        """
+        Envía los siguientes `lote` eventos pendientes y los marca como
+        despachados. Devuelve cuántos salieron (0 si no había). Si el sink
+        falla, suma un intento a cada evento y relanza ErrorEntrega sin marcar nada.
+        """
+        filas = list(
+            self.pendientes().order_by('id').values('id', 'user_id', 'event_type', 'payload', 'created_at')[:self.lote]
+        )
+        if not filas:
+            return 0
+        ids = [fila['id'] for fila in filas]
+
+        inicio = time.perf_counter()
+        try:
+            self.sink.enviar([a_dict(fila) for fila in filas])
+        except ErrorEntrega:
+            self.totales['fallos'] += 1
+            metricas.eventos_fallos.inc()
+            for desde in range(0, len(ids), TAM_LOTE_IN):
+                EventoUsuario.objects.filter(pk__in=ids[desde:desde + TAM_LOTE_IN]).update(attempts=F('attempts') + 1)
+            raise
+        envio = time.perf_counter() - inicio
+
+        ahora = timezone.now()
+        for desde in range(0, len(ids), TAM_LOTE_IN):
+            EventoUsuario.objects.filter(pk__in=ids[desde:desde + TAM_LOTE_IN]).update(dispatched_at=ahora)
+
+        retrasos = [(ahora - fila['created_at']).total_seconds() for fila in filas]
+        for tipo, cantidad in Counter(fila['event_type'] for fila in filas).items():
+            metricas.eventos_despachados.labels(tipo).inc(cantidad)
+        for retraso in retrasos:
+            metricas.eventos_retraso.observe(retraso)
+        metricas.eventos_envio_duracion.observe(envio)
+
+        self.totales['lotes'] += 1
+        self.totales['eventos'] += len(filas)
+        self.totales['segundos_envio'] += envio
+        self.totales['retraso_max_s'] = max(self.totales['retraso_max_s'], max(retrasos))
+        campos = {
+            'evento': 'lote_despachado',
+            'eventos': len(filas),
+            'desde_id': ids[0],
+            'hasta_id': ids[-1],
+            'envio_ms': round(envio * 1000, 1),
+            'eventos_s': round(len(filas) / envio) if envio else None,
+            'retraso_max_ms': round(max(retrasos) * 1000, 1),
+        }
+        logger.info(' '.join(f'{clave}={valor}' for clave, valor in campos.items()), extra={'eventos': campos})
+        return len(filas)
+
+    def purgar_despachados(self, horas):
+        """Borra por lotes los eventos entregados hace más de `horas`; devuelve cuántos."""
+        limite = timezone.now() - timedelta(hours=horas)
+        total = 0
+        while True:
+            ids = list(EventoUsuario.objects.despachados_antes_de(limite).values_list('id', flat=True)[:TAM_LOTE_IN])
+            if not ids:
+                return total
+            total += EventoUsuario.objects.filter(pk__in=ids).delete()[0]
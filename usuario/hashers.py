@@ -0,0 +1,19 @@
+"""
+Hasher PBKDF2 con iteraciones calibradas para el nodo.
+
+Mismo algoritmo que el PBKDF2 de Django (`pbkdf2_sha256`), así que los hashes
+existentes se siguen verificando; solo cambian las iteraciones de los nuevos.
+El valor sale de `settings.PBKDF2_ITERACIONES`, que escribe
+`manage.py calibrar_hasher`. Si no está definido se usa el de Django.
+Como `must_update` compara iteraciones, los hashes antiguos se recalculan en
+el siguiente login correcto.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class PBKDF2CalibradoHasher(PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PBKDF2_ITERACIONES', None) or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,293 @@
+"""
+Pool de procesos dedicado al hashing de contraseñas (PBKDF2).
+
+El hash se ejecuta fuera del worker de gunicorn, en un ProcessPoolExecutor de
+tamaño configurable. La cola es acotada: si ya hay `WORKERS + MAX_COLA`
+operaciones en vuelo, la nueva petición se rechaza con `PoolHashSaturado`
+en lugar de quedarse esperando (las vistas lo traducen a un 503 con
+`Retry-After`).
+
+Con `WORKERS = 0` el hash se calcula en el mismo proceso (útil en tests),
+pero se sigue aplicando el control de admisión.
+"""
+import asyncio
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from usuario import metricas
+from usuario import timing
+
+
+CONFIG_POR_DEFECTO = {
+    'WORKERS': 2,
+    'MAX_COLA': 16,
+    'RETRY_AFTER': 1,
+}
+
+
+class PoolHashSaturado(Exception):
+    """La cola del pool de hashing está llena: el cliente debe reintentar."""
+
+    def __init__(self, retry_after):
+        super().__init__("Servicio saturado, intente nuevamente en unos segundos.")
+        self.retry_after = retry_after
+
+
+# --- Funciones que corren dentro de los procesos del pool ---
+# Devuelven (resultado, duración) para poder separar tiempo de espera y de cómputo.
+
+def _inicializar_worker():
+    # Con 'fork' el hijo hereda los manejadores de señales del worker de gunicorn
+    # (uvicorn ignora SIGTERM en el hijo): sin esto el hijo sobrevive al apagado.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Con el método de arranque 'spawn' el proceso hijo no hereda Django configurado.
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+
+def _hash_en_worker(password):
+    inicio = time.perf_counter()
+    encoded = make_password(password)
+    return encoded, time.perf_counter() - inicio
+
+
+def _verificar_en_worker(password, encoded):
+    inicio = time.perf_counter()
+    valido = check_password(password, encoded)
+    return valido, time.perf_counter() - inicio
+
+
+def _verificar_y_rehashear_en_worker(password, encoded):
+    # Si el hash usa parámetros antiguos (otro hasher u otras iteraciones),
+    # check_password llama al setter y se calcula aquí mismo el nuevo hash.
+    inicio = time.perf_counter()
+    nuevo = []
+    valido = check_password(password, encoded, setter=nuevo.append)
+    rehash = make_password(nuevo[0]) if valido and nuevo else None
+    return (valido, rehash), time.perf_counter() - inicio
+
+
+def _calentar_en_worker():
+    get_hasher('default')
+
+
+class PoolHash:
+
+    def __init__(self, workers, max_cola, retry_after):
+        self.workers = workers
+        self.capacidad = max(workers, 1) + max_cola
+        self.retry_after = retry_after
+        self._permisos = threading.BoundedSemaphore(self.capacidad)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._en_vuelo = 0
+        self._contadores = {
+            'enviadas': 0,
+            'completadas': 0,
+            'rechazadas': 0,
+            'profundidad_maxima': 0,
+            'espera_total_s': 0.0,
+            'espera_maxima_s': 0.0,
+            'hash_total_s': 0.0,
+        }
+
+    def _obtener_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=_inicializar_worker,
+                    )
+        return self._executor
+
+    def _admitir(self, bloquear):
+        if not self._permisos.acquire(blocking=bloquear):
+            with self._lock:
+                self._contadores['rechazadas'] += 1
+            raise PoolHashSaturado(self.retry_after)
+        with self._lock:
+            self._en_vuelo += 1
+            self._contadores['enviadas'] += 1
+            if self._en_vuelo > self._contadores['profundidad_maxima']:
+                self._contadores['profundidad_maxima'] = self._en_vuelo
+        return time.perf_counter()
+
+    def _finalizar(self, encolada, duracion):
+        espera = max(time.perf_counter() - encolada - duracion, 0.0)
+        with self._lock:
+            self._en_vuelo -= 1
+            self._contadores['completadas'] += 1
+            self._contadores['espera_total_s'] += espera
+            self._contadores['hash_total_s'] += duracion
+            if espera > self._contadores['espera_maxima_s']:
+                self._contadores['espera_maxima_s'] = espera
+        self._permisos.release()
+        metricas.hash_espera.observe(espera)
+        if duracion:
+            metricas.hash_duracion.observe(duracion)
+
+    def _enviar(self, funcion, *args):
+        try:
+            return self._obtener_executor().submit(funcion, *args)
+        except BrokenProcessPool:
+            # Un proceso hijo murió: el siguiente intento crea un pool nuevo.
+            self._executor = None
+            raise
+
+    def ejecutar(self, funcion, *args, bloquear=False):
+        """
+        Ejecuta `funcion(*args)` en el pool. Con `bloquear=False` (peticiones
+        interactivas) se rechaza de inmediato si la cola está llena.
+        """
+        encolada = self._admitir(bloquear)
+        duracion = 0.0
+        try:
+            with timing.medir('hash'):
+                if self.workers:
+                    resultado, duracion = self._enviar(funcion, *args).result()
+                else:
+                    resultado, duracion = funcion(*args)
+            return resultado
+        finally:
+            self._finalizar(encolada, duracion)
+
+    async def aejecutar(self, funcion, *args):
+        """
+        Versión asíncrona de `ejecutar` para las vistas ASGI: espera el resultado
+        sin bloquear el bucle de eventos y nunca encola si el pool está lleno.
+        """
+        encolada = self._admitir(bloquear=False)
+        duracion = 0.0
+        try:
+            with timing.medir('hash'):
+                if self.workers:
+                    resultado, duracion = await asyncio.wrap_future(self._enviar(funcion, *args))
+                else:
+                    # Sin procesos (tests): en un hilo, fuera del bucle de eventos.
+                    resultado, duracion = await asyncio.to_thread(funcion, *args)
+            return resultado
+        finally:
+            self._finalizar(encolada, duracion)
+
+    def ejecutar_lote(self, funcion, argumentos):
+        """
+        Ejecuta `funcion` para cada tupla de `argumentos` en paralelo y devuelve
+        los resultados en orden. Pensado para trabajo en lote: espera en vez de
+        rechazar y nunca ocupa más de `workers` plazas, de modo que el resto de
+        la cola sigue disponible para login y registro.
+        """
+        if not self.workers:
+            return [self.ejecutar(funcion, *args, bloquear=True) for args in argumentos]
+
+        limite = threading.Semaphore(self.workers)
+        futuros = []
+        for args in argumentos:
+            limite.acquire()
+            encolada = self._admitir(bloquear=True)
+            try:
+                futuro = self._enviar(funcion, *args)
+            except BaseException:
+                self._finalizar(encolada, 0.0)
+                limite.release()
+                raise
+
+            def _al_terminar(f, encolada=encolada):
+                duracion = 0.0 if f.cancelled() or f.exception() else f.result()[1]
+                self._finalizar(encolada, duracion)
+                limite.release()
+
+            futuro.add_done_callback(_al_terminar)
+            futuros.append(futuro)
+        return [futuro.result()[0] for futuro in futuros]
+
+    def calentar(self):
+        """Arranca los procesos del pool antes de la primera petición (usuario/arranque.py)."""
+        if self.workers:
+            executor = self._obtener_executor()
+            for futuro in [executor.submit(_calentar_en_worker) for _ in range(self.workers)]:
+                futuro.result()
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+            datos['profundidad_cola'] = self._en_vuelo
+        datos['workers'] = self.workers
+        datos['capacidad'] = self.capacidad
+        return datos
+
+    def cerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                conf = {**CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_HASH_POOL', {})}
+                _pool = PoolHash(conf['WORKERS'], conf['MAX_COLA'], conf['RETRY_AFTER'])
+    return _pool
+
+
+def reiniciar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.cerrar()
+        _pool = None
+
+
+@receiver(setting_changed)
+def _reiniciar_si_cambia_config(*, setting, **kwargs):
+    if setting == 'USUARIO_HASH_POOL':
+        reiniciar_pool()
+
+
+# --- API pública ---
+
+def hashear(password, bloquear=False):
+    return obtener_pool().ejecutar(_hash_en_worker, password, bloquear=bloquear)
+
+
+def verificar(password, encoded, bloquear=False):
+    return obtener_pool().ejecutar(_verificar_en_worker, password, encoded, bloquear=bloquear)
+
+
+def verificar_y_rehashear(password, encoded, bloquear=False):
+    """Devuelve (válida, hash_nuevo_o_None) en un solo paso por el pool."""
+    return obtener_pool().ejecutar(_verificar_y_rehashear_en_worker, password, encoded, bloquear=bloquear)
+
+
+async def ahashear(password):
+    return await obtener_pool().aejecutar(_hash_en_worker, password)
+
+
+async def averificar_y_rehashear(password, encoded):
+    return await obtener_pool().aejecutar(_verificar_y_rehashear_en_worker, password, encoded)
+
+
+def hashear_lote(passwords, pool=None):
+    """Hashes de `passwords` en orden; `pool` permite usar uno propio (importación masiva)."""
+    return (pool or obtener_pool()).ejecutar_lote(_hash_en_worker, [(password,) for password in passwords])
+
+
+def estadisticas():
+    return obtener_pool().estadisticas()
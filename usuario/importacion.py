@@ -0,0 +1,162 @@
+"""
+Importación masiva de usuarios desde CSV (manage.py importar_usuarios).
+
+Cada fila se valida y normaliza como en `UsuarioManager.create_user` (email
+obligatorio y con el dominio en minúsculas) y además se comprueban el formato
+del email y las longitudes de las columnas, para que una fila mala no haga
+fallar el lote entero. La contraseña llega en claro (`password`, se hashea en
+un pool de procesos) o ya hasheada en formato de Django (`password_hash`, se
+guarda tal cual si el algoritmo es uno de PASSWORD_HASHERS; los hashes
+antiguos se actualizan en el siguiente login).
+
+Los lotes se insertan con `UsuarioRepository.importar_lote` (COPY en
+PostgreSQL). Los emails y DNI repetidos dentro de un lote se descartan aquí;
+los que ya existen en la BD (incluidas filas de lotes anteriores del mismo
+archivo) los descarta la propia inserción.
+"""
+from collections import namedtuple
+
+from django.contrib.auth.hashers import identify_hasher
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from usuario import hashing
+from usuario.models import Usuario, normalizar_email
+from usuario.repositories import TAM_LOTE_IN, UsuarioRepository
+from usuario.services import MENSAJE_DNI_DUPLICADO, MENSAJE_EMAIL_DUPLICADO
+
+
+COLUMNAS_OBLIGATORIAS = ('email', 'username', 'dni')
+COLUMNAS_REPORTE = ('linea', 'email', 'dni', 'motivo')
+VALORES_VERDADEROS = {'1', 'true', 't', 'yes', 'y', 'si', 'sí'}
+
+MENSAJE_SIN_PASSWORD = "Falta password o password_hash."
+MENSAJE_HASH_DESCONOCIDO = "password_hash no tiene un algoritmo conocido."
+MENSAJE_EMAIL_INVALIDO = "El email no es válido."
+
+Rechazo = namedtuple('Rechazo', COLUMNAS_REPORTE)
+
+
+def _longitud(campo):
+    return Usuario._meta.get_field(campo).max_length
+
+
+def comprobar_cabecera(columnas):
+    """ValueError si faltan columnas obligatorias o de contraseña."""
+    faltan = [columna for columna in COLUMNAS_OBLIGATORIAS if columna not in columnas]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+    if 'password' not in columnas and 'password_hash' not in columnas:
+        raise ValueError("El CSV necesita una columna password o password_hash")
+
+
+def normalizar_fila(fila):
+    """
+    dict con email, username, dni, is_active y `password` (en claro) o
+    `password_hash`. ValueError con el motivo si la fila no es válida.
+    """
+    email = (fila.get('email') or '').strip()
+    if not email:
+        raise ValueError("El usuario debe tener un email")
+    email = Usuario.objects.normalize_email(email)
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError(MENSAJE_EMAIL_INVALIDO)
+
+    datos = {
+        'email': email,
+        'username': (fila.get('username') or '').strip(),
+        'dni': (fila.get('dni') or '').strip(),
+        'is_active': (fila.get('is_active') or 'true').strip().lower() in VALORES_VERDADEROS,
+        'password': fila.get('password') or None,
+        'password_hash': (fila.get('password_hash') or '').strip() or None,
+    }
+    for campo in ('email', 'username', 'dni'):
+        if not datos[campo]:
+            raise ValueError(f"Falta {campo}.")
+        if len(datos[campo]) > _longitud(campo):
+            raise ValueError(f"{campo} supera {_longitud(campo)} caracteres.")
+    if datos['password_hash']:
+        try:
+            identify_hasher(datos['password_hash'])
+        except ValueError:
+            raise ValueError(MENSAJE_HASH_DESCONOCIDO)
+    elif not datos['password']:
+        raise ValueError(MENSAJE_SIN_PASSWORD)
+    return datos
+
+
+class Importador:
+    """
+    Procesa lotes de filas ya leídas y acumula los totales. `pool` es el
+    hashing.PoolHash de la importación; `con_eventos=False` no escribe eventos
+    'created' (carga inicial: los consumidores toman una exportación).
+    """
+
+    def __init__(self, pool, con_eventos=True):
+        self.pool = pool
+        self.con_eventos = con_eventos
+        self.totales = {'leidas': 0, 'insertadas': 0, 'duplicadas': 0, 'invalidas': 0, 'hasheadas': 0}
+
+    def procesar_lote(self, filas):
+        """`filas`: [(línea, dict)]. Devuelve la lista de Rechazo del lote."""
+        rechazos, validas = [], []
+        emails, dnis = set(), set()
+        for linea, fila in filas:
+            try:
+                datos = normalizar_fila(fila)
+            except ValueError as e:
+                rechazos.append(Rechazo(linea, fila.get('email'), fila.get('dni'), str(e)))
+                continue
+            email = normalizar_email(datos['email'])
+            if email in emails:
+                rechazos.append(Rechazo(linea, datos['email'], datos['dni'], MENSAJE_EMAIL_DUPLICADO))
+            elif datos['dni'] in dnis:
+                rechazos.append(Rechazo(linea, datos['email'], datos['dni'], MENSAJE_DNI_DUPLICADO))
+            else:
+                emails.add(email)
+                dnis.add(datos['dni'])
+                validas.append((linea, datos))
+        invalidas = sum(rechazo.motivo not in (MENSAJE_EMAIL_DUPLICADO, MENSAJE_DNI_DUPLICADO) for rechazo in rechazos)
+
+        en_claro = [datos['password'] for _, datos in validas if not datos['password_hash']]
+        hashes = iter(hashing.hashear_lote(en_claro, self.pool))
+        usuarios = [
+            Usuario(
+                email=datos['email'],
+                username=datos['username'],
+                dni=datos['dni'],
+                is_active=datos['is_active'],
+                password=datos['password_hash'] or next(hashes),
+            )
+            for _, datos in validas
+        ]
+        insertados = {id(usuario) for usuario in UsuarioRepository.importar_lote(usuarios, self.con_eventos)}
+
+        descartados = [(linea, usuario) for (linea, _), usuario in zip(validas, usuarios) if id(usuario) not in insertados]
+        rechazos.extend(self._motivos_duplicados(descartados))
+        rechazos.sort()
+
+        self.totales['leidas'] += len(filas)
+        self.totales['insertadas'] += len(insertados)
+        self.totales['duplicadas'] += len(rechazos) - invalidas
+        self.totales['invalidas'] += invalidas
+        self.totales['hasheadas'] += len(en_claro)
+        return rechazos
+
+    @staticmethod
+    def _motivos_duplicados(descartados):
+        # Solo para las filas que chocaron con la BD: suelen ser pocas
+        emails_usados = set()
+        for inicio in range(0, len(descartados), TAM_LOTE_IN):
+            emails_usados.update(normalizar_email(email) for email in Usuario.todos.por_emails(
+                [usuario.email for _, usuario in descartados[inicio:inicio + TAM_LOTE_IN]]
+            ).values_list('email', flat=True))
+        return [
+            Rechazo(
+                linea, usuario.email, usuario.dni,
+                MENSAJE_EMAIL_DUPLICADO if normalizar_email(usuario.email) in emails_usados else MENSAJE_DNI_DUPLICADO,
+            )
+            for linea, usuario in descartados
+        ]
@@ -0,0 +1,114 @@
+"""
+Benchmark de credential stuffing: CPU de hashing por segundo con y sin el
+límite de intentos fallidos (LOGIN_THROTTLE).
+
+    python manage.py bench_ataque_login --duracion 10 --hilos 4 --ips 20
+
+Crea cuentas víctima con un hash precalculado, lanza intentos con contraseñas
+erróneas desde `--ips` direcciones y al final borra las cuentas. La salida es
+JSON con los intentos, rechazos y segundos de PBKDF2 por segundo de reloj.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from usuario import hashing
+from usuario.hashing import PoolHashSaturado
+from usuario.models import Usuario
+from usuario.services import UsuarioService
+from usuario.throttling import LoginBloqueado
+
+
+class Command(BaseCommand):
+    help = "Mide la CPU de hashing por segundo durante un ataque de login simulado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duracion', type=float, default=10.0, help='Segundos por escenario.')
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos atacantes concurrentes.')
+        parser.add_argument('--ips', type=int, default=20, help='Direcciones IP de origen simuladas.')
+        parser.add_argument('--cuentas', type=int, default=10, help='Cuentas víctima.')
+        parser.add_argument('--max-fallos-email', type=int, help='Sobrescribe LOGIN_THROTTLE[MAX_FALLOS_EMAIL].')
+        parser.add_argument('--max-fallos-ip', type=int, help='Sobrescribe LOGIN_THROTTLE[MAX_FALLOS_IP].')
+
+    def handle(self, *args, **opciones):
+        ejecucion = uuid.uuid4().hex[:8]
+        prefijo = f'bench-ataque-{ejecucion}-'
+        password = make_password('password-correcto')
+        Usuario.objects.bulk_create([
+            Usuario(email=f'{prefijo}{i}@example.invalid', username=f'Victima {i}', dni=f'A{ejecucion}{i}', password=password)
+            for i in range(opciones['cuentas'])
+        ])
+        emails = [f'{prefijo}{i}@example.invalid' for i in range(opciones['cuentas'])]
+        # Rango 198.18.0.0/15 (benchmarks) con un tercer octeto por ejecución para no
+        # heredar contadores de ejecuciones anteriores.
+        octeto = random.randint(0, 255)
+        ips = [f'198.18.{octeto}.{i % 256}' for i in range(opciones['ips'])]
+
+        resultados = {}
+        try:
+            for escenario, activo in (('sin_limite', False), ('con_limite', True)):
+                conf = {**getattr(settings, 'LOGIN_THROTTLE', {}), 'ACTIVO': activo}
+                if opciones['max_fallos_email'] is not None:
+                    conf['MAX_FALLOS_EMAIL'] = opciones['max_fallos_email']
+                if opciones['max_fallos_ip'] is not None:
+                    conf['MAX_FALLOS_IP'] = opciones['max_fallos_ip']
+                with override_settings(LOGIN_THROTTLE=conf):
+                    resultados[escenario] = self._atacar(emails, ips, opciones['duracion'], opciones['hilos'])
+        finally:
+            Usuario.objects.filter(email__startswith=prefijo).delete()
+
+        self.stdout.write(json.dumps(resultados, indent=2))
+
+    def _atacar(self, emails, ips, duracion, hilos):
+        contadores = {'intentos': 0, 'rechazados': 0, 'saturados': 0}
+        lock = threading.Lock()
+        fin = time.monotonic() + duracion
+
+        def atacante():
+            try:
+                while time.monotonic() < fin:
+                    resultado = 'intentos'
+                    try:
+                        UsuarioService.autenticar_usuario(random.choice(emails), 'password-erroneo', ip=random.choice(ips))
+                    except LoginBloqueado:
+                        resultado = 'rechazados'
+                    except PoolHashSaturado:
+                        resultado = 'saturados'
+                    except ValueError:
+                        pass
+                    with lock:
+                        contadores['intentos'] += 1
+                        if resultado != 'intentos':
+                            contadores[resultado] += 1
+            finally:
+                connection.close()
+
+        hilos_atacantes = [threading.Thread(target=atacante) for _ in range(hilos)]
+        cpu_por_segundo = []
+        cpu_inicial = cpu_anterior = hashing.estadisticas()['hash_total_s']
+        for hilo in hilos_atacantes:
+            hilo.start()
+        while time.monotonic() < fin:
+            time.sleep(1)
+            cpu_actual = hashing.estadisticas()['hash_total_s']
+            cpu_por_segundo.append(round(cpu_actual - cpu_anterior, 4))
+            cpu_anterior = cpu_actual
+        for hilo in hilos_atacantes:
+            hilo.join()
+
+        # Los hashes se contabilizan al terminar: los que seguían en vuelo al acabar
+        # el escenario solo suman al total, no a la serie por segundo.
+        return {
+            **contadores,
+            'hash_cpu_s_por_segundo': cpu_por_segundo,
+            'hash_cpu_s_medio': round(sum(cpu_por_segundo) / max(len(cpu_por_segundo), 1), 4),
+            'hash_cpu_s_total': round(hashing.estadisticas()['hash_total_s'] - cpu_inicial, 4),
+        }
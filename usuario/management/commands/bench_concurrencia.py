@@ -0,0 +1,221 @@
+"""
+Compara el servidor en modo síncrono (gunicorn, servicio_usuario.wsgi) y
+asíncrono (gunicorn con workers uvicorn, servicio_usuario.asgi y las vistas
+asíncronas) con cientos de conexiones concurrentes.
+
+    python manage.py bench_concurrencia --conexiones 500 --duracion 15 --workers 4
+    DB_ENGINE=sqlite python manage.py bench_concurrencia --escenario register
+
+Genera usuarios sintéticos, arranca gunicorn en cada modo en un puerto local
+con servicio_usuario/gunicorn_conf.py, como en producción (hereda el entorno:
+base de datos, HASH_POOL_*, PBKDF2_ITERACIONES...) y lo satura durante
+`--duracion` segundos con `--conexiones` clientes asyncio, una conexión
+HTTP/1.1 por petición. La salida es JSON con req/s, latencias y respuestas
+por código de estado de cada modo; los 503 son rechazos del pool de hashing,
+no errores del servidor.
+"""
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from usuario.management.commands.bench_usuario import PASSWORD_BENCH, commit_actual, dni_bench, generar_usuarios, percentil
+from usuario.models import Usuario
+
+
+# La aplicación y la clase de worker las elige servicio_usuario/gunicorn_conf.py
+MODOS = ('wsgi', 'asgi')
+
+
+def arrancar_servidor(modo, puerto, workers):
+    try:
+        socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+    except OSError:
+        pass
+    else:
+        raise CommandError(f"El puerto {puerto} ya está en uso")
+    entorno = {**os.environ, 'MODO_SERVIDOR': modo}
+    proceso = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn',
+            '-c', 'python:servicio_usuario.gunicorn_conf',
+            '--bind', f'127.0.0.1:{puerto}',
+            '--workers', str(workers),
+            '--backlog', '4096',
+            '--timeout', '120',
+        ],
+        cwd=settings.BASE_DIR,
+        env=entorno,
+        start_new_session=True,  # Para terminar también los workers (ver parar_servidor)
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise CommandError(f"gunicorn ({modo}) terminó al arrancar con código {proceso.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+            return proceso
+        except OSError:
+            time.sleep(0.2)
+    parar_servidor(proceso)
+    raise CommandError(f"gunicorn ({modo}) no aceptó conexiones en 30 s")
+
+
+def parar_servidor(proceso):
+    # Señal al grupo de procesos: si el master muere antes que sus workers, estos
+    # seguirían escuchando en el puerto y atenderían el siguiente modo.
+    os.killpg(proceso.pid, signal.SIGTERM)
+    try:
+        proceso.wait(15)
+    except subprocess.TimeoutExpired:
+        os.killpg(proceso.pid, signal.SIGKILL)
+        proceso.wait()
+
+
+def peticion_http(ruta, datos, puerto):
+    cuerpo = json.dumps(datos).encode()
+    return (
+        f'POST {ruta} HTTP/1.1\r\n'
+        f'Host: 127.0.0.1:{puerto}\r\n'
+        'Content-Type: application/json\r\n'
+        f'Content-Length: {len(cuerpo)}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode() + cuerpo
+
+
+async def enviar(puerto, peticion, timeout):
+    """Envía una petición en una conexión nueva y devuelve el código de estado."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', puerto), timeout)
+    try:
+        writer.write(peticion)
+        await writer.drain()
+        return await asyncio.wait_for(leer_respuesta(reader), timeout)
+    finally:
+        writer.close()
+
+
+async def leer_respuesta(reader):
+    # No basta con leer hasta EOF: uvicorn no siempre cierra tras `Connection: close`.
+    estado = int((await reader.readline()).split()[1])
+    longitud = None
+    while True:
+        linea = await reader.readline()
+        if linea in (b'\r\n', b''):
+            break
+        nombre, _, valor = linea.partition(b':')
+        if nombre.strip().lower() == b'content-length':
+            longitud = int(valor)
+    if longitud is None:
+        await reader.read()
+    else:
+        await reader.readexactly(longitud)
+    return estado
+
+
+async def cargar(puerto, generar_peticion, conexiones, duracion, timeout):
+    latencias, estados = [], {}
+    fin = time.monotonic() + duracion
+
+    async def cliente():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                estado = str(await enviar(puerto, generar_peticion(), timeout))
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, IndexError, ValueError):
+                estado = 'error_conexion'
+            latencias.append(time.perf_counter() - inicio)
+            estados[estado] = estados.get(estado, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(conexiones)))
+    total = time.perf_counter() - inicio
+
+    latencias.sort()
+    correctas = sum(n for estado, n in estados.items() if estado.startswith('2'))
+    return {
+        'peticiones': len(latencias),
+        'por_estado': dict(sorted(estados.items())),
+        'duracion_s': round(total, 3),
+        'req_s': round(len(latencias) / total, 2),
+        'correctas_s': round(correctas / total, 2),
+        'p50_ms': percentil(latencias, 50),
+        'p95_ms': percentil(latencias, 95),
+        'p99_ms': percentil(latencias, 99),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compara los modos WSGI y ASGI con muchas conexiones concurrentes; salida en JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conexiones', type=int, default=500, help='Clientes concurrentes.')
+        parser.add_argument('--duracion', type=float, default=15.0, help='Segundos de carga por modo.')
+        parser.add_argument('--workers', type=int, default=2, help='Workers de gunicorn.')
+        parser.add_argument('--usuarios', type=int, default=1000, help='Usuarios sintéticos para el login.')
+        parser.add_argument('--escenario', choices=('login', 'register'), default='login')
+        parser.add_argument('--modos', default=','.join(MODOS), help='Lista separada por comas.')
+        parser.add_argument('--puerto', type=int, default=8765)
+        parser.add_argument('--timeout', type=float, default=60.0, help='Segundos máximos por petición.')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, stdout).')
+
+    def handle(self, *args, **opciones):
+        modos = [m for m in opciones['modos'].split(',') if m]
+        desconocidos = set(modos) - set(MODOS)
+        if desconocidos:
+            raise CommandError(f"Modos desconocidos: {', '.join(sorted(desconocidos))}")
+
+        prefijo = f'bench-{uuid.uuid4().hex[:8]}-'
+        generar_usuarios(prefijo, opciones['usuarios'])
+        connection.close()  # El servidor usa sus propias conexiones (y SQLite no admite dos escritores)
+        puerto = opciones['puerto']
+        contador = iter(range(10 ** 9))
+
+        def generar_peticion():
+            if opciones['escenario'] == 'login':
+                email = f'{prefijo}{random.randrange(opciones["usuarios"])}@example.invalid'
+                return peticion_http('/api/login/', {'email': email, 'password': PASSWORD_BENCH}, puerto)
+            i = next(contador)
+            return peticion_http('/api/register/', {
+                'email': f'{prefijo}reg-{i}@example.invalid',
+                'username': f'Registro {i}',
+                'dni': dni_bench(prefijo, i, 'R'),
+                'password': PASSWORD_BENCH,
+            }, puerto)
+
+        informe = {
+            'commit': commit_actual(),
+            'bd': connection.vendor,
+            'escenario': opciones['escenario'],
+            'conexiones': opciones['conexiones'],
+            'workers': opciones['workers'],
+            'modos': {},
+        }
+        try:
+            for modo in modos:
+                proceso = arrancar_servidor(modo, puerto, opciones['workers'])
+                try:
+                    informe['modos'][modo] = asyncio.run(cargar(
+                        puerto, generar_peticion, opciones['conexiones'], opciones['duracion'], opciones['timeout']
+                    ))
+                finally:
+                    parar_servidor(proceso)
+        finally:
+            Usuario.objects.filter(email__startswith=prefijo).delete()
+
+        salida = json.dumps(informe, indent=2)
+        if opciones['salida']:
+            with open(opciones['salida'], 'w') as archivo:
+                archivo.write(salida)
+        self.stdout.write(salida)
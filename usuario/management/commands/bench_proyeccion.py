@@ -0,0 +1,83 @@
+"""
+Micro-benchmark de la ruta de lectura: UsuarioSerializer frente a la proyección.
+
+    python manage.py bench_proyeccion --filas 20000
+
+Genera `--filas` usuarios y mide, para cada método, la consulta más la
+codificación a JSON de todas las filas: objetos por segundo (mejor de
+`--repeticiones`) y bytes asignados por fila (pico de tracemalloc). Comprueba
+además que todos producen el mismo JSON. Al terminar borra los usuarios.
+"""
+import json
+import time
+import tracemalloc
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from usuario import proyecciones
+from usuario.management.commands.bench_usuario import commit_actual, generar_usuarios
+from usuario.models import Usuario
+from usuario.proyecciones import CAMPOS_LECTURA
+from usuario.serializers import UsuarioSerializer
+
+
+def metodos(usuarios):
+    """Funciones que devuelven el JSON (bytes) de `usuarios` por cada vía."""
+    return {
+        # .all(): un QuerySet nuevo cada vez, sin la caché de resultados de la anterior
+        'serializer': lambda: JSONRenderer().render(UsuarioSerializer(usuarios.all(), many=True).data),
+        'values_dict': lambda: json.dumps(
+            list(usuarios.values(*CAMPOS_LECTURA)), ensure_ascii=False, separators=(',', ':')
+        ).encode(),
+        'proyeccion': lambda: proyecciones.lista_a_json(
+            proyecciones.desde_filas(usuarios.values_list(*CAMPOS_LECTURA))
+        ).encode(),
+    }
+
+
+def medir(funcion, filas, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, {
+        'objetos_s': round(filas / mejor),
+        'us_por_fila': round(mejor / filas * 1e6, 2),
+        'bytes_por_fila': round(pico / filas),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compara UsuarioSerializer con la proyección de lectura; salida en JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=10000, help='Usuarios a generar y codificar.')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Se informa la más rápida.')
+
+    def handle(self, *args, **opciones):
+        prefijo = f'bench-{uuid.uuid4().hex[:8]}-'
+        generar_usuarios(prefijo, opciones['filas'])
+        usuarios = Usuario.objects.filter(email__startswith=prefijo).order_by('id')
+        informe = {'commit': commit_actual(), 'filas': opciones['filas'], 'metodos': {}}
+        try:
+            salidas = {}
+            for nombre, funcion in metodos(usuarios).items():
+                salidas[nombre], informe['metodos'][nombre] = medir(
+                    funcion, opciones['filas'], opciones['repeticiones']
+                )
+            informe['mismo_json'] = len(set(salidas.values())) == 1
+        finally:
+            Usuario.objects.filter(email__startswith=prefijo).delete()
+
+        self.stdout.write(json.dumps(informe, indent=2))
@@ -0,0 +1,117 @@
+"""
+Mide el filtro de Bloom de tokens revocados y el coste del refresco con rotación.
+
+    python manage.py bench_revocacion --revocados 100000 --consultas 200000
+    DB_ENGINE=sqlite python manage.py bench_revocacion --refrescos 500
+
+1. Filtro: lo llena con `--revocados` jti aleatorios (dimensionado según
+   USUARIO_REVOCACION) y consulta `--consultas` jti que no están: tasa de
+   falsos positivos observada frente a la teórica, microsegundos por consulta
+   y memoria, comparada con un `set` de Python con los mismos jti.
+2. Refresco: crea un usuario, hace login y rota su refresh token
+   `--refrescos` veces por /api/token/refresh/, contando las consultas SQL de
+   cada petición. Al terminar borra el usuario y sus revocaciones.
+"""
+import json
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from usuario import revocacion
+from usuario.management.commands.bench_usuario import PASSWORD_BENCH, commit_actual
+from usuario.models import TokenRevocado, Usuario
+
+
+def medir_filtro(revocados, consultas, capacidad, tasa):
+    filtro = revocacion.FiltroBloom(capacidad, tasa)
+    jtis = [uuid.uuid4().hex for _ in range(revocados)]
+    for jti in jtis:
+        filtro.agregar(jti)
+
+    ausentes = [uuid.uuid4().hex for _ in range(consultas)]
+    inicio = time.perf_counter()
+    falsos_positivos = sum(jti in filtro for jti in ausentes)
+    duracion = time.perf_counter() - inicio
+
+    tracemalloc.start()
+    try:
+        conjunto = set(jtis)
+        bytes_set, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del conjunto
+
+    return {
+        'revocados': revocados,
+        'capacidad': filtro.capacidad,
+        'bits': filtro.bits,
+        'hashes': filtro.hashes,
+        'bytes_filtro': filtro.bytes,
+        'bytes_set_python': bytes_set,
+        'tasa_falsos_positivos_objetivo': tasa,
+        'tasa_falsos_positivos_estimada': round(filtro.tasa_estimada(), 6),
+        'tasa_falsos_positivos_observada': round(falsos_positivos / consultas, 6),
+        'us_por_consulta': round(duracion / consultas * 1e6, 3),
+    }
+
+
+def medir_refrescos(refrescos):
+    email = f'bench-{uuid.uuid4().hex[:8]}@example.invalid'
+    usuario = Usuario.objects.create_user(email=email, username='Bench', dni=email[:20], password=PASSWORD_BENCH)
+    cliente = Client()
+    jtis, consultas, latencias = [], [], []
+    try:
+        refresh = primero = str(RefreshToken.for_user(usuario))
+        for _ in range(refrescos):
+            jtis.append(RefreshToken(refresh)['jti'])
+            inicio = time.perf_counter()
+            with CaptureQueriesContext(connection) as capturadas:
+                respuesta = cliente.post(
+                    '/api/token/refresh/', data={'refresh': refresh}, content_type='application/json'
+                )
+            latencias.append(time.perf_counter() - inicio)
+            consultas.append(len(capturadas))
+            refresh = respuesta.json()['refresh']
+        # Reutilizar un token ya rotado debe fallar (401)
+        reutilizado = cliente.post('/api/token/refresh/', data={'refresh': primero}, content_type='application/json')
+    finally:
+        TokenRevocado.objects.filter(jti__in=jtis).delete()
+        usuario.delete()
+
+    latencias.sort()
+    return {
+        'refrescos': refrescos,
+        'consultas_por_refresco': round(sum(consultas) / refrescos, 2),
+        'consultas_maximas': max(consultas),
+        'p50_ms': round(latencias[len(latencias) // 2] * 1000, 3),
+        'estado_reutilizado': reutilizado.status_code,
+    }
+
+
+class Command(BaseCommand):
+    help = "Falsos positivos y memoria del filtro de revocados, y consultas por refresco; salida en JSON."
+
+    def add_arguments(self, parser):
+        conf = {**revocacion.CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_REVOCACION', {})}
+        parser.add_argument('--revocados', type=int, default=conf['CAPACIDAD'], help='jti revocados en el filtro.')
+        parser.add_argument('--consultas', type=int, default=200000, help='Consultas de jti no revocados.')
+        parser.add_argument('--capacidad', type=int, default=conf['CAPACIDAD'])
+        parser.add_argument('--tasa', type=float, default=conf['TASA_FALSOS_POSITIVOS'])
+        parser.add_argument('--refrescos', type=int, default=200, help='Rotaciones por /api/token/refresh/ (0 = omitir).')
+
+    def handle(self, *args, **opciones):
+        informe = {
+            'commit': commit_actual(),
+            'bd': connection.vendor,
+            'filtro': medir_filtro(opciones['revocados'], opciones['consultas'], opciones['capacidad'], opciones['tasa']),
+        }
+        if opciones['refrescos']:
+            informe['refresco'] = medir_refrescos(opciones['refrescos'])
+        self.stdout.write(json.dumps(informe, indent=2))
@@ -0,0 +1,237 @@
+"""
+Benchmark de carga del servicio: login, registro y lectura de usuarios.
+
+    python manage.py bench_usuario --usuarios 5000 --peticiones 1000 --concurrencia 16
+    DB_ENGINE=sqlite python manage.py bench_usuario --escenarios login,lookup
+    python manage.py bench_usuario --usuarios 1000000 --escenarios search
+
+Genera usuarios sintéticos con un único hash precalculado (bulk_create, sin
+PBKDF2 por fila), lanza cada escenario con N hilos a través de la pila
+completa de Django (middleware + vista) y escribe un JSON con req/s,
+latencias p50/p95/p99 y consultas por petición. Incluye el commit y el motor
+de BD para poder comparar resultados entre commits. Con el escenario `search`
+añade el plan de ejecución (EXPLAIN) de la búsqueda por prefijo para comprobar
+que usa los índices. Al terminar borra los usuarios generados salvo con
+--conservar.
+"""
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+import zlib
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from usuario.models import CAMPOS_BUSQUEDA, Usuario
+from usuario.proyecciones import CAMPOS_LECTURA
+from usuario.services import UsuarioService
+
+
+PASSWORD_BENCH = 'bench-password-123'
+ESCENARIOS = ('login', 'register', 'lookup', 'search')
+
+
+def dni_bench(prefijo, i, marca='B'):
+    """DNI único por ejecución y dentro de los 20 caracteres del campo (el prefijo no cabe)."""
+    return f'{marca}{zlib.crc32(prefijo.encode()):08x}{i}'
+
+
+def generar_usuarios(prefijo, cantidad, lote=1000):
+    """Inserta `cantidad` usuarios `<prefijo><i>@example.invalid` con el mismo hash."""
+    password = make_password(PASSWORD_BENCH)
+    for inicio in range(0, cantidad, lote):
+        Usuario.objects.bulk_create([
+            Usuario(
+                email=f'{prefijo}{i}@example.invalid',
+                username=f'Bench {i}',
+                dni=dni_bench(prefijo, i),
+                password=password,
+            )
+            for i in range(inicio, min(inicio + lote, cantidad))
+        ])
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(int(round(p / 100 * (len(ordenados) - 1))), len(ordenados) - 1)
+    return round(ordenados[indice] * 1000, 3)
+
+
+def plan_busqueda(prefijo, limite=50):
+    """EXPLAIN de la consulta de /api/usuarios/search/ tal como la ejecuta el repositorio."""
+    consulta = Usuario.objects.por_prefijo(prefijo).order_by('id').values(*CAMPOS_LECTURA)[:limite + 1]
+    return consulta.explain().splitlines()
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar_escenario(peticion, total, concurrencia):
+    """
+    Ejecuta `peticion(i)` `total` veces repartidas en `concurrencia` hilos.
+    `peticion` devuelve True si la respuesta es la esperada.
+    """
+    siguiente = iter(range(total))
+    lock = threading.Lock()
+    latencias, errores, consultas = [], [0], [0]
+
+    def contar_consultas(execute, sql, params, many, context):
+        consultas[0] += 1
+        return execute(sql, params, many, context)
+
+    def trabajador():
+        propias = []
+        try:
+            with connection.execute_wrapper(contar_consultas):
+                while True:
+                    with lock:
+                        i = next(siguiente, None)
+                    if i is None:
+                        break
+                    inicio = time.perf_counter()
+                    ok = peticion(i)
+                    propias.append(time.perf_counter() - inicio)
+                    if not ok:
+                        with lock:
+                            errores[0] += 1
+        finally:
+            connection.close()
+            with lock:
+                latencias.extend(propias)
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        'peticiones': len(latencias),
+        'errores': errores[0],
+        'duracion_s': round(duracion, 3),
+        'req_s': round(len(latencias) / duracion, 2) if duracion else None,
+        'p50_ms': percentil(latencias, 50),
+        'p95_ms': percentil(latencias, 95),
+        'p99_ms': percentil(latencias, 99),
+        'consultas_por_peticion': round(consultas[0] / max(len(latencias), 1), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark de login, registro y lectura de usuarios; salida en JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1000, help='Usuarios sintéticos a generar.')
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por escenario.')
+        parser.add_argument('--concurrencia', type=int, default=8, help='Hilos concurrentes.')
+        parser.add_argument('--escenarios', default=','.join(ESCENARIOS), help='Lista separada por comas.')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, stdout).')
+        parser.add_argument('--conservar', action='store_true', help='No borrar los usuarios generados.')
+
+    def handle(self, *args, **opciones):
+        escenarios = [e for e in opciones['escenarios'].split(',') if e]
+        desconocidos = set(escenarios) - set(ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+        prefijo = f'bench-{uuid.uuid4().hex[:8]}-'
+        inicio = time.perf_counter()
+        generar_usuarios(prefijo, opciones['usuarios'])
+        ids = list(Usuario.objects.filter(email__startswith=prefijo).values_list('id', flat=True))
+        informe = {
+            'commit': commit_actual(),
+            'bd': connection.vendor,
+            'usuarios': opciones['usuarios'],
+            'generacion_s': round(time.perf_counter() - inicio, 3),
+            'concurrencia': opciones['concurrencia'],
+            'escenarios': {},
+        }
+
+        try:
+            for escenario in escenarios:
+                peticion = getattr(self, f'_peticion_{escenario}')(prefijo, opciones['usuarios'], ids)
+                informe['escenarios'][escenario] = ejecutar_escenario(
+                    peticion, opciones['peticiones'], opciones['concurrencia']
+                )
+            if 'search' in escenarios:
+                informe['planes'] = {'search': plan_busqueda(f'{prefijo}{opciones["usuarios"] // 2}')}
+        finally:
+            if not opciones['conservar']:
+                Usuario.objects.filter(email__startswith=prefijo).delete()
+
+        salida = json.dumps(informe, indent=2)
+        if opciones['salida']:
+            with open(opciones['salida'], 'w') as archivo:
+                archivo.write(salida)
+        self.stdout.write(salida)
+
+    # Cada escenario devuelve la función que hace la petición número i.
+    # Un Client por hilo: no es seguro compartirlo.
+
+    @staticmethod
+    def _cliente():
+        local = threading.local()
+
+        def obtener():
+            if not hasattr(local, 'cliente'):
+                local.cliente = Client()
+            return local.cliente
+        return obtener
+
+    def _peticion_login(self, prefijo, usuarios, ids):
+        cliente = self._cliente()
+
+        def peticion(i):
+            email = f'{prefijo}{random.randrange(usuarios)}@example.invalid'
+            respuesta = cliente().post(
+                '/api/login/',
+                data=json.dumps({'email': email, 'password': PASSWORD_BENCH}),
+                content_type='application/json',
+            )
+            return respuesta.status_code == 200
+        return peticion
+
+    def _peticion_register(self, prefijo, usuarios, ids):
+        cliente = self._cliente()
+
+        def peticion(i):
+            respuesta = cliente().post(
+                '/api/register/',
+                data=json.dumps({
+                    'email': f'{prefijo}reg-{i}@example.invalid',
+                    'username': f'Registro {i}',
+                    'dni': dni_bench(prefijo, i, 'R'),
+                    'password': PASSWORD_BENCH,
+                }),
+                content_type='application/json',
+            )
+            return respuesta.status_code == 201
+        return peticion
+
+    def _peticion_lookup(self, prefijo, usuarios, ids):
+        def peticion(i):
+            return UsuarioService.obtener_usuario(random.choice(ids)) is not None
+        return peticion
+
+    def _peticion_search(self, prefijo, usuarios, ids):
+        def peticion(i):
+            resultados, _ = UsuarioService.buscar_usuarios(
+                f'{prefijo}{random.randrange(usuarios)}', tuple(CAMPOS_BUSQUEDA)
+            )
+            return bool(resultados)
+        return peticion
@@ -0,0 +1,88 @@
+"""
+Calibra las iteraciones de PBKDF2 para un tiempo objetivo por hash en este nodo.
+
+    python manage.py calibrar_hasher --objetivo-ms 250
+    python manage.py calibrar_hasher --solo-estado
+
+Mide cada hasher de PASSWORD_HASHERS con sus parámetros actuales, ajusta las
+iteraciones del preferido (si es PBKDF2) y escribe `settings.HASHER_CONFIG`
+(JSON). Los usuarios con hashes antiguos se actualizan solos en su siguiente
+login correcto; el comando informa de cuántos quedan pendientes.
+"""
+import json
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, get_hashers
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from usuario.models import Usuario
+
+
+PASSWORD_PRUEBA = 'calibracion-Contraseña-123'
+
+
+def medir_ms(hasher, muestras, **parametros):
+    salt = hasher.salt()
+    tiempos = []
+    for _ in range(muestras):
+        inicio = time.perf_counter()
+        hasher.encode(PASSWORD_PRUEBA, salt, **parametros)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+class Command(BaseCommand):
+    help = "Calibra las iteraciones de PBKDF2 para un tiempo objetivo por hash."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objetivo-ms', type=float, default=250.0, help='Milisegundos por hash deseados.')
+        parser.add_argument('--muestras', type=int, default=5, help='Hashes medidos por configuración (mediana).')
+        parser.add_argument('--minimo', type=int, default=100000, help='Iteraciones mínimas aceptadas.')
+        parser.add_argument('--salida', default=str(settings.HASHER_CONFIG), help='Archivo de configuración a escribir.')
+        parser.add_argument('--solo-estado', action='store_true', help='Solo medir e informar, sin escribir nada.')
+
+    def handle(self, *args, **opciones):
+        preferido = get_hasher('default')
+        informe = {'hashers': {}}
+
+        for hasher in get_hashers():
+            try:
+                informe['hashers'][hasher.algorithm] = {'ms_por_hash': round(medir_ms(hasher, opciones['muestras']), 2)}
+            except ValueError as e:
+                # Librería opcional no instalada (argon2, bcrypt...)
+                informe['hashers'][hasher.algorithm] = {'error': str(e)}
+
+        iteraciones = getattr(preferido, 'iterations', None)
+        if not opciones['solo_estado']:
+            if not isinstance(preferido, PBKDF2PasswordHasher):
+                raise CommandError(f"El hasher preferido ({preferido.algorithm}) no es PBKDF2.")
+            actual_ms = medir_ms(preferido, opciones['muestras'])
+            iteraciones = int(preferido.iterations * opciones['objetivo_ms'] / actual_ms)
+            iteraciones = max(round(iteraciones, -3), opciones['minimo'])
+            medido_ms = medir_ms(preferido, opciones['muestras'], iterations=iteraciones)
+            config = {
+                'algoritmo': preferido.algorithm,
+                'iteraciones': iteraciones,
+                'objetivo_ms': opciones['objetivo_ms'],
+                'medido_ms': round(medido_ms, 2),
+                'nodo': platform.node(),
+                'calibrado_en': timezone.now().isoformat(),
+            }
+            with open(opciones['salida'], 'w') as archivo:
+                json.dump(config, archivo, indent=2)
+            informe['calibracion'] = {**config, 'archivo': opciones['salida']}
+
+        # Hashes con otros parámetros: otro algoritmo u otras iteraciones
+        prefijo = f'{preferido.algorithm}${iteraciones}$'
+        informe['usuarios_con_parametros_antiguos'] = Usuario.objects.exclude(password__startswith=prefijo).count()
+        informe['usuarios_total'] = Usuario.objects.count()
+
+        self.stdout.write(json.dumps(informe, indent=2, ensure_ascii=False))
+        if not opciones['solo_estado']:
+            self.stderr.write(
+                f"Reinicie los workers (o exporte PBKDF2_ITERACIONES={iteraciones}) para aplicar la calibración."
+            )
@@ -0,0 +1,140 @@
+"""
+Reparte los eventos de cambios de usuarios (usuario/eventos.py) a un sink.
+
+    python manage.py despachar_eventos
+    python manage.py despachar_eventos --sink webhook --lote 1000
+    python manage.py despachar_eventos --particion 0/2 --puerto-metricas 9101
+    python manage.py despachar_eventos --una-vez
+
+Sin `--una-vez` se queda sondeando la tabla cada `ESPERA` segundos mientras
+no haya eventos y, en esos huecos, borra los ya entregados hace más de
+RETENCION_HORAS. Si el sink rechaza un lote, espera (el doble cada vez, hasta
+un minuto) y lo reintenta entero. SIGTERM/SIGINT terminan tras el lote en curso.
+
+`--particion i/n` reparte los usuarios entre n procesos (`user_id % n == i`);
+en PostgreSQL un advisory lock impide arrancar dos con la misma partición,
+que podrían entregar desordenados los eventos de un usuario.
+
+Las métricas (usuario/metricas.py) van a PROMETHEUS_MULTIPROC_DIR si está
+definida, o a un servidor HTTP propio con `--puerto-metricas`. Al terminar
+escribe un resumen en JSON: eventos, ritmo y retraso máximo.
+"""
+import json
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from usuario import eventos
+
+
+# Clave del advisory lock de PostgreSQL (el segundo entero es la partición)
+CLAVE_BLOQUEO = 0x55455654
+ESPERA_MAXIMA = 60
+
+
+def particion(valor):
+    indice, _, total = valor.partition('/')
+    try:
+        indice, total = int(indice), int(total)
+    except ValueError:
+        raise ValueError(f'Partición no válida: {valor!r} (se espera i/n)')
+    if not 0 <= indice < total:
+        raise ValueError(f'Partición no válida: {valor!r} (se espera 0 <= i < n)')
+    return indice, total
+
+
+class Command(BaseCommand):
+    help = "Entrega a un sink los eventos pendientes de usuarios (outbox), por lotes y en orden."
+
+    def add_arguments(self, parser):
+        conf = eventos.obtener_config()
+        parser.add_argument('--sink', default=conf['SINK'], help="webhook, archivo, memoria o ruta de una clase.")
+        parser.add_argument('--lote', type=int, default=conf['LOTE'], help='Eventos por envío.')
+        parser.add_argument('--espera', type=float, default=conf['ESPERA'], help='Segundos entre sondeos sin eventos.')
+        parser.add_argument('--particion', default='0/1', help='i/n: solo los usuarios con user_id %% n == i.')
+        parser.add_argument('--una-vez', action='store_true', help='Vacía lo pendiente y termina.')
+        parser.add_argument('--puerto-metricas', type=int, help='Sirve /metrics de este proceso en ese puerto.')
+
+    def handle(self, *args, **opciones):
+        try:
+            indice, total = particion(opciones['particion'])
+            sink = eventos.crear_sink(opciones['sink'])
+        except (ImportError, ValueError) as e:
+            raise CommandError(str(e))
+        despachador = eventos.Despachador(sink, opciones['lote'], indice, total)
+
+        if opciones['puerto_metricas']:
+            from prometheus_client import start_http_server
+            start_http_server(opciones['puerto_metricas'])
+
+        self.parar = False
+        if not opciones['una_vez']:
+            signal.signal(signal.SIGTERM, self._parar)
+            signal.signal(signal.SIGINT, self._parar)
+
+        self._bloquear(indice, total)
+        inicio = time.perf_counter()
+        try:
+            self._bucle(despachador, opciones['espera'], opciones['una_vez'])
+        finally:
+            self._desbloquear(indice, total)
+
+        duracion = time.perf_counter() - inicio
+        totales = despachador.totales
+        self.stdout.write(json.dumps({
+            'sink': type(sink).__name__,
+            'particion': f'{indice}/{total}',
+            'lotes': totales['lotes'],
+            'eventos': totales['eventos'],
+            'fallos': totales['fallos'],
+            'eventos_s': round(totales['eventos'] / duracion, 1) if duracion else None,
+            'eventos_s_envio': round(totales['eventos'] / totales['segundos_envio'], 1) if totales['segundos_envio'] else None,
+            'retraso_max_ms': round(totales['retraso_max_s'] * 1000, 1),
+            'pendientes': despachador.pendientes().count(),
+        }, indent=2))
+
+    def _parar(self, signum, frame):
+        self.parar = True
+
+    def _bucle(self, despachador, espera, una_vez):
+        retencion = eventos.obtener_config()['RETENCION_HORAS']
+        reintento = espera
+        while not self.parar:
+            try:
+                enviados = despachador.despachar_lote()
+            except eventos.ErrorEntrega as e:
+                if una_vez:
+                    raise CommandError(f'El sink rechazó el lote: {e}')
+                self.stderr.write(f'El sink rechazó el lote, reintento en {reintento:g}s: {e}')
+                self._dormir(reintento)
+                reintento = min(reintento * 2, ESPERA_MAXIMA)
+                continue
+            reintento = espera
+            if enviados:
+                continue
+            if una_vez:
+                return
+            despachador.purgar_despachados(retencion)
+            self._dormir(espera)
+
+    def _dormir(self, segundos):
+        # A trozos, para que una señal no espere al final de un reintento largo
+        limite = time.monotonic() + segundos
+        while not self.parar and time.monotonic() < limite:
+            time.sleep(max(0, min(0.1, limite - time.monotonic())))
+
+    def _bloquear(self, indice, total):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [CLAVE_BLOQUEO, indice])
+            if not cursor.fetchone()[0]:
+                raise CommandError(f'Ya hay un despachador con la partición {indice}/{total}')
+
+    def _desbloquear(self, indice, total):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [CLAVE_BLOQUEO, indice])
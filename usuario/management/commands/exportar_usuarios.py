@@ -0,0 +1,80 @@
+"""
+Exporta la tabla de usuarios en CSV o NDJSON con memoria constante.
+
+    python manage.py exportar_usuarios --salida usuarios.ndjson
+    python manage.py exportar_usuarios --formato csv --gzip --salida usuarios.csv.gz
+    python manage.py exportar_usuarios --since 2026-10-01 --cursor 125000 > cambios.ndjson
+
+Las filas salen en orden de id (usuario/exportacion.py). Al terminar escribe
+en stderr un resumen JSON con el último id exportado: si la exportación se
+corta, `--cursor <último id>` la retoma sin repetir filas (añadiendo a otro
+archivo; en CSV la cabecera se repite). Con `--gzip` un archivo cortado no
+es un gzip válido y hay que repetirlo. `--since` solo exporta los usuarios
+modificados desde esa fecha (updated_at).
+"""
+import json
+import resource
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from usuario import exportacion
+from usuario.services import UsuarioService
+
+
+class Command(BaseCommand):
+    help = "Vuelca los usuarios (sin contraseñas) en CSV o NDJSON, opcionalmente en gzip."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=sorted(exportacion.FORMATOS), default='ndjson')
+        parser.add_argument('--salida', default='-', help="Archivo de salida ('-' = stdout).")
+        parser.add_argument('--gzip', action='store_true', help='Comprime la salida en gzip.')
+        parser.add_argument('--cursor', type=int, help='Solo usuarios con id mayor que este.')
+        parser.add_argument('--since', help='Solo usuarios modificados desde esta fecha (ISO 8601).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Filas por lectura del cursor.')
+
+    def handle(self, *args, **opciones):
+        try:
+            desde = exportacion.parsear_desde(opciones['since']) if opciones['since'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        leidas = {'filas': 0, 'ultimo_id': opciones['cursor']}
+
+        def contar(filas):
+            for fila in filas:
+                leidas['filas'] += 1
+                leidas['ultimo_id'] = fila[0]
+                yield fila
+
+        filas = UsuarioService.exportar_usuarios(
+            exportacion.CAMPOS_EXPORTACION, opciones['cursor'], desde, opciones['chunk_size']
+        )
+        trozos = exportacion.codificar(contar(filas), opciones['formato'], opciones['gzip'])
+
+        inicio = time.perf_counter()
+        salida = sys.stdout.buffer if opciones['salida'] == '-' else open(opciones['salida'], 'wb')
+        bytes_escritos = 0
+        # Lo ya escrito: cada trozo sin comprimir acaba justo en la fila que lo completó
+        resumen = dict(leidas)
+        try:
+            for trozo in trozos:
+                salida.write(trozo)
+                bytes_escritos += len(trozo)
+                resumen.update(leidas)
+        finally:
+            # El resumen también si se corta: `ultimo_id` permite retomar
+            if salida is sys.stdout.buffer:
+                salida.flush()
+            else:
+                salida.close()
+            duracion = time.perf_counter() - inicio
+            resumen.update({
+                'bytes': bytes_escritos,
+                'segundos': round(duracion, 3),
+                'filas_s': round(resumen['filas'] / duracion) if duracion else None,
+                # ru_maxrss en KiB en Linux
+                'memoria_max_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            })
+            self.stderr.write(json.dumps(resumen))
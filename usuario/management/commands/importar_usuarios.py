@@ -0,0 +1,165 @@
+"""
+Alta masiva de usuarios desde un CSV (usuario/importacion.py).
+
+    python manage.py importar_usuarios usuarios.csv
+    python manage.py importar_usuarios usuarios.csv --procesos 8 --lote 10000
+    python manage.py importar_usuarios usuarios.csv --reanudar
+
+El CSV lleva cabecera con email, username, dni y password (en claro) o
+password_hash (ya hasheada por Django); is_active es opcional. Se lee en
+streaming y se inserta por lotes, cada uno en su transacción. Las filas no
+válidas y las de email o DNI repetidos (en el archivo o ya registrados) no
+paran la importación: van al informe (`--informe`, CSV con línea y motivo).
+
+Tras cada lote confirmado se guarda un checkpoint con la posición en el
+archivo; si la importación se corta, `--reanudar` sigue desde ahí. Si se
+corta entre el COMMIT y el checkpoint, ese lote se repite y sus filas salen
+en el informe como duplicadas (las restricciones únicas impiden insertarlas
+dos veces). Al terminar bien se borra el checkpoint y se escribe un resumen
+en JSON; por stderr va el progreso de cada lote.
+"""
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from usuario import hashing, importacion
+
+
+def _lineas(archivo, posicion):
+    # Líneas decodificadas; `posicion['offset']` queda al final de la última entregada
+    for linea in archivo:
+        posicion['offset'] += len(linea)
+        yield linea.decode('utf-8-sig' if posicion['offset'] == len(linea) else 'utf-8')
+
+
+class Command(BaseCommand):
+    help = "Importa usuarios desde un CSV por lotes, con informe de rechazos y reanudación."
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='CSV con cabecera (email, username, dni, password o password_hash).')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por transacción.')
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos para hashear contraseñas en claro (0 = en este proceso).',
+        )
+        parser.add_argument('--sin-eventos', action='store_true', help="No escribe eventos 'created' (carga inicial).")
+        parser.add_argument('--informe', help='CSV de filas rechazadas (por defecto <archivo>.rechazados.csv).')
+        parser.add_argument('--checkpoint', help='Estado para reanudar (por defecto <archivo>.checkpoint.json).')
+        parser.add_argument('--reanudar', action='store_true', help='Sigue desde el checkpoint.')
+
+    def handle(self, *args, **opciones):
+        ruta = opciones['archivo']
+        ruta_informe = opciones['informe'] or f'{ruta}.rechazados.csv'
+        ruta_checkpoint = opciones['checkpoint'] or f'{ruta}.checkpoint.json'
+        if opciones['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que 0')
+        try:
+            identidad = self._identidad(ruta)
+        except OSError as e:
+            raise CommandError(str(e))
+        checkpoint = self._leer_checkpoint(ruta_checkpoint, identidad, opciones['reanudar'])
+
+        pool = hashing.PoolHash(opciones['procesos'], 0, 1)
+        importador = importacion.Importador(pool, con_eventos=not opciones['sin_eventos'])
+        if checkpoint:
+            importador.totales.update(checkpoint['totales'])
+        inicio = time.perf_counter()
+        leidas_al_inicio = importador.totales['leidas']
+        try:
+            with open(ruta, 'rb') as archivo, \
+                    open(ruta_informe, 'a' if checkpoint else 'w', newline='', encoding='utf-8') as informe:
+                escritor = csv.writer(informe)
+                if not checkpoint:
+                    escritor.writerow(importacion.COLUMNAS_REPORTE)
+                try:
+                    self._importar(archivo, checkpoint, importador, escritor, informe, opciones['lote'],
+                                   ruta_checkpoint, identidad, inicio, leidas_al_inicio)
+                except ValueError as e:
+                    raise CommandError(str(e))
+        finally:
+            pool.cerrar()
+
+        if os.path.exists(ruta_checkpoint):
+            os.remove(ruta_checkpoint)
+        duracion = time.perf_counter() - inicio
+        leidas = importador.totales['leidas'] - leidas_al_inicio
+        self.stdout.write(json.dumps({
+            **importador.totales,
+            'informe': ruta_informe,
+            'segundos': round(duracion, 3),
+            'filas_s': round(leidas / duracion) if duracion else None,
+        }, indent=2))
+
+    def _importar(self, archivo, checkpoint, importador, escritor, informe, tam_lote,
+                  ruta_checkpoint, identidad, inicio, leidas_al_inicio):
+        posicion = {'offset': 0}
+        lineas = _lineas(archivo, posicion)
+        # La cabecera siempre del principio; después, al punto del checkpoint
+        cabecera = next(csv.reader([next(lineas, '')]), [])
+        importacion.comprobar_cabecera(cabecera)
+        linea_inicial = 1
+        if checkpoint:
+            archivo.seek(checkpoint['offset'])
+            posicion['offset'] = checkpoint['offset']
+            linea_inicial = checkpoint['linea']
+
+        lector = csv.DictReader(lineas, fieldnames=cabecera)
+        lote = []
+        for fila in lector:
+            lote.append((linea_inicial + lector.line_num, fila))
+            if len(lote) >= tam_lote:
+                self._procesar(lote, importador, escritor, informe)
+                self._guardar_checkpoint(ruta_checkpoint, identidad, lote[-1][0], posicion['offset'], importador)
+                self._progreso(lote[-1][0], importador, inicio, leidas_al_inicio)
+                lote = []
+        if lote:
+            self._procesar(lote, importador, escritor, informe)
+            self._progreso(lote[-1][0], importador, inicio, leidas_al_inicio)
+
+    def _procesar(self, lote, importador, escritor, informe):
+        escritor.writerows(importador.procesar_lote(lote))
+        # En disco antes del checkpoint: al reanudar no se pierden rechazos
+        informe.flush()
+
+    def _progreso(self, linea, importador, inicio, leidas_al_inicio):
+        totales = importador.totales
+        duracion = time.perf_counter() - inicio
+        filas_s = round((totales['leidas'] - leidas_al_inicio) / duracion) if duracion else 0
+        self.stderr.write(
+            f"linea={linea} insertadas={totales['insertadas']} duplicadas={totales['duplicadas']}"
+            f" invalidas={totales['invalidas']} filas_s={filas_s}"
+        )
+
+    @staticmethod
+    def _identidad(ruta):
+        estado = os.stat(ruta)
+        return {'tamano': estado.st_size, 'mtime': estado.st_mtime_ns}
+
+    @staticmethod
+    def _leer_checkpoint(ruta_checkpoint, identidad, reanudar):
+        if not os.path.exists(ruta_checkpoint):
+            if reanudar:
+                raise CommandError(f'No hay checkpoint en {ruta_checkpoint}')
+            return None
+        if not reanudar:
+            raise CommandError(
+                f'Hay una importación a medias ({ruta_checkpoint}): use --reanudar o borre el checkpoint'
+            )
+        with open(ruta_checkpoint, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint['archivo'] != identidad:
+            raise CommandError('El archivo cambió desde el checkpoint: no se puede reanudar')
+        return checkpoint
+
+    @staticmethod
+    def _guardar_checkpoint(ruta_checkpoint, identidad, linea, offset, importador):
+        # Escritura atómica: un corte a mitad deja el checkpoint anterior
+        temporal = f'{ruta_checkpoint}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'archivo': identidad, 'linea': linea, 'offset': offset, 'totales': importador.totales}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta_checkpoint)
@@ -0,0 +1,28 @@
+"""
+Borra las revocaciones de refresh tokens que ya caducaron.
+
+    python manage.py purgar_tokens_revocados
+
+Un token caducado lo rechaza simplejwt por `exp`, así que su fila en
+TokenRevocado ya no sirve. Pensado para ejecutarse periódicamente (cron); se
+borra por lotes para no mantener bloqueos largos.
+"""
+from django.core.management.base import BaseCommand
+
+from usuario.models import TokenRevocado
+
+
+class Command(BaseCommand):
+    help = "Borra las revocaciones de refresh tokens caducados."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por DELETE.')
+
+    def handle(self, *args, **opciones):
+        total = 0
+        while True:
+            jtis = list(TokenRevocado.objects.caducados().values_list('jti', flat=True)[:opciones['lote']])
+            if not jtis:
+                break
+            total += TokenRevocado.objects.filter(jti__in=jtis).delete()[0]
+        self.stdout.write(f"Revocaciones caducadas borradas: {total}")
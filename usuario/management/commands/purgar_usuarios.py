@@ -0,0 +1,120 @@
+"""
+Borra definitivamente los usuarios dados de baja (deleted_at) por lotes.
+
+    python manage.py purgar_usuarios
+    python manage.py purgar_usuarios --lote 1000 --pausa 0.5 --antiguedad-horas 720
+    python manage.py purgar_usuarios --max-lotes 10
+
+`UsuarioRepository.eliminar` solo marca la baja; aquí se borran la fila y sus
+dependientes (grupos, permisos, log del admin) con
+`UsuarioRepository._borrar_definitivamente`, un lote por transacción y con una
+pausa entre lotes para dejar pasar al resto de escrituras. Pensado para cron o
+un proceso en segundo plano; SIGTERM/SIGINT terminan tras el lote en curso.
+
+En PostgreSQL un lote que espera un bloqueo más de `--bloqueo-max-ms` se
+aborta (lock_timeout) y se reintenta tras la pausa. Al terminar escribe un
+resumen en JSON: usuarios borrados, ritmo y espera por bloqueos.
+"""
+import json
+import signal
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from django.utils import timezone
+
+from usuario.repositories import UsuarioRepository
+
+
+# Lotes abortados seguidos (bloqueos o BD caída) antes de rendirse
+MAX_ABORTADOS_SEGUIDOS = 5
+
+CONFIG_POR_DEFECTO = {
+    'LOTE': 500,
+    'PAUSA': 0.2,
+    'ANTIGUEDAD_HORAS': 0,
+    'BLOQUEO_MAX_MS': 2000,
+}
+
+
+def obtener_config():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_PURGA', {})}
+
+
+class Command(BaseCommand):
+    help = "Borra definitivamente, por lotes y con pausas, los usuarios dados de baja."
+
+    def add_arguments(self, parser):
+        conf = obtener_config()
+        parser.add_argument('--lote', type=int, default=conf['LOTE'], help='Usuarios por transacción.')
+        parser.add_argument('--pausa', type=float, default=conf['PAUSA'], help='Segundos entre lotes.')
+        parser.add_argument(
+            '--antiguedad-horas', type=float, default=conf['ANTIGUEDAD_HORAS'],
+            help='Solo las bajas de hace más de estas horas.',
+        )
+        parser.add_argument(
+            '--bloqueo-max-ms', type=int, default=conf['BLOQUEO_MAX_MS'],
+            help='Espera máxima por un bloqueo antes de abortar el lote (PostgreSQL; 0 = sin límite).',
+        )
+        parser.add_argument('--max-lotes', type=int, help='Termina tras este número de lotes.')
+
+    def handle(self, *args, **opciones):
+        if opciones['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que 0')
+        self.parar = False
+        anteriores = {senal: signal.signal(senal, self._parar) for senal in (signal.SIGTERM, signal.SIGINT)}
+        inicio = time.perf_counter()
+        try:
+            totales = self._purgar(opciones)
+        finally:
+            for senal, manejador in anteriores.items():
+                signal.signal(senal, manejador)
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(json.dumps({
+            'usuarios': totales['usuarios'],
+            'lotes': totales['lotes'],
+            'abortados': totales['abortados'],
+            'segundos': round(duracion, 3),
+            'usuarios_s': round(totales['usuarios'] / duracion, 1) if duracion else None,
+            'espera_bloqueo_ms': round(totales['espera_bloqueo_s'] * 1000, 1),
+            'espera_bloqueo_max_ms': round(totales['espera_bloqueo_max_s'] * 1000, 1),
+        }, indent=2))
+
+    def _purgar(self, opciones):
+        antes_de = timezone.now() - timedelta(hours=opciones['antiguedad_horas'])
+        totales = {'usuarios': 0, 'lotes': 0, 'abortados': 0, 'espera_bloqueo_s': 0.0, 'espera_bloqueo_max_s': 0.0}
+        seguidos = 0
+        while not self.parar and (opciones['max_lotes'] is None or totales['lotes'] < opciones['max_lotes']):
+            try:
+                borrados, espera = UsuarioRepository.purgar_bajas(
+                    antes_de, opciones['lote'], opciones['bloqueo_max_ms']
+                )
+            except OperationalError as e:
+                totales['abortados'] += 1
+                seguidos += 1
+                if seguidos >= MAX_ABORTADOS_SEGUIDOS:
+                    raise CommandError(f'{seguidos} lotes abortados seguidos: {e}')
+                self.stderr.write(f'Lote abortado, reintento en {opciones["pausa"]:g}s: {e}')
+                self._dormir(opciones['pausa'])
+                continue
+            seguidos = 0
+            totales['espera_bloqueo_s'] += espera
+            totales['espera_bloqueo_max_s'] = max(totales['espera_bloqueo_max_s'], espera)
+            if not borrados:
+                break
+            totales['usuarios'] += borrados
+            totales['lotes'] += 1
+            self._dormir(opciones['pausa'])
+        return totales
+
+    def _parar(self, signum, frame):
+        self.parar = True
+
+    def _dormir(self, segundos):
+        # A trozos, para que una señal no espere al final de la pausa
+        limite = time.monotonic() + segundos
+        while not self.parar and time.monotonic() < limite:
+            time.sleep(max(0, min(0.1, limite - time.monotonic())))
@@ -0,0 +1,103 @@
+"""
+Métricas Prometheus del servicio.
+
+Con varios workers de gunicorn cada proceso tiene sus propios contadores. Si
+existe la variable de entorno `PROMETHEUS_MULTIPROC_DIR` (debe estar definida
+antes de arrancar los workers), prometheus_client guarda cada valor en
+archivos mmap de ese directorio, sin locks entre procesos, y `/metrics` los
+agrega todos: un scrape ve el contenedor entero y no un worker al azar. Sin
+la variable (desarrollo, tests) se usa el registro del propio proceso.
+
+No se definen Gauges: en modo multiproceso necesitan limpiar los archivos de
+los workers que mueren.
+"""
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+
+peticion_duracion = Histogram(
+    'usuario_peticion_duracion_segundos',
+    'Duración de las peticiones HTTP por vista.',
+    ['vista', 'metodo', 'estado'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+peticion_consultas = Histogram(
+    'usuario_peticion_consultas_bd',
+    'Consultas SQL por petición.',
+    ['vista'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+logins = Counter(
+    'usuario_logins_total',
+    'Intentos de login por resultado (exito, fallo, bloqueado, saturado).',
+    ['resultado'],
+)
+
+hash_duracion = Histogram(
+    'usuario_hash_duracion_segundos',
+    'Tiempo de CPU de cada hash o verificación de contraseña.',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1, 2),
+)
+
+hash_espera = Histogram(
+    'usuario_hash_espera_segundos',
+    'Espera en la cola del pool de hashing.',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# Despachador de eventos (usuario/eventos.py). El ritmo de entrega es
+# rate(usuario_eventos_despachados_total) y el retraso, desde que se escribe
+# el evento hasta que el sink lo acepta.
+eventos_despachados = Counter(
+    'usuario_eventos_despachados_total',
+    'Eventos de usuario entregados al sink, por tipo.',
+    ['tipo'],
+)
+
+eventos_fallos = Counter(
+    'usuario_eventos_fallos_entrega_total',
+    'Lotes de eventos rechazados por el sink (se reintentan).',
+)
+
+eventos_retraso = Histogram(
+    'usuario_eventos_retraso_segundos',
+    'Tiempo desde que se escribe un evento hasta que se entrega.',
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+eventos_envio_duracion = Histogram(
+    'usuario_eventos_envio_duracion_segundos',
+    'Duración del envío de cada lote al sink.',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+def nombre_vista(request):
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return 'sin_vista'
+    # Las vistas de DRF (@api_view) guardan la función original en `cls`
+    funcion = coincidencia.func
+    return getattr(funcion, 'cls', funcion).__name__
+
+
+def observar_peticion(request, response, duracion, mediciones):
+    """Registra una petición; `mediciones` son las fases de usuario.timing."""
+    vista = nombre_vista(request)
+    peticion_duracion.labels(vista, request.method, response.status_code).observe(duracion)
+    consultas = mediciones.get('db')
+    peticion_consultas.labels(vista).observe(consultas[1] if consultas else 0)
+
+
+def exportar():
+    """Devuelve (cuerpo, content type) en formato de texto de Prometheus."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
@@ -0,0 +1,83 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from usuario import metricas
+from usuario import timing
+
+
+logger = logging.getLogger('usuario.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Desglosa el tiempo de cada petición por fases (db, db_checkout, hash, jwt,
+    parse) y lo escribe en una línea de log con campos clave=valor
+    (SERVER_TIMING); con SERVER_TIMING_CABECERA lo devuelve también en la
+    cabecera `Server-Timing`. Con METRICAS, además registra la duración y las
+    consultas de la petición en las métricas de Prometheus.
+
+    Funciona en modo síncrono y asíncrono: bajo ASGI no obliga a Django a
+    pasar cada petición por un hilo.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.server_timing = getattr(settings, 'SERVER_TIMING', True)
+        self.cabecera = self.server_timing and getattr(settings, 'SERVER_TIMING_CABECERA', False)
+        self.metricas = getattr(settings, 'METRICAS', True)
+        if not (self.server_timing or self.metricas):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        token = timing.iniciar()
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            mediciones = timing.terminar(token)
+        return self._registrar(request, response, time.perf_counter() - inicio, mediciones)
+
+    async def __acall__(self, request):
+        token = timing.iniciar()
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            mediciones = timing.terminar(token)
+        return self._registrar(request, response, time.perf_counter() - inicio, mediciones)
+
+    def _registrar(self, request, response, total, mediciones):
+        if self.metricas:
+            metricas.observar_peticion(request, response, total, mediciones)
+        if not self.server_timing:
+            return response
+
+        total_ms = total * 1000
+        if self.cabecera:
+            partes = [
+                f'{fase};dur={segundos * 1000:.2f};desc="{llamadas}"'
+                for fase, (segundos, llamadas) in mediciones.items()
+            ]
+            partes.append(f'total;dur={total_ms:.2f}')
+            response['Server-Timing'] = ', '.join(partes)
+
+        if logger.isEnabledFor(logging.INFO):
+            campos = {'metodo': request.method, 'ruta': request.path, 'estado': response.status_code}
+            for fase, (segundos, llamadas) in mediciones.items():
+                campos[f'{fase}_ms'] = round(segundos * 1000, 2)
+                campos[f'{fase}_n'] = llamadas
+            campos['total_ms'] = round(total_ms, 2)
+            logger.info(' '.join(f'{clave}={valor}' for clave, valor in campos.items()), extra={'server_timing': campos})
+        return response
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:38
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+NOMBRE_INDICE = 'usuario_email_lower_unico'
+
+
+def comprobar_duplicados(apps, schema_editor):
+    # Emails que solo difieren en mayúsculas impedirían crear el índice único:
+    # se listan para resolverlos a mano antes de volver a migrar.
+    Usuario = apps.get_model('usuario', 'Usuario')
+    duplicados = list(
+        Usuario.objects.using(schema_editor.connection.alias)
+        .values(email_normalizado=Lower('email'))
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('email_normalizado', flat=True)[:20]
+    )
+    if duplicados:
+        raise ValueError(
+            "Hay emails repetidos sin distinguir mayúsculas; unifique estas cuentas antes de migrar: "
+            + ', '.join(duplicados)
+        )
+
+
+def crear_indice(apps, schema_editor):
+    Usuario = apps.get_model('usuario', 'Usuario')
+    if schema_editor.connection.vendor == 'postgresql':
+        # CONCURRENTLY: no bloquea las escrituras mientras se indexa la tabla entera.
+        tabla = schema_editor.quote_name(Usuario._meta.db_table)
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {schema_editor.quote_name(NOMBRE_INDICE)} '
+            f'ON {tabla} (LOWER({schema_editor.quote_name("email")}))'
+        )
+    else:
+        schema_editor.add_constraint(Usuario, models.UniqueConstraint(Lower('email'), name=NOMBRE_INDICE))
+
+
+def borrar_indice(apps, schema_editor):
+    Usuario = apps.get_model('usuario', 'Usuario')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(NOMBRE_INDICE)}')
+    else:
+        schema_editor.remove_constraint(Usuario, models.UniqueConstraint(Lower('email'), name=NOMBRE_INDICE))
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('usuario', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(comprobar_duplicados, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(crear_indice, borrar_indice),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='usuario',
+                    constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='usuario_email_lower_unico'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,69 @@
+from django.db import migrations
+
+
+# Índices de la búsqueda por prefijo (UsuarioQuerySet.por_prefijo). Dependen del
+# motor, así que no forman parte del estado del modelo.
+#
+# PostgreSQL: LIKE 'x%' solo usa un B-tree con text_pattern_ops (o con collation
+# "C"). El DNI ya tiene el índice *_like (varchar_pattern_ops) que Django crea
+# para los CharField únicos. Si la extensión pg_trgm está instalada se añaden
+# también índices GIN de trigramas, útiles para búsquedas por subcadena.
+#
+# Otros motores (SQLite en local): la búsqueda usa rangos sobre LOWER(...), que
+# resuelven el índice único de LOWER(email) (0002) y este de LOWER(username).
+INDICES_POSTGRESQL = {
+    'usuario_email_lower_patron': 'LOWER("email") text_pattern_ops',
+    'usuario_username_lower_patron': 'LOWER("username") text_pattern_ops',
+}
+INDICES_TRIGRAMAS = {
+    'usuario_email_lower_trgm': 'USING gin (LOWER("email") gin_trgm_ops)',
+    'usuario_username_lower_trgm': 'USING gin (LOWER("username") gin_trgm_ops)',
+}
+INDICES_OTROS = {
+    'usuario_username_lower': 'LOWER("username")',
+}
+
+
+def _tabla(apps, schema_editor):
+    return schema_editor.quote_name(apps.get_model('usuario', 'Usuario')._meta.db_table)
+
+
+def crear_indices(apps, schema_editor):
+    tabla = _tabla(apps, schema_editor)
+    if schema_editor.connection.vendor != 'postgresql':
+        for nombre, expresion in INDICES_OTROS.items():
+            schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({expresion})')
+        return
+
+    # CONCURRENTLY: la tabla sigue admitiendo escrituras mientras se indexa.
+    for nombre, expresion in INDICES_POSTGRESQL.items():
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} ({expresion})')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        trigramas = cursor.fetchone() is not None
+    if trigramas:
+        for nombre, definicion in INDICES_TRIGRAMAS.items():
+            schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} {definicion}')
+
+
+def borrar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        for nombre in INDICES_OTROS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {nombre}')
+        return
+    for nombre in (*INDICES_POSTGRESQL, *INDICES_TRIGRAMAS):
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('usuario', '0002_usuario_email_lower_unico'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
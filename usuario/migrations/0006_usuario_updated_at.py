@@ -0,0 +1,60 @@
+import importlib
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# Índice de la exportación incremental (`exportar_usuarios --since`). Igual que
+# los de 0003, se crea con CONCURRENTLY en PostgreSQL y no forma parte del
+# estado del modelo. Las filas existentes toman la fecha de la migración.
+INDICE = 'usuario_updated_at'
+
+# En SQLite AddField reconstruye la tabla y se pierden los índices creados con
+# SQL en 0003: se vuelven a crear (en PostgreSQL no se tocan).
+indices_busqueda = importlib.import_module('usuario.migrations.0003_indices_busqueda')
+
+
+def _tabla(apps, schema_editor):
+    return schema_editor.quote_name(apps.get_model('usuario', 'Usuario')._meta.db_table)
+
+
+def crear_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        indices_busqueda.crear_indices(apps, schema_editor)
+    concurrente = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(
+        f'CREATE INDEX {concurrente}IF NOT EXISTS {INDICE} ON {_tabla(apps, schema_editor)} ("updated_at")'
+    )
+
+
+def recrear_indices_busqueda(apps, schema_editor):
+    # Al deshacer: RemoveField también reconstruye la tabla en SQLite
+    if schema_editor.connection.vendor != 'postgresql':
+        indices_busqueda.crear_indices(apps, schema_editor)
+
+
+def borrar_indice(apps, schema_editor):
+    concurrente = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f'DROP INDEX {concurrente}IF EXISTS {INDICE}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('usuario', '0005_evento_usuario'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recrear_indices_busqueda),
+        # Un default constante: en PostgreSQL añadir la columna no reescribe la tabla
+        migrations.AddField(
+            model_name='usuario',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
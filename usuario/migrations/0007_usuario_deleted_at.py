@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+
+# Índices parciales de la baja lógica. Forman parte del estado del modelo
+# (Meta.indexes) pero, como los de 0003 y 0006, se crean con CONCURRENTLY en
+# PostgreSQL para no bloquear las escrituras en una tabla ya grande.
+INDICES = {
+    'usuario_vigentes': ('"id"', '"deleted_at" IS NULL'),
+    'usuario_bajas': ('"deleted_at"', '"deleted_at" IS NOT NULL'),
+}
+
+
+def _concurrente(schema_editor):
+    return 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+
+
+def crear_indices(apps, schema_editor):
+    tabla = schema_editor.quote_name(apps.get_model('usuario', 'Usuario')._meta.db_table)
+    for nombre, (columna, condicion) in INDICES.items():
+        schema_editor.execute(
+            f'CREATE INDEX {_concurrente(schema_editor)}IF NOT EXISTS {nombre} ON {tabla} ({columna}) WHERE {condicion}'
+        )
+
+
+def borrar_indices(apps, schema_editor):
+    for nombre in INDICES:
+        schema_editor.execute(f'DROP INDEX {_concurrente(schema_editor)}IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('usuario', '0006_usuario_updated_at'),
+    ]
+
+    operations = [
+        # Columna nullable sin default: ni PostgreSQL ni SQLite reescriben la tabla
+        migrations.AddField(
+            model_name='usuario',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(crear_indices, borrar_indices)],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='usuario',
+                    index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['id'], name='usuario_vigentes'),
+                ),
+                migrations.AddIndex(
+                    model_name='usuario',
+                    index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='usuario_bajas'),
+                ),
+            ],
+        ),
+    ]
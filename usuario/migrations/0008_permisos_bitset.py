@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuario', '0007_usuario_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermisoBit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True)),
+                ('bit', models.PositiveIntegerField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='permisos',
+            field=models.CharField(blank=True, max_length=1024, null=True),
+        ),
+    ]
@@ -1,7 +1,78 @@
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
-class UsuarioManager(BaseUserManager):
+
+# Campos de la búsqueda por prefijo y cómo se normaliza el texto buscado en cada uno
+CAMPOS_BUSQUEDA = {
+    'email': str.lower,
+    'username': str.lower,
+    'dni': str.upper,
+}
+
+
+def normalizar_email(email):
+    """Clave de búsqueda de emails: sin espacios alrededor y en minúsculas."""
+    return str(email).strip().lower() if email else email
+
+
+def limpiar_email(email):
+    """
+    Email tal como se guarda: sin espacios alrededor y con el dominio en
+    minúsculas (como `create_user`). Así LOWER(email) coincide con la clave de
+    `normalizar_email` y el índice único no admite " a@x.com" junto a "a@x.com".
+    """
+    return BaseUserManager.normalize_email(str(email).strip()) if email else email
+
+
+class UsuarioQuerySet(models.QuerySet):
+    # Buscar siempre por LOWER(email): usa el índice único usuario_email_lower_unico.
+    # `email__iexact` no lo usaría (UPPER(...) LIKE en PostgreSQL).
+
+    def borrados(self):
+        return self.filter(deleted_at__isnull=False)
+
+    def por_email(self, email):
+        return self.alias(email_normalizado=Lower('email')).filter(email_normalizado=normalizar_email(email))
+
+    def por_emails(self, emails):
+        return self.alias(email_normalizado=Lower('email')).filter(
+            email_normalizado__in=[normalizar_email(email) for email in emails]
+        )
+
+    def por_prefijo(self, prefijo, campos=tuple(CAMPOS_BUSQUEDA)):
+        """
+        Usuarios cuyo email, username o DNI (según `campos`) empieza por `prefijo`,
+        sin distinguir mayúsculas. Cada condición usa un índice (migración 0003):
+        en PostgreSQL LIKE 'x%' sobre índices text_pattern_ops; en otros motores
+        un rango [x, x+1) sobre índices normales, porque el LIKE de Django lleva
+        ESCAPE y SQLite no lo resuelve con índices.
+        """
+        rango = connections[self.db].vendor != 'postgresql'
+        condiciones = models.Q()
+        for campo in campos:
+            valor = CAMPOS_BUSQUEDA[campo](prefijo)
+            columna = campo if campo == 'dni' else f'{campo}_busqueda'
+            if rango:
+                siguiente = valor[:-1] + chr(min(ord(valor[-1]) + 1, 0x10FFFF))
+                condiciones |= models.Q(**{f'{columna}__gte': valor, f'{columna}__lt': siguiente})
+            else:
+                condiciones |= models.Q(**{f'{columna}__startswith': valor})
+        return self.alias(email_busqueda=Lower('email'), username_busqueda=Lower('username')).filter(condiciones)
+
+
+class UsuarioManager(BaseUserManager.from_queryset(UsuarioQuerySet)):
+    # Manager por defecto: los usuarios dados de baja (deleted_at) no existen
+    # para login, JWT, listados ni lecturas. `Usuario.todos` los incluye.
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+    def get_by_natural_key(self, username):
+        # Login del admin de Django: el mismo criterio que el login de la API
+        return self.por_email(username).get()
+
     def create_user(self, email, username, dni, password=None):
         if not email:
             raise ValueError("El usuario debe tener un email")
@@ -27,13 +98,128 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # Exportación incremental (--since); el índice lo crea la migración 0006.
+    # `save(update_fields=...)` solo lo actualiza si se incluye en la lista.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Baja lógica (UsuarioRepository.eliminar); `manage.py purgar_usuarios`
+    # borra después las filas y sus dependientes por lotes.
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Permisos efectivos (directos y de sus grupos) como bitset en base64url;
+    # lo mantiene usuario/permisos.py al cambiar grupos o permisos.
+    permisos = models.CharField(max_length=1024, null=True, blank=True)
+
     objects = UsuarioManager()
+    # Incluye los dados de baja: comprobar duplicados (las restricciones únicas
+    # los siguen contando hasta la purga) y purgar.
+    todos = UsuarioQuerySet.as_manager()
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "dni"]
 
+    class Meta:
+        constraints = [
+            # Un email por usuario sin distinguir mayúsculas; es además el índice de los logins
+            models.UniqueConstraint(Lower('email'), name='usuario_email_lower_unico'),
+        ]
+        indexes = [
+            # Listados por id con `deleted_at IS NULL` sin pasar por las bajas pendientes de purga
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=True), name='usuario_vigentes'),
+            # Solo las bajas: la purga las recorre por fecha sin tocar el resto de la tabla
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='usuario_bajas'),
+        ]
+
     def __str__(self):
         return self.email
 
     def get_first_name(self):
-        return self.username.split(' ')[0] if self.username else ''
\ No newline at end of file
+        return self.username.split(' ')[0] if self.username else ''
+
+    def has_perm(self, perm, obj=None):
+        # Sin objeto, con el bitset de la propia fila (usuario/permisos.py) en
+        # vez de las consultas de ModelBackend a grupos y permisos.
+        if obj is not None:
+            return super().has_perm(perm, obj)
+        if not self.is_active:
+            return False
+        if self.is_superuser:
+            return True
+        from usuario import permisos
+        return permisos.tiene(permisos.decodificar(self.permisos), perm)
+
+
+class TokenRevocadoQuerySet(models.QuerySet):
+
+    def vigentes(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def caducados(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class TokenRevocado(models.Model):
+    """
+    Refresh tokens ya usados o revocados, por `jti`. Solo hace falta guardarlos
+    hasta que caducan: después simplejwt los rechaza por `exp`.
+    """
+    jti = models.CharField(max_length=64, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # Sincronización incremental del filtro de Bloom de cada worker (usuario/revocacion.py)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = TokenRevocadoQuerySet.as_manager()
+
+    def __str__(self):
+        return self.jti
+
+
+class EventoUsuarioQuerySet(models.QuerySet):
+
+    def pendientes(self):
+        return self.filter(dispatched_at__isnull=True)
+
+    def despachados_antes_de(self, limite):
+        return self.filter(dispatched_at__lt=limite)
+
+
+class EventoUsuario(models.Model):
+    """
+    Outbox de cambios de usuarios (usuario/eventos.py): una fila por alta,
+    actualización o borrado, escrita en la misma transacción que el cambio.
+    El `id` creciente fija el orden de entrega.
+    """
+    CREADO = 'created'
+    ACTUALIZADO = 'updated'
+    ELIMINADO = 'deleted'
+
+    # Sin ForeignKey: el evento de borrado sobrevive al usuario
+    user_id = models.BigIntegerField()
+    event_type = models.CharField(max_length=16)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, db_index=True)
+    # Entregas fallidas de este evento (lotes rechazados por el sink)
+    attempts = models.PositiveIntegerField(default=0)
+
+    objects = EventoUsuarioQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Solo los pendientes: el despachador lo recorre por id sin tocar el histórico
+            models.Index(fields=['id'], condition=models.Q(dispatched_at__isnull=True), name='usuario_evento_pendientes'),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} {self.user_id}'
+
+
+class PermisoBit(models.Model):
+    """
+    Posición fija de cada permiso ('app_label.codename') en el bitset que
+    llevan los tokens (usuario/permisos.py). Las filas no se borran aunque
+    desaparezca el permiso: un bit nunca se reutiliza para otro.
+    """
+    nombre = models.CharField(max_length=255, unique=True)
+    bit = models.PositiveIntegerField(unique=True)
+
+    def __str__(self):
+        return f'{self.nombre}={self.bit}'
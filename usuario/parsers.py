@@ -0,0 +1,11 @@
+from rest_framework.parsers import JSONParser
+
+from usuario import timing
+
+
+class JSONParserMedido(JSONParser):
+    """`JSONParser` de DRF que suma su tiempo a la fase `parse` de Server-Timing."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        with timing.medir('parse'):
+            return super().parse(stream, media_type, parser_context)
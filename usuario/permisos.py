@@ -0,0 +1,218 @@
+"""
+Permisos efectivos de cada usuario como bitset.
+
+`PermissionsMixin.has_perm` pasa por ModelBackend, que consulta los permisos
+del usuario y los de sus grupos (JOINs) la primera vez en cada instancia; los
+otros servicios no tienen forma barata de autorizar. Aquí cada permiso
+('app_label.codename') tiene una posición fija (`PermisoBit`, asignada al
+migrar y nunca reutilizada) y los permisos directos y de grupo de un usuario
+se resumen en un entero con esos bits, codificado en base64url
+(little-endian, sin relleno) en la columna `Usuario.permisos`.
+
+- La columna se recalcula al cambiar los grupos o permisos de un usuario,
+  los permisos de un grupo o al borrar un grupo o permiso, y se invalidan
+  las cachés del usuario: el bitset viaja en las instantáneas cacheadas
+  (usuario/authentication.py) y `has_perm` no consulta nada.
+- `generar_tokens_para_usuario` lo añade como claim `perms` (junto a
+  `is_superuser`); refleja los permisos al emitir o refrescar el token.
+- Otros servicios piden una vez GET /api/permisos/bits/ ({nombre: bit}) y
+  comprueban `is_superuser or int.from_bytes(b64url(perms), 'little') >> bit & 1`.
+"""
+import base64
+import threading
+
+from django.contrib.auth.models import Group, Permission
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from usuario import cache
+from usuario.models import PermisoBit, Usuario
+
+
+CLAIM = 'perms'
+
+# Usuarios por consulta al recalcular (límite de parámetros de SQLite)
+TAM_LOTE_IN = 500
+
+_mapa = None
+_mapa_lock = threading.Lock()
+
+
+def obtener_mapa():
+    """{'app_label.codename': bit}, cargado una vez por proceso."""
+    global _mapa
+    if _mapa is None:
+        with _mapa_lock:
+            if _mapa is None:
+                _mapa = dict(PermisoBit.objects.values_list('nombre', 'bit'))
+    return _mapa
+
+
+def reiniciar_mapa():
+    global _mapa
+    with _mapa_lock:
+        _mapa = None
+
+
+def asignar_bits():
+    """Da el siguiente bit libre a cada permiso que aún no tiene uno. Devuelve cuántos asignó."""
+    for _ in range(3):
+        nombres = {
+            f'{app_label}.{codename}'
+            for app_label, codename in Permission.objects.values_list('content_type__app_label', 'codename')
+        }
+        faltan = sorted(nombres - set(PermisoBit.objects.values_list('nombre', flat=True)))
+        if not faltan:
+            return 0
+        try:
+            with transaction.atomic():
+                maximo = PermisoBit.objects.aggregate(maximo=Max('bit'))['maximo']
+                siguiente = 0 if maximo is None else maximo + 1
+                PermisoBit.objects.bulk_create(
+                    [PermisoBit(nombre=nombre, bit=siguiente + i) for i, nombre in enumerate(faltan)]
+                )
+        except IntegrityError:
+            # Otro proceso asignó a la vez: se recalcula con sus bits
+            continue
+        finally:
+            reiniciar_mapa()
+        return len(faltan)
+    return 0
+
+
+def codificar(bits):
+    valor = 0
+    for bit in bits:
+        valor |= 1 << bit
+    if not valor:
+        return None
+    return base64.urlsafe_b64encode(valor.to_bytes((valor.bit_length() + 7) // 8, 'little')).rstrip(b'=').decode()
+
+
+def decodificar(texto):
+    if not texto:
+        return 0
+    return int.from_bytes(base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4)), 'little')
+
+
+def tiene(bitset, perm):
+    bit = obtener_mapa().get(perm)
+    return bit is not None and bitset >> bit & 1 == 1
+
+
+# --- Recálculo ---
+
+def calcular(ids):
+    """{id: bitset codificado o None} de los usuarios `ids`: dos consultas por lote."""
+    mapa = obtener_mapa()
+    bits = {id: set() for id in ids}
+    for inicio in range(0, len(ids), TAM_LOTE_IN):
+        parte = ids[inicio:inicio + TAM_LOTE_IN]
+        directos = Usuario.user_permissions.through.objects.filter(usuario_id__in=parte).values_list(
+            'usuario_id', 'permission__content_type__app_label', 'permission__codename'
+        )
+        de_grupos = Usuario.groups.through.objects.filter(
+            usuario_id__in=parte, group__permissions__isnull=False
+        ).values_list(
+            'usuario_id', 'group__permissions__content_type__app_label', 'group__permissions__codename'
+        )
+        for filas in (directos, de_grupos):
+            for id, app_label, codename in filas:
+                nombre = f'{app_label}.{codename}'
+                if nombre not in mapa:
+                    # Permiso creado después de migrar
+                    asignar_bits()
+                    mapa = obtener_mapa()
+                bits[id].add(mapa[nombre])
+    return {id: codificar(bits_usuario) for id, bits_usuario in bits.items()}
+
+
+def recalcular(ids):
+    """Guarda el bitset de `ids` (un UPDATE por valor distinto) e invalida sus cachés."""
+    ids = list(dict.fromkeys(ids))
+    por_valor = {}
+    for id, valor in calcular(ids).items():
+        por_valor.setdefault(valor, []).append(id)
+    with transaction.atomic():
+        for valor, ids_valor in por_valor.items():
+            for inicio in range(0, len(ids_valor), TAM_LOTE_IN):
+                Usuario.todos.filter(pk__in=ids_valor[inicio:inicio + TAM_LOTE_IN]).update(permisos=valor)
+    for id in ids:
+        cache.invalidar_usuario(id)
+
+
+def titulares():
+    """Ids de los usuarios con algún permiso directo o de grupo."""
+    return list(
+        Usuario.todos.filter(Q(user_permissions__isnull=False) | Q(groups__permissions__isnull=False))
+        .distinct().values_list('pk', flat=True)
+    )
+
+
+def al_migrar(apps=None, **kwargs):
+    # post_migrate: bits de los permisos nuevos y, si los hubo, bitsets de
+    # los usuarios con permisos (la primera vez, los de antes de esta columna).
+    # `flush` lo emite sin `apps`: las tablas son las de los modelos actuales.
+    if apps is not None:
+        try:
+            apps.get_model('usuario', 'PermisoBit')
+        except LookupError:
+            # Migración hacia atrás, sin la tabla
+            return
+    if asignar_bits():
+        recalcular(titulares())
+
+
+# --- Señales: grupos y permisos que cambian ---
+
+def _miembros(grupos):
+    grupos = list(grupos)
+    ids = []
+    for inicio in range(0, len(grupos), TAM_LOTE_IN):
+        ids.extend(Usuario.todos.filter(groups__in=grupos[inicio:inicio + TAM_LOTE_IN]).values_list('pk', flat=True))
+    return ids
+
+
+def _afectados(sender, instance, reverse, pk_set):
+    if sender is Group.permissions.through:
+        # Permisos de un grupo (o grupos de un permiso): todos sus miembros
+        if not reverse:
+            return _miembros([instance.pk])
+        return _miembros(pk_set if pk_set is not None else instance.group_set.values_list('pk', flat=True))
+    if not reverse:
+        return [instance.pk]
+    return list(pk_set if pk_set is not None else instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Usuario.groups.through)
+@receiver(m2m_changed, sender=Usuario.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def _recalcular_si_cambian(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Tras el clear ya no se sabe a quién afectaba
+        instance._usuarios_afectados = _afectados(sender, instance, reverse, None)
+    elif action == 'post_clear':
+        recalcular(instance.__dict__.pop('_usuarios_afectados', []))
+    elif action in ('post_add', 'post_remove'):
+        recalcular(_afectados(sender, instance, reverse, pk_set))
+
+
+@receiver(pre_delete, sender=Group)
+@receiver(pre_delete, sender=Permission)
+def _recordar_afectados(sender, instance, **kwargs):
+    # El borrado en cascada de las filas M2M no emite m2m_changed
+    if sender is Group:
+        instance._usuarios_afectados = _miembros([instance.pk])
+    else:
+        instance._usuarios_afectados = [
+            *instance.user_set.values_list('pk', flat=True),
+            *_miembros(instance.group_set.values_list('pk', flat=True)),
+        ]
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def _recalcular_afectados(sender, instance, **kwargs):
+    recalcular(instance.__dict__.pop('_usuarios_afectados', []))
@@ -0,0 +1,80 @@
+"""
+Proyección de lectura de usuarios: la ruta rápida de las respuestas.
+
+`UsuarioSerializer` construye instancias completas del modelo (hash de la
+contraseña, managers M2M...) y objetos Field por cada respuesta. Para leer basta
+con `values_list(*CAMPOS_LECTURA)` en una tupla con nombre y un codificador JSON
+creado una sola vez. El JSON resultante es idéntico, byte a byte, al que
+renderiza DRF para `UsuarioSerializer` (UNICODE_JSON y COMPACT_JSON por defecto).
+"""
+import functools
+import json
+from collections import namedtuple
+from json.encoder import encode_basestring
+
+
+# Campos que se devuelven en las respuestas (todos menos 'password')
+CAMPOS_LECTURA = ('id', 'username', 'email', 'dni')
+
+UsuarioLectura = namedtuple('UsuarioLectura', CAMPOS_LECTURA)
+
+_codificar = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+# Plantilla fija por campo: id entero y el resto cadenas (columnas NOT NULL).
+# `encode_basestring` es la versión en C que usa json con ensure_ascii=False.
+_PLANTILLA = '{"id":%d,"username":%s,"email":%s,"dni":%s}'
+
+
+def _como_drf(texto):
+    # JSONRenderer escapa U+2028 y U+2029 (separadores de línea en JavaScript)
+    # sobre el JSON ya generado; `encode_basestring` los deja tal cual.
+    return texto.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def desde_filas(filas):
+    """Convierte las tuplas de `values_list(*CAMPOS_LECTURA)` en UsuarioLectura."""
+    return map(UsuarioLectura._make, filas)
+
+
+def desde_modelo(usuario):
+    # Una instancia recién creada conserva los valores tal como llegaron en la
+    # petición (p. ej. "dni": 12345678); se pasan a texto como CharField de DRF.
+    return UsuarioLectura(usuario.id, *(str(getattr(usuario, campo)) for campo in CAMPOS_LECTURA[1:]))
+
+
+def a_json(usuario):
+    id, username, email, dni = usuario
+    return _como_drf(_PLANTILLA % (id, encode_basestring(username), encode_basestring(email), encode_basestring(dni)))
+
+
+def lista_a_json(usuarios):
+    return _como_drf('[' + ','.join([
+        _PLANTILLA % (id, encode_basestring(username), encode_basestring(email), encode_basestring(dni))
+        for id, username, email, dni in usuarios
+    ]) + ']')
+
+
+def pagina_a_json(usuarios, siguiente):
+    return '{"results":%s,"next_cursor":%s}' % (lista_a_json(usuarios), _codificar(siguiente))
+
+
+@functools.lru_cache(maxsize=64)
+def _plantilla_campos(campos):
+    # Como _PLANTILLA, pero solo con `campos` (subconjunto ordenado de CAMPOS_LECTURA)
+    return '{' + ','.join('"%s":%s' % (campo, '%d' if campo == 'id' else '%s') for campo in campos) + '}'
+
+
+def lista_campos_a_json(usuarios, campos):
+    """`lista_a_json` limitado a `campos`, para respuestas más pequeñas."""
+    if campos == CAMPOS_LECTURA:
+        return lista_a_json(usuarios)
+    plantilla = _plantilla_campos(campos)
+    indices = [CAMPOS_LECTURA.index(campo) for campo in campos]
+    return _como_drf('[' + ','.join([
+        plantilla % tuple(usuario[i] if i == 0 else encode_basestring(usuario[i]) for i in indices)
+        for usuario in usuarios
+    ]) + ']')
+
+
+def lote_a_json(usuarios, campos, faltantes):
+    return '{"results":%s,"missing":%s}' % (lista_campos_a_json(usuarios, campos), _como_drf(_codificar(faltantes)))
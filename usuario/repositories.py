@@ -1,6 +1,18 @@
-from usuario.models import Usuario
+from usuario.models import Usuario, normalizar_email
+from usuario import cache
+from usuario import proyecciones
+from usuario import eventos
+from usuario.proyecciones import CAMPOS_LECTURA
 # Necesitas importar esta excepción estándar para manejar búsquedas fallidas.
 from django.core.exceptions import ObjectDoesNotExist 
+import functools
+import time
+from django.db import DatabaseError, IntegrityError, connections, models, router, transaction
+from django.utils import timezone
+
+# Valores por cada WHERE ... IN (...) en las consultas por lotes: mantiene las
+# sentencias por debajo del límite de parámetros de SQLite y con planes estables.
+TAM_LOTE_IN = 500
 
 class UsuarioRepository:
     
@@ -9,12 +21,99 @@ class UsuarioRepository:
         # Correcto en ambos ORMs, pero confirmado para Django ORM.
         return Usuario.objects.all() 
 
+    @staticmethod
+    def listar_pagina(despues_de=None, limite=50):
+        # Paginación keyset: WHERE id > cursor ORDER BY id LIMIT n usa el índice de la PK,
+        # así que la página 10.000 cuesta lo mismo que la primera (sin OFFSET).
+        # Devuelve UsuarioLectura (solo los campos de la respuesta), no instancias del modelo.
+        usuarios = Usuario.objects.order_by('id')
+        if despues_de is not None:
+            usuarios = usuarios.filter(id__gt=despues_de)
+        return list(proyecciones.desde_filas(usuarios.values_list(*CAMPOS_LECTURA)[:limite]))
+
+    @staticmethod
+    def buscar_pagina(prefijo, campos, despues_de=None, limite=50):
+        # Búsqueda por prefijo con el mismo keyset por id que listar_pagina
+        usuarios = Usuario.objects.por_prefijo(prefijo, campos).order_by('id')
+        if despues_de is not None:
+            usuarios = usuarios.filter(id__gt=despues_de)
+        return list(proyecciones.desde_filas(usuarios.values_list(*CAMPOS_LECTURA)[:limite]))
+
+    @staticmethod
+    def iterar(campos, despues_de=None, chunk_size=2000):
+        # Recorrido completo con cursor del lado del servidor (en PostgreSQL):
+        # solo `chunk_size` filas en memoria a la vez.
+        usuarios = Usuario.objects.order_by('id')
+        if despues_de is not None:
+            usuarios = usuarios.filter(id__gt=despues_de)
+        return usuarios.values(*campos).iterator(chunk_size=chunk_size)
+
+    @staticmethod
+    def iterar_lectura(despues_de=None, chunk_size=2000):
+        # Como `iterar`, pero en UsuarioLectura para codificarlas con proyecciones.a_json
+        usuarios = Usuario.objects.order_by('id')
+        if despues_de is not None:
+            usuarios = usuarios.filter(id__gt=despues_de)
+        return proyecciones.desde_filas(usuarios.values_list(*CAMPOS_LECTURA).iterator(chunk_size=chunk_size))
+
+    @staticmethod
+    def iterar_exportacion(campos, despues_de=None, desde=None, chunk_size=2000):
+        # Tuplas de `campos` en orden de id con cursor del lado del servidor:
+        # la memoria no depende del tamaño de la tabla. `desde` filtra por updated_at.
+        usuarios = Usuario.objects.order_by('id')
+        if despues_de is not None:
+            usuarios = usuarios.filter(id__gt=despues_de)
+        if desde is not None:
+            usuarios = usuarios.filter(updated_at__gte=desde)
+        return usuarios.values_list(*campos).iterator(chunk_size=chunk_size)
+
     @staticmethod
     def obtener_por_id(id):
+        # Lectura a través de la caché de usuarios (LRU local + caché de Django)
+        return cache.obtener_usuario(id, UsuarioRepository._cargar_por_id)
+
+    @staticmethod
+    def obtener_version(id):
+        # updated_at del usuario (o None si no existe) sin cargar la fila, para los ETag
+        return cache.obtener_version(id, UsuarioRepository._cargar_version)
+
+    @staticmethod
+    def _cargar_version(id):
+        return Usuario.objects.filter(pk=id).values_list('updated_at', flat=True).first()
+
+    @staticmethod
+    def obtener_lecturas(ids):
+        # {id: UsuarioLectura} de los que existen, a través de la caché de lectura
+        return cache.obtener_lecturas(ids, UsuarioRepository._cargar_lecturas)
+
+    @staticmethod
+    def _cargar_lecturas(ids, tam_lote=TAM_LOTE_IN):
+        encontrados = {}
+        for inicio in range(0, len(ids), tam_lote):
+            filas = Usuario.objects.filter(pk__in=ids[inicio:inicio + tam_lote]).values_list(*CAMPOS_LECTURA)
+            encontrados.update((usuario.id, usuario) for usuario in proyecciones.desde_filas(filas))
+        return encontrados
+
+    @staticmethod
+    def obtener_lecturas_por_email(emails, tam_lote=TAM_LOTE_IN):
+        # {email normalizado: UsuarioLectura}; sin caché (está indexada por id),
+        # pero cada lote usa el índice único de LOWER(email)
+        encontrados = {}
+        for inicio in range(0, len(emails), tam_lote):
+            filas = Usuario.objects.por_emails(emails[inicio:inicio + tam_lote]).values_list(*CAMPOS_LECTURA)
+            encontrados.update(
+                (normalizar_email(usuario.email), usuario) for usuario in proyecciones.desde_filas(filas)
+            )
+        return encontrados
+
+    @staticmethod
+    def _cargar_por_id(id):
         try:
             #  CORRECCIÓN: Usamos .get(pk=id) para obtener por clave primaria.
             # Si no se encuentra, Django lanza la excepción ObjectDoesNotExist.
-            return Usuario.objects.get(pk=id)
+            # Sin el hash de la contraseña: la instancia acaba en la caché
+            # compartida (Redis). El login lo lee de la BD, sin pasar por aquí.
+            return Usuario.objects.defer('password').get(pk=id)
         except ObjectDoesNotExist:
             return None # Devolver None si no se encuentra.
     
@@ -22,27 +121,217 @@ class UsuarioRepository:
     def crear(datos):
         #  MEJORA: Usamos el método .create() del Manager.
         # Esto es más conciso y a veces más seguro.
-        return Usuario.objects.create(**datos) 
+        with transaction.atomic():
+            usuario = Usuario.objects.create(**datos)
+            eventos.registrar_creados([usuario])
+        cache.invalidar_usuario(usuario.pk)
+        return usuario
+
+    @staticmethod
+    def importar_lote(usuarios, con_eventos=True):
+        """
+        Inserta `usuarios` (instancias sin guardar, sin emails ni DNI repetidos
+        entre sí) saltándose los que chocan con un usuario ya registrado, en una
+        transacción con sus eventos 'created'. Devuelve los insertados, con pk.
+        PostgreSQL: COPY a una tabla temporal y un INSERT ... SELECT ... ON
+        CONFLICT DO NOTHING. Otros motores: duplicados con dos consultas y bulk_create.
+        """
+        if not usuarios:
+            return []
+        connection = connections[router.db_for_write(Usuario)]
+        with transaction.atomic(using=connection.alias):
+            if connection.vendor == 'postgresql':
+                insertados = UsuarioRepository._importar_con_copy(connection, usuarios)
+            else:
+                insertados = UsuarioRepository._importar_con_bulk_create(usuarios)
+            if con_eventos:
+                eventos.registrar_creados(insertados)
+        return insertados
+
+    @staticmethod
+    def _importar_con_copy(connection, usuarios):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            # Una por sesión; ON COMMIT DELETE ROWS la vacía al confirmar cada lote
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS usuario_importacion ('
+                'linea integer, email text, username text, dni text, password text, is_active boolean'
+                ') ON COMMIT DELETE ROWS'
+            )
+            with cursor.copy(
+                'COPY usuario_importacion (linea, email, username, dni, password, is_active) FROM STDIN'
+            ) as copia:
+                for linea, usuario in enumerate(usuarios):
+                    copia.write_row((linea, usuario.email, usuario.username, usuario.dni, usuario.password, usuario.is_active))
+            # Sin emails repetidos en el lote, LOWER(email) empareja cada fila insertada con la suya
+            cursor.execute(
+                f'WITH insertados AS ('
+                f' INSERT INTO {qn(Usuario._meta.db_table)}'
+                f' (password, is_superuser, username, email, dni, is_active, is_staff, updated_at)'
+                f' SELECT password, false, username, email, dni, is_active, false, %s'
+                f' FROM usuario_importacion ORDER BY linea'
+                f' ON CONFLICT DO NOTHING'
+                f' RETURNING id, email'
+                f') SELECT s.linea, i.id FROM insertados i'
+                f' JOIN usuario_importacion s ON LOWER(s.email) = LOWER(i.email)',
+                [timezone.now()],
+            )
+            ids = dict(cursor.fetchall())
+        insertados = []
+        for linea, usuario in enumerate(usuarios):
+            if linea in ids:
+                usuario.pk = ids[linea]
+                insertados.append(usuario)
+        return insertados
+
+    @staticmethod
+    def _importar_con_bulk_create(usuarios, tam_lote=TAM_LOTE_IN):
+        emails_usados, dnis_usados = set(), set()
+        for inicio in range(0, len(usuarios), tam_lote):
+            parte = usuarios[inicio:inicio + tam_lote]
+            emails_usados.update(normalizar_email(email) for email in Usuario.todos.por_emails(
+                [usuario.email for usuario in parte]
+            ).values_list('email', flat=True))
+            dnis_usados.update(Usuario.todos.filter(
+                dni__in=[usuario.dni for usuario in parte]
+            ).values_list('dni', flat=True))
+        nuevos = [
+            usuario for usuario in usuarios
+            if normalizar_email(usuario.email) not in emails_usados and usuario.dni not in dnis_usados
+        ]
+        try:
+            with transaction.atomic():
+                Usuario.objects.bulk_create(nuevos)
+            return nuevos
+        except IntegrityError:
+            # Otro alta concurrente ganó la carrera: fila a fila
+            insertados = []
+            for usuario in nuevos:
+                usuario.pk = None
+                try:
+                    with transaction.atomic():
+                        usuario.save(force_insert=True)
+                    insertados.append(usuario)
+                except IntegrityError:
+                    usuario.pk = None
+            return insertados
 
     @staticmethod
     def actualizar(id, datos):
-        usuario = UsuarioRepository.obtener_por_id(id)
-        if not usuario:
-            return None
-        
-        #  La lógica de setattr() y save() es correcta para la actualización.
-        for campo, valor in datos.items():
-            setattr(usuario, campo, valor)
-            
-        usuario.save()
+        # Un único UPDATE ... RETURNING (PostgreSQL y SQLite >= 3.35) que solo
+        # toca las columnas recibidas y devuelve la fila ya actualizada: el
+        # evento 'updated' (outbox, misma transacción) y el usuario devuelto
+        # salen de la BD y no de una copia cacheada que en otro worker puede
+        # estar anticuada. Un usuario dado de baja no se actualiza. El hash de
+        # la contraseña no se devuelve (queda diferido en la instancia).
+        meta = Usuario._meta
+        campos = [meta.get_field(campo) for campo in datos]
+        actualizado = meta.get_field('updated_at')
+        connection = connections[router.db_for_write(Usuario)]
+        qn = connection.ops.quote_name
+        asignaciones = ', '.join(f'{qn(campo.column)} = %s' for campo in [*campos, actualizado])
+        valores = [campo.get_db_prep_save(valor, connection) for campo, valor in zip(campos, datos.values())]
+        valores.append(actualizado.get_db_prep_save(timezone.now(), connection))
+        sql = (
+            f'UPDATE {qn(meta.db_table)} SET {asignaciones}'
+            f' WHERE {qn(meta.pk.column)} = %s AND {qn(meta.get_field("deleted_at").column)} IS NULL'
+            f' RETURNING {", ".join(qn(campo.column) for campo in meta.concrete_fields if campo.name != "password")}'
+        )
+        with transaction.atomic(using=connection.alias):
+            # raw() aplica los conversores de cada campo a las columnas devueltas
+            usuario = next(iter(Usuario.todos.db_manager(connection.alias).raw(sql, [*valores, id])), None)
+            if usuario is not None:
+                eventos.registrar_actualizado(usuario)
+        cache.invalidar_usuario(id)
         return usuario
 
     @staticmethod
     def eliminar(id):
-        #  Usar try/except para obtener el objeto.
-        try:
-            usuario = Usuario.objects.get(pk=id)
-            usuario.delete()
-            return True
-        except ObjectDoesNotExist:
-            return False
\ No newline at end of file
+        # Baja lógica: un UPDATE de una fila, sin tocar las tablas M2M (las
+        # borra después `manage.py purgar_usuarios`). El evento 'deleted' solo
+        # si existía y no estaba ya dado de baja, en la misma transacción (outbox).
+        ahora = timezone.now()
+        with transaction.atomic():
+            borrados = Usuario.objects.filter(pk=id).update(deleted_at=ahora, updated_at=ahora)
+            if borrados:
+                eventos.registrar_eliminado(id)
+        cache.invalidar_usuario(id)
+        return borrados > 0
+
+    @staticmethod
+    def purgar_bajas(antes_de, tam_lote, bloqueo_max_ms=None):
+        """
+        Borra definitivamente hasta `tam_lote` usuarios dados de baja antes de
+        `antes_de`, con sus filas dependientes, en una transacción. Devuelve
+        (usuarios borrados, segundos esperando el bloqueo de sus filas).
+        En PostgreSQL, con `bloqueo_max_ms` la transacción falla con
+        OperationalError si alguna sentencia espera un bloqueo más que eso.
+        """
+        connection = connections[router.db_for_write(Usuario)]
+        with transaction.atomic(using=connection.alias):
+            if bloqueo_max_ms and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{int(bloqueo_max_ms)}ms'])
+            # FOR UPDATE (sin efecto en SQLite): espera a que terminen las
+            # escrituras en curso sobre esas filas; es la espera que se mide
+            inicio = time.perf_counter()
+            ids = list(
+                Usuario.todos.borrados().filter(deleted_at__lt=antes_de)
+                .order_by('deleted_at').select_for_update()
+                .values_list('id', flat=True)[:tam_lote]
+            )
+            espera = time.perf_counter() - inicio
+            return UsuarioRepository._borrar_definitivamente(ids), espera
+
+    @staticmethod
+    @functools.cache
+    def _dependientes_en_cascada():
+        # Tablas que apuntan a Usuario con CASCADE (M2M de grupos/permisos, log del admin).
+        # None si alguna relación no es CASCADE o tiene a su vez dependientes:
+        # en ese caso hay que dejar que el Collector de Django resuelva el borrado.
+        relaciones = [
+            campo for campo in Usuario._meta.get_fields(include_hidden=True)
+            if campo.auto_created and not campo.concrete and (campo.one_to_many or campo.one_to_one)
+        ]
+        for relacion in relaciones:
+            if relacion.on_delete is not models.CASCADE:
+                return None
+            if any(campo.auto_created and not campo.concrete
+                   for campo in relacion.related_model._meta.get_fields(include_hidden=True)):
+                return None
+        return [(relacion.related_model._meta.db_table, relacion.field.column) for relacion in relaciones]
+
+    @staticmethod
+    def _borrar_definitivamente(ids):
+        """
+        Borra los usuarios `ids` y sus filas dependientes sin consultarlos antes.
+        En PostgreSQL es una sola sentencia (CTEs que modifican datos); en otros
+        motores, un DELETE por tabla dentro de una transacción. No envía las
+        señales pre/post_delete. Devuelve el número de usuarios borrados.
+        """
+        if not ids:
+            return 0
+        dependientes = UsuarioRepository._dependientes_en_cascada()
+        if dependientes is None:
+            return Usuario.todos.filter(pk__in=ids).delete()[1].get(Usuario._meta.label, 0)
+
+        connection = connections[router.db_for_write(Usuario)]
+        qn = connection.ops.quote_name
+        marcadores = ', '.join(['%s'] * len(ids))
+        borrar_dependientes = [
+            f'DELETE FROM {qn(tabla)} WHERE {qn(columna)} IN ({marcadores})'
+            for tabla, columna in dependientes
+        ]
+        borrar_usuarios = f'DELETE FROM {qn(Usuario._meta.db_table)} WHERE {qn(Usuario._meta.pk.column)} IN ({marcadores})'
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                ctes = ', '.join(f'd{i} AS ({sql})' for i, sql in enumerate(borrar_dependientes))
+                sql = f'WITH {ctes} {borrar_usuarios}' if ctes else borrar_usuarios
+                cursor.execute(sql, list(ids) * (len(borrar_dependientes) + 1))
+                return cursor.rowcount
+            with transaction.atomic(using=connection.alias):
+                for sql in borrar_dependientes:
+                    cursor.execute(sql, list(ids))
+                cursor.execute(borrar_usuarios, list(ids))
+                return cursor.rowcount
@@ -0,0 +1,244 @@
+"""
+Revocación de refresh tokens con un filtro de Bloom por proceso.
+
+Al rotar un refresh token (`UsuarioService.refrescar_tokens`) su `jti` se
+guarda en `TokenRevocado` hasta que caduca. Cada worker mantiene un filtro de
+Bloom con los `jti` revocados vigentes:
+
+- Si el `jti` no está en el filtro, seguro que no fue revocado por este
+  worker ni antes de la última sincronización: se responde sin consultar.
+- Si está, puede ser un falso positivo: se confirma con la BD.
+
+El filtro se construye al arrancar el worker (usuario/arranque.py) y cada
+`SINCRONIZAR_CADA` segundos se le añaden los `jti` revocados desde la
+sincronización anterior (con un margen por las transacciones que confirman
+tarde). Un filtro desactualizado no deja pasar un token reutilizado: la
+revocación es un INSERT por clave primaria y un segundo uso del mismo token
+falla ahí; el filtro solo ahorra consultas.
+"""
+import hashlib
+import math
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from usuario.models import TokenRevocado
+
+
+CONFIG_POR_DEFECTO = {
+    'CAPACIDAD': 100000,
+    'TASA_FALSOS_POSITIVOS': 0.001,
+    'SINCRONIZAR_CADA': 5,
+    'MARGEN_SINCRONIZACION': 5,
+}
+
+
+class FiltroBloom:
+    """
+    Conjunto aproximado de cadenas: sin falsos negativos y con una tasa de
+    falsos positivos de `tasa_falsos_positivos` mientras no supere `capacidad`
+    elementos. Las `hashes` posiciones salen de un único blake2b (doble hashing).
+    """
+
+    def __init__(self, capacidad, tasa_falsos_positivos):
+        self.capacidad = capacidad
+        self.bits = max(64, math.ceil(-capacidad * math.log(tasa_falsos_positivos) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacidad * math.log(2)))
+        self.elementos = 0
+        self._array = bytearray((self.bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _posiciones(self, valor):
+        digest = hashlib.blake2b(valor.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def agregar(self, valor):
+        posiciones = self._posiciones(valor)
+        with self._lock:
+            nuevo = False
+            for posicion in posiciones:
+                byte, bit = posicion >> 3, 1 << (posicion & 7)
+                if not self._array[byte] & bit:
+                    self._array[byte] |= bit
+                    nuevo = True
+            # Las sincronizaciones solapan: solo se cuenta lo que no estaba (un
+            # falso positivo al agregar tampoco cuenta; `elementos` es aproximado)
+            self.elementos += nuevo
+
+    def __contains__(self, valor):
+        array = self._array
+        return all(array[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(valor))
+
+    @property
+    def bytes(self):
+        return len(self._array)
+
+    def tasa_estimada(self):
+        """Tasa de falsos positivos esperada con los elementos actuales."""
+        return (1 - math.exp(-self.hashes * self.elementos / self.bits)) ** self.hashes
+
+
+class ListaRevocacion:
+
+    def __init__(self, capacidad, tasa_falsos_positivos, sincronizar_cada, margen_sincronizacion):
+        self.capacidad = capacidad
+        self.tasa_falsos_positivos = tasa_falsos_positivos
+        self.sincronizar_cada = sincronizar_cada
+        self.margen = timedelta(seconds=margen_sincronizacion)
+        self.filtro = None
+        self._desde = None
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+        self._sincronizando = threading.Lock()
+        self._contadores = {
+            'negativos': 0,
+            'positivos': 0,
+            'falsos_positivos': 0,
+            'reconstrucciones': 0,
+            'sincronizaciones': 0,
+        }
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def _reconstruir(self):
+        # Filtro nuevo con los `jti` revocados que aún no han caducado
+        desde = timezone.now()
+        jtis = list(TokenRevocado.objects.vigentes().values_list('jti', flat=True))
+        # Con más revocados que capacidad la tasa de falsos positivos se dispararía
+        filtro = FiltroBloom(max(self.capacidad, 2 * len(jtis)), self.tasa_falsos_positivos)
+        for jti in jtis:
+            filtro.agregar(jti)
+        self.filtro, self._desde = filtro, desde
+        self._contar('reconstrucciones')
+
+    def _incorporar_nuevos(self):
+        desde = timezone.now()
+        nuevos = TokenRevocado.objects.filter(revoked_at__gte=self._desde - self.margen).values_list('jti', flat=True)
+        for jti in nuevos:
+            self.filtro.agregar(jti)
+        self._desde = desde
+        self._contar('sincronizaciones')
+
+    def sincronizar(self, forzar=False):
+        """
+        Añade al filtro lo revocado por otros workers, como mucho cada
+        `sincronizar_cada` segundos; la primera vez (o si se llenó) lo reconstruye.
+        """
+        if not forzar and self.filtro is not None and time.monotonic() < self._proxima:
+            return
+        # Con un filtro ya construido no se espera a otro hilo que esté sincronizando
+        if not self._sincronizando.acquire(blocking=forzar or self.filtro is None):
+            return
+        try:
+            if not forzar and self.filtro is not None and time.monotonic() < self._proxima:
+                return
+            if self.filtro is None or self.filtro.elementos > self.filtro.capacidad:
+                self._reconstruir()
+            else:
+                self._incorporar_nuevos()
+            self._proxima = time.monotonic() + self.sincronizar_cada
+        finally:
+            self._sincronizando.release()
+
+    def esta_revocado(self, jti):
+        self.sincronizar()
+        if jti not in self.filtro:
+            self._contar('negativos')
+            return False
+        self._contar('positivos')
+        revocado = TokenRevocado.objects.filter(jti=jti).exists()
+        if not revocado:
+            self._contar('falsos_positivos')
+        return revocado
+
+    def revocar(self, jti, expira):
+        """
+        Guarda el `jti` como revocado. Devuelve False si ya lo estaba: otra
+        petición lo revocó (o usó el mismo refresh token) antes.
+        """
+        # En autocommit basta el INSERT (sin BEGIN/COMMIT alrededor); dentro de
+        # una transacción, el savepoint permite seguir usándola si falla.
+        en_transaccion = transaction.get_connection().in_atomic_block
+        try:
+            with transaction.atomic() if en_transaccion else nullcontext():
+                TokenRevocado.objects.create(jti=jti, expires_at=expira)
+        except IntegrityError:
+            return False
+        if self.filtro is not None:
+            self.filtro.agregar(jti)
+        return True
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+        consultas_no_revocadas = datos['negativos'] + datos['falsos_positivos']
+        datos['tasa_falsos_positivos_observada'] = (
+            datos['falsos_positivos'] / consultas_no_revocadas if consultas_no_revocadas else None
+        )
+        filtro = self.filtro
+        if filtro is not None:
+            datos.update({
+                'elementos': filtro.elementos,
+                'capacidad': filtro.capacidad,
+                'bits': filtro.bits,
+                'hashes': filtro.hashes,
+                'bytes': filtro.bytes,
+                'tasa_falsos_positivos_estimada': filtro.tasa_estimada(),
+            })
+        return datos
+
+
+_lista = None
+_lista_lock = threading.Lock()
+
+
+def obtener_lista():
+    global _lista
+    if _lista is None:
+        with _lista_lock:
+            if _lista is None:
+                conf = {**CONFIG_POR_DEFECTO, **getattr(settings, 'USUARIO_REVOCACION', {})}
+                _lista = ListaRevocacion(
+                    conf['CAPACIDAD'],
+                    conf['TASA_FALSOS_POSITIVOS'],
+                    conf['SINCRONIZAR_CADA'],
+                    conf['MARGEN_SINCRONIZACION'],
+                )
+    return _lista
+
+
+def reiniciar_lista():
+    global _lista
+    with _lista_lock:
+        _lista = None
+
+
+@receiver(setting_changed)
+def _reiniciar_si_cambia_config(*, setting, **kwargs):
+    if setting == 'USUARIO_REVOCACION':
+        reiniciar_lista()
+
+
+# --- API pública ---
+
+def esta_revocado(jti):
+    return obtener_lista().esta_revocado(jti)
+
+
+def revocar(jti, expira):
+    return obtener_lista().revocar(jti, expira)
+
+
+def estadisticas():
+    return obtener_lista().estadisticas()
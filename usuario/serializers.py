@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import Usuario 
+# Campos que se devuelven en las respuestas; las lecturas usan usuario/proyecciones.py
+from .proyecciones import CAMPOS_LECTURA
 
 class UsuarioSerializer(serializers.ModelSerializer):
     
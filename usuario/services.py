@@ -1,7 +1,34 @@
 from usuario.repositories import UsuarioRepository
-from usuario.models import Usuario # 💡 Necesario para crear/cifrar
+from usuario.models import Usuario, limpiar_email, normalizar_email # 💡 Necesario para crear/cifrar
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken 
-from django.contrib.auth.hashers import make_password # Para cifrar contraseñas
+from usuario import hashing # Hashing de contraseñas en un pool de procesos acotado
+from usuario import cache
+from usuario import throttling
+from usuario import timing # Fases para la cabecera Server-Timing
+from usuario import revocacion # Refresh tokens ya rotados (filtro de Bloom + tabla)
+from usuario import eventos # Outbox de cambios de usuarios
+from usuario import permisos # Bitset de permisos para los tokens
+from usuario.authentication import cargar_snapshot
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from datetime import datetime, timezone
+import json
+
+# Mensajes de error compartidos por el registro individual y el masivo
+MENSAJE_CAMPOS_OBLIGATORIOS = "Email y contraseña son obligatorios"
+MENSAJE_EMAIL_DUPLICADO = "El email ya está registrado."
+MENSAJE_DNI_DUPLICADO = "El DNI ya está registrado."
+MENSAJE_LINEA_INVALIDA = "La línea no es un objeto JSON válido."
+
+# Restricciones únicas de la tabla de usuarios por nombre (PostgreSQL): las de
+# `unique=True` con el nombre que les da PostgreSQL y el índice de LOWER(email)
+RESTRICCIONES_EMAIL = {'usuario_usuario_email_key', 'usuario_email_lower_unico'}
+RESTRICCIONES_DNI = {'usuario_usuario_dni_key'}
+
+# Filas por lote en el registro masivo (un SELECT de duplicados + un INSERT por lote)
+TAM_LOTE_BULK = 500
 
 class UsuarioService:
     
@@ -9,25 +36,116 @@ class UsuarioService:
     
     @staticmethod
     def generar_tokens_para_usuario(user):
-        refresh = RefreshToken.for_user(user)
-        return {
-            'access': str(refresh.access_token), #  Nombrar como 'access' (estándar JWT)
-            'refresh': str(refresh)              #  Nombrar como 'refresh' (estándar JWT)
-        }
+        with timing.medir('jwt'):
+            refresh = RefreshToken.for_user(user)
+            # Claims que usa SnapshotJWTAuthentication para no consultar la BD
+            # (el access token los copia del refresh).
+            refresh['username'] = user.username
+            refresh['is_staff'] = user.is_staff
+            # Permisos para autorizar sin consultas, aquí y en otros servicios (usuario/permisos.py)
+            refresh['is_superuser'] = user.is_superuser
+            refresh[permisos.CLAIM] = user.permisos or ''
+            return {
+                'access': str(refresh.access_token), #  Nombrar como 'access' (estándar JWT)
+                'refresh': str(refresh)              #  Nombrar como 'refresh' (estándar JWT)
+            }
+
+    @staticmethod
+    def refrescar_tokens(refresh: str):
+        """
+        Rota el refresh token: revoca el recibido y devuelve un par nuevo.
+        Si el token no estaba revocado la única consulta es el INSERT de la
+        revocación; el usuario sale de la instantánea cacheada.
+        """
+        try:
+            token = RefreshToken(refresh)
+        except TokenError:
+            raise ValueError("Token inválido o expirado.")
+
+        jti = token[api_settings.JTI_CLAIM]
+        if revocacion.esta_revocado(jti):
+            raise ValueError("Token revocado.")
+
+        snapshot = cache.obtener_snapshot(token[api_settings.USER_ID_CLAIM], cargar_snapshot)
+        if snapshot is None or not snapshot['is_active']:
+            raise ValueError("Usuario no encontrado o inactivo.")
+
+        # Dos peticiones con el mismo token: solo una consigue insertar el jti
+        if not revocacion.revocar(jti, datetime.fromtimestamp(token['exp'], tz=timezone.utc)):
+            raise ValueError("Token revocado.")
+
+        with timing.medir('jwt'):
+            token.set_jti()
+            token.set_iat()
+            token.set_exp()
+            token['username'] = snapshot['username']
+            token['is_staff'] = snapshot['is_staff']
+            # De la instantánea: los cambios de permisos llegan con cada refresco
+            token['is_superuser'] = snapshot['is_superuser']
+            token[permisos.CLAIM] = snapshot['permisos'] or ''
+            return {
+                'access': str(token.access_token),
+                'refresh': str(token),
+            }
         
     @staticmethod
-    def autenticar_usuario(email: str, password: str):
+    def autenticar_usuario(email: str, password: str, ip: str = None):
+        # Límite de intentos fallidos por email e IP: se comprueba antes de tocar
+        # la BD o calcular el hash (puede lanzar LoginBloqueado).
+        throttling.verificar_intento(email, ip)
+
         try:
-            user = Usuario.objects.get(email=email)
+            # Sin distinguir mayúsculas, por el índice único de LOWER(email)
+            user = Usuario.objects.por_email(email).get()
         except Usuario.DoesNotExist:
+            throttling.registrar_fallo(email, ip)
             raise ValueError("Credenciales inválidas.")
 
-        # Verificar contraseña
-        if not user.check_password(password):
+        # Verificar contraseña (en el pool de hashing, puede lanzar PoolHashSaturado)
+        valida, rehash = hashing.verificar_y_rehashear(password, user.password)
+        if not valida:
+            throttling.registrar_fallo(email, ip)
             raise ValueError("Credenciales inválidas.")
-        
-        #  Aquí va lógica de negocio adicional (ej. Verificar intentos de login fallidos)
 
+        if rehash:
+            # Hash con parámetros antiguos: se actualiza solo si nadie lo cambió entretanto.
+            Usuario.objects.filter(pk=user.pk, password=user.password).update(password=rehash)
+            cache.invalidar_usuario(user.pk)
+
+        throttling.registrar_exito(email)
+
+        return UsuarioService._respuesta_login(user)
+
+    @staticmethod
+    async def aautenticar_usuario(email: str, password: str, ip: str = None):
+        """
+        Versión asíncrona de `autenticar_usuario` (vistas ASGI). La consulta usa
+        el ORM asíncrono y el hash se espera sin bloquear el bucle de eventos;
+        el límite de intentos y la caché siguen siendo síncronos.
+        """
+        await sync_to_async(throttling.verificar_intento)(email, ip)
+
+        try:
+            user = await Usuario.objects.por_email(email).aget()
+        except Usuario.DoesNotExist:
+            await sync_to_async(throttling.registrar_fallo)(email, ip)
+            raise ValueError("Credenciales inválidas.")
+
+        valida, rehash = await hashing.averificar_y_rehashear(password, user.password)
+        if not valida:
+            await sync_to_async(throttling.registrar_fallo)(email, ip)
+            raise ValueError("Credenciales inválidas.")
+
+        if rehash:
+            await Usuario.objects.filter(pk=user.pk, password=user.password).aupdate(password=rehash)
+            await sync_to_async(cache.invalidar_usuario)(user.pk)
+
+        await sync_to_async(throttling.registrar_exito)(email)
+
+        return UsuarioService._respuesta_login(user)
+
+    @staticmethod
+    def _respuesta_login(user):
         tokens = UsuarioService.generar_tokens_para_usuario(user)
 
         return {
@@ -43,32 +161,220 @@ class UsuarioService:
         # El repositorio ya devuelve None si no encuentra, lo cual es correcto aquí.
         return UsuarioRepository.obtener_por_id(id) 
     
+    @staticmethod
+    def obtener_version_usuario(id):
+        # Revalidación con If-None-Match: solo updated_at, sin cargar ni serializar la fila
+        return UsuarioRepository.obtener_version(id)
+
+    @staticmethod
+    def obtener_usuarios_lote(ids=None, emails=None):
+        """
+        Busca un lote de usuarios por id o por email. Devuelve
+        (encontrados en el orden pedido, claves que no existen).
+        """
+        if emails is not None:
+            claves = list(dict.fromkeys(normalizar_email(email) for email in emails))
+            encontrados = UsuarioRepository.obtener_lecturas_por_email(claves)
+        else:
+            claves = list(dict.fromkeys(ids))
+            encontrados = UsuarioRepository.obtener_lecturas(claves)
+        return (
+            [encontrados[clave] for clave in claves if clave in encontrados],
+            [clave for clave in claves if clave not in encontrados],
+        )
+
     @staticmethod
     def listar_usuarios():
         return UsuarioRepository.listar()
+
+    @staticmethod
+    def listar_usuarios_pagina(cursor=None, limite=50):
+        # Se pide una fila de más para saber si existe una página siguiente.
+        usuarios = UsuarioRepository.listar_pagina(cursor, limite + 1)
+        siguiente = usuarios[limite - 1].id if len(usuarios) > limite else None
+        return usuarios[:limite], siguiente
+
+    @staticmethod
+    def buscar_usuarios(prefijo, campos, cursor=None, limite=50):
+        usuarios = UsuarioRepository.buscar_pagina(prefijo, campos, cursor, limite + 1)
+        siguiente = usuarios[limite - 1].id if len(usuarios) > limite else None
+        return usuarios[:limite], siguiente
+
+    @staticmethod
+    def iterar_usuarios(campos, cursor=None):
+        return UsuarioRepository.iterar(campos, despues_de=cursor)
+
+    @staticmethod
+    def iterar_usuarios_lectura(cursor=None):
+        return UsuarioRepository.iterar_lectura(despues_de=cursor)
     
+    @staticmethod
+    def exportar_usuarios(campos, cursor=None, desde=None, chunk_size=2000):
+        return UsuarioRepository.iterar_exportacion(campos, despues_de=cursor, desde=desde, chunk_size=chunk_size)
+
     @staticmethod
     def crear_usuario(datos):
         #  Lógica de Negocio (Validaciones)
         if 'email' not in datos or 'password' not in datos:
-            raise ValueError("Email y contraseña son obligatorios")
-        
-        #  Verificar si el email ya existe (el campo 'unique=True' lo hará en la BD, 
-        # pero es mejor validarlo antes de guardar para un mejor mensaje de error)
-        if Usuario.objects.filter(email=datos['email']).exists():
-            raise ValueError("El email ya está registrado.")
+            raise ValueError(MENSAJE_CAMPOS_OBLIGATORIOS)
         
         # 1.  Crear la instancia y cifrar
         usuario = Usuario(
             username=datos.get('username'),
-            email=datos.get('email'),
+            email=limpiar_email(datos.get('email')),
+            dni=datos.get('dni'),
+            password=hashing.hashear(datos['password']),
+        )
+        return UsuarioService._insertar_nuevo(usuario)
+
+    @staticmethod
+    async def acrear_usuario(datos):
+        """Versión asíncrona de `crear_usuario` (vistas ASGI)."""
+        if 'email' not in datos or 'password' not in datos:
+            raise ValueError(MENSAJE_CAMPOS_OBLIGATORIOS)
+
+        usuario = Usuario(
+            username=datos.get('username'),
+            email=limpiar_email(datos.get('email')),
             dni=datos.get('dni'),
-            password=make_password(datos['password']),
+            password=await hashing.ahashear(datos['password']),
         )
-        # 2.  Guardar en la base de datos (ya cifrado)
-        usuario.save()
+        # No `asave()`: las transacciones aún no funcionan en modo asíncrono y el
+        # INSERT necesita su savepoint para no romper una transacción exterior.
+        return await sync_to_async(UsuarioService._insertar_nuevo)(usuario)
+
+    @staticmethod
+    def _insertar_nuevo(usuario):
+        # Un solo INSERT: los duplicados los detectan los índices únicos de email/dni
+        # y se traducen al mismo mensaje que antes daba la consulta previa.
+        # El evento 'created' va en la misma transacción (outbox).
+        try:
+            with transaction.atomic():
+                usuario.save(force_insert=True)
+                eventos.registrar_creados([usuario])
+        except IntegrityError as e:
+            raise ValueError(UsuarioService._mensaje_integridad(e))
+        cache.invalidar_usuario(usuario.pk)
         return usuario
 
+    @staticmethod
+    def crear_usuarios_bulk(lineas, tam_lote=TAM_LOTE_BULK):
+        """
+        Registro masivo a partir de líneas NDJSON (bytes o str).
+
+        Genera un resultado por línea, en orden: {'linea': n, 'id': id} si se creó
+        o {'linea': n, 'error': mensaje} con el mismo texto que `crear_usuario`.
+        Solo mantiene en memoria un lote de `tam_lote` líneas a la vez.
+        """
+        lote = []
+        for numero, linea in enumerate(lineas, start=1):
+            if not linea.strip():
+                continue
+            lote.append((numero, linea))
+            if len(lote) >= tam_lote:
+                yield from UsuarioService._procesar_lote_bulk(lote)
+                lote = []
+        if lote:
+            yield from UsuarioService._procesar_lote_bulk(lote)
+
+    @staticmethod
+    def _procesar_lote_bulk(lote):
+        resultados = {}
+        validos = []  # (numero, datos)
+        for numero, linea in lote:
+            try:
+                datos = json.loads(linea)
+            except ValueError:
+                datos = None
+            if not isinstance(datos, dict):
+                resultados[numero] = {'linea': numero, 'error': MENSAJE_LINEA_INVALIDA}
+            elif 'email' not in datos or 'password' not in datos:
+                resultados[numero] = {'linea': numero, 'error': MENSAJE_CAMPOS_OBLIGATORIOS}
+            else:
+                validos.append((numero, datos))
+
+        # Duplicados contra la BD (una consulta por campo) y dentro del propio lote
+        emails_usados = {normalizar_email(email) for email in Usuario.todos.por_emails(
+            [datos['email'] for _, datos in validos]
+        ).values_list('email', flat=True)}
+        dnis_usados = set(Usuario.todos.filter(
+            dni__in=[datos.get('dni') for _, datos in validos]
+        ).values_list('dni', flat=True))
+        pendientes = []
+        for numero, datos in validos:
+            email = normalizar_email(datos['email'])
+            if email in emails_usados:
+                resultados[numero] = {'linea': numero, 'error': MENSAJE_EMAIL_DUPLICADO}
+            elif datos.get('dni') is not None and datos['dni'] in dnis_usados:
+                resultados[numero] = {'linea': numero, 'error': MENSAJE_DNI_DUPLICADO}
+            else:
+                emails_usados.add(email)
+                dnis_usados.add(datos.get('dni'))
+                pendientes.append((numero, datos))
+
+        # Hash en paralelo en el pool y un solo INSERT por lote
+        hashes = hashing.hashear_lote([datos['password'] for _, datos in pendientes])
+        usuarios = [
+            Usuario(
+                username=datos.get('username'),
+                email=limpiar_email(datos['email']),
+                dni=datos.get('dni'),
+                password=encoded,
+            )
+            for (_, datos), encoded in zip(pendientes, hashes)
+        ]
+        try:
+            with transaction.atomic():
+                Usuario.objects.bulk_create(usuarios)
+                eventos.registrar_creados(usuarios)
+        except IntegrityError:
+            # Otro registro concurrente ganó la carrera: se inserta fila a fila.
+            UsuarioService._insertar_uno_a_uno(usuarios)
+        for usuario in usuarios:
+            if usuario.pk is not None:
+                cache.invalidar_usuario(usuario.pk)
+
+        for (numero, _), usuario in zip(pendientes, usuarios):
+            if usuario.pk is not None:
+                resultados[numero] = {'linea': numero, 'id': usuario.pk}
+            else:
+                resultados[numero] = {'linea': numero, 'error': usuario._error_bulk}
+
+        for numero, _ in lote:
+            yield resultados[numero]
+
+    @staticmethod
+    def _insertar_uno_a_uno(usuarios):
+        for usuario in usuarios:
+            usuario.pk = None
+            try:
+                with transaction.atomic():
+                    usuario.save(force_insert=True)
+                    eventos.registrar_creados([usuario])
+            except IntegrityError as e:
+                usuario.pk = None
+                usuario._error_bulk = UsuarioService._mensaje_integridad(e)
+
+    @staticmethod
+    def _mensaje_integridad(error):
+        # Traduce la violación de unicidad de la BD al mensaje de `crear_usuario`.
+        # PostgreSQL da el nombre de la restricción; su texto no sirve porque el
+        # DETAIL lleva el valor repetido (un email puede contener "dni").
+        restriccion = getattr(getattr(error.__cause__, 'diag', None), 'constraint_name', None)
+        if restriccion in RESTRICCIONES_DNI:
+            return MENSAJE_DNI_DUPLICADO
+        if restriccion in RESTRICCIONES_EMAIL:
+            return MENSAJE_EMAIL_DUPLICADO
+        if restriccion is None:
+            # SQLite: "UNIQUE constraint failed: tabla.columna" o "index '<nombre>'"
+            texto = str(error)
+            tabla = Usuario._meta.db_table
+            if f'{tabla}.dni' in texto:
+                return MENSAJE_DNI_DUPLICADO
+            if f'{tabla}.email' in texto or any(nombre in texto for nombre in RESTRICCIONES_EMAIL):
+                return MENSAJE_EMAIL_DUPLICADO
+        return str(error)
+
     @staticmethod
     def actualizar_usuario(id, datos):
         # Lógica de Servicio: Si actualizan la contraseña, debe ser cifrada.
@@ -1,11 +1,52 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, AsyncRequestFactory, override_settings
 from django.urls import reverse
-from django.contrib.auth.hashers import make_password
-from usuario.models import Usuario
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, check_password
+from django.contrib.auth.models import Group, Permission
+from usuario import hashing
+from usuario import cache as cache_usuarios
+from usuario import throttling
+from usuario import timing
+from usuario import metricas
+from usuario import proyecciones
+from usuario import arranque
+from usuario import revocacion
+from usuario import eventos
+from usuario import exportacion
+from usuario import importacion
+from usuario import permisos
+from usuario.serializers import UsuarioSerializer
+from rest_framework.renderers import JSONRenderer
+from prometheus_client import REGISTRY
+import subprocess
+import sys
+from unittest import mock
+from django.core.cache import caches
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from servicio_usuario.db.base import DatabaseWrapper, estadisticas_checkout
+from usuario.authentication import SnapshotJWTAuthentication
+from rest_framework.test import APIRequestFactory
+import threading
+from usuario.models import EventoUsuario, PermisoBit, TokenRevocado, Usuario
 from usuario.services import UsuarioService
 from usuario.repositories import UsuarioRepository
+from usuario.views import alogin_view, aregister_view
 from rest_framework import status
+import csv
+import gzip
 import json
+import importlib
+import io
+import os
+import tempfile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from datetime import timedelta
+import urllib.error
+import uuid
 
 
 class UsuarioModelTests(TestCase):
@@ -386,4 +427,2123 @@ class RegisterViewTests(TestCase):
     def test_register_metodo_get_no_permitido(self):
         """Prueba que GET no está permitido en register"""
         response = self.client.get(reverse('register'))
-        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class PoolHashTests(TestCase):
+    """Pruebas para el pool de hashing con control de admisión"""
+
+    def setUp(self):
+        self.client = Client()
+        self.usuario = Usuario.objects.create_user(
+            email='pool@example.com',
+            username='Pool User',
+            dni='15151515P',
+            password='password123'
+        )
+
+    def tearDown(self):
+        hashing.reiniciar_pool()
+
+    def _ocupar_cola(self):
+        """Consume todos los permisos del pool para simular una cola llena"""
+        pool = hashing.obtener_pool()
+        for _ in range(pool.capacidad):
+            pool._permisos.acquire()
+        self.addCleanup(lambda: [pool._permisos.release() for _ in range(pool.capacidad)])
+        return pool
+
+    def test_hashear_y_verificar_en_proceso(self):
+        """Prueba que el hash inline sea verificable y cuente estadísticas"""
+        encoded = hashing.hashear('secreto123')
+        self.assertTrue(hashing.verificar('secreto123', encoded))
+        self.assertFalse(hashing.verificar('otro', encoded))
+        stats = hashing.estadisticas()
+        self.assertEqual(stats['completadas'], 3)
+        self.assertEqual(stats['profundidad_cola'], 0)
+        self.assertGreater(stats['hash_total_s'], 0)
+
+    @override_settings(USUARIO_HASH_POOL={'WORKERS': 1, 'MAX_COLA': 1, 'RETRY_AFTER': 1})
+    def test_hashear_en_pool_de_procesos(self):
+        """Prueba que el hash se calcule en un proceso del pool"""
+        encoded = hashing.hashear('secreto123')
+        self.assertTrue(check_password('secreto123', encoded))
+        self.assertEqual(hashing.estadisticas()['workers'], 1)
+
+    @override_settings(USUARIO_HASH_POOL={'WORKERS': 0, 'MAX_COLA': 0, 'RETRY_AFTER': 7})
+    def test_cola_llena_rechaza(self):
+        """Prueba que con la cola llena se rechace sin esperar"""
+        self._ocupar_cola()
+        with self.assertRaises(hashing.PoolHashSaturado) as context:
+            hashing.hashear('secreto123')
+        self.assertEqual(context.exception.retry_after, 7)
+        self.assertEqual(hashing.estadisticas()['rechazadas'], 1)
+
+    @override_settings(USUARIO_HASH_POOL={'WORKERS': 0, 'MAX_COLA': 0, 'RETRY_AFTER': 3})
+    def test_login_con_cola_llena_devuelve_503(self):
+        """Prueba que login responda 503 con Retry-After si el pool está saturado"""
+        self._ocupar_cola()
+        response = self.client.post(
+            reverse('login'),
+            data=json.dumps({'email': 'pool@example.com', 'password': 'password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+
+    @override_settings(USUARIO_HASH_POOL={'WORKERS': 0, 'MAX_COLA': 0, 'RETRY_AFTER': 3})
+    def test_register_con_cola_llena_devuelve_503(self):
+        """Prueba que register responda 503 con Retry-After si el pool está saturado"""
+        self._ocupar_cola()
+        response = self.client.post(
+            reverse('register'),
+            data=json.dumps({
+                'email': 'saturado@example.com',
+                'username': 'Saturado',
+                'dni': '16161616Q',
+                'password': 'password123'
+            }),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertFalse(Usuario.objects.filter(email='saturado@example.com').exists())
+
+
+class RegisterBulkViewTests(TestCase):
+    """Pruebas para el registro masivo NDJSON"""
+
+    def setUp(self):
+        self.client = Client()
+        Usuario.objects.create_user(
+            email='existe@example.com',
+            username='Existe',
+            dni='17171717R',
+            password='password123'
+        )
+        admin = Usuario.objects.create(
+            email='admin-bulk@example.com', username='Admin', dni='AB0', password='!', is_staff=True
+        )
+        token = UsuarioService.generar_tokens_para_usuario(admin)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def _enviar(self, lineas):
+        response = self.client.post(
+            reverse('register-bulk'),
+            data='\n'.join(lineas).encode(),
+            content_type='application/x-ndjson',
+            **self.auth
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        contenido = b''.join(response.streaming_content).decode()
+        return [json.loads(linea) for linea in contenido.splitlines()]
+
+    def test_registro_masivo_resultado_por_linea(self):
+        """Prueba que cada línea reciba su id o el error de crear_usuario"""
+        resultados = self._enviar([
+            json.dumps({'email': 'a@example.com', 'username': 'A', 'dni': '1A', 'password': 'pass-a'}),
+            json.dumps({'email': 'existe@example.com', 'username': 'B', 'dni': '2B', 'password': 'pass-b'}),
+            json.dumps({'username': 'C', 'dni': '3C', 'password': 'pass-c'}),
+            'esto no es json',
+            json.dumps({'email': 'a@example.com', 'username': 'D', 'dni': '4D', 'password': 'pass-d'}),
+            json.dumps({'email': 'e@example.com', 'username': 'E', 'dni': '17171717R', 'password': 'pass-e'}),
+        ])
+        self.assertEqual([r['linea'] for r in resultados], [1, 2, 3, 4, 5, 6])
+        creado = Usuario.objects.get(email='a@example.com')
+        self.assertEqual(resultados[0], {'linea': 1, 'id': creado.id})
+        self.assertTrue(creado.check_password('pass-a'))
+        self.assertEqual(resultados[1]['error'], "El email ya está registrado.")
+        self.assertEqual(resultados[2]['error'], "Email y contraseña son obligatorios")
+        self.assertIn('error', resultados[3])
+        self.assertEqual(resultados[4]['error'], "El email ya está registrado.")
+        self.assertEqual(resultados[5]['error'], "El DNI ya está registrado.")
+
+    async def test_registro_masivo_bajo_asgi(self):
+        """Prueba que bajo ASGI los resultados se envíen con un iterador asíncrono, línea a línea"""
+        lineas = [
+            json.dumps({'email': f'asgi{i}@example.com', 'username': f'A{i}', 'dni': f'AS{i}', 'password': 'x'})
+            for i in range(3)
+        ]
+        response = await AsyncClient().post(
+            reverse('register-bulk'), data='\n'.join(lineas).encode(), content_type='application/x-ndjson',
+            headers={'Authorization': self.auth['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        contenido = b''.join([trozo async for trozo in response.streaming_content]).decode()
+        resultados = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual([resultado['linea'] for resultado in resultados], [1, 2, 3])
+        self.assertTrue(all('id' in resultado for resultado in resultados))
+
+    def test_requiere_staff(self):
+        """Prueba que el registro masivo no sea anónimo ni para usuarios finales"""
+        linea = json.dumps({'email': 'anon@example.com', 'username': 'Anon', 'dni': '9Z', 'password': 'x'}).encode()
+        response = self.client.post(reverse('register-bulk'), data=linea, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        token = UsuarioService.generar_tokens_para_usuario(Usuario.objects.get(email='existe@example.com'))['access']
+        response = self.client.post(
+            reverse('register-bulk'), data=linea, content_type='application/x-ndjson',
+            HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Usuario.objects.filter(email='anon@example.com').exists())
+
+    def test_registro_masivo_en_varios_lotes(self):
+        """Prueba que los lotes se inserten con bulk_create y conserven el orden"""
+        lineas = (
+            json.dumps({'email': f'lote{i}@example.com', 'username': f'L{i}', 'dni': f'L{i}', 'password': 'x'})
+            for i in range(7)
+        )
+        resultados = list(UsuarioService.crear_usuarios_bulk(lineas, tam_lote=3))
+        self.assertEqual([r['linea'] for r in resultados], list(range(1, 8)))
+        self.assertTrue(all('id' in r for r in resultados))
+        self.assertEqual(Usuario.objects.filter(email__startswith='lote').count(), 7)
+
+    def test_registro_masivo_linea_demasiado_larga(self):
+        """Prueba que una línea gigante no se cargue entera y falle sola"""
+        from usuario import views
+        largo = json.dumps({'email': 'x' * (views.MAX_LINEA_BULK * 2), 'password': 'x'})
+        resultados = self._enviar([
+            largo,
+            json.dumps({'email': 'corta@example.com', 'username': 'C', 'dni': '5E', 'password': 'x'}),
+        ])
+        self.assertEqual(len(resultados), 2)
+        self.assertIn('error', resultados[0])
+        self.assertIn('id', resultados[1])
+
+
+class UsuariosListViewTests(TestCase):
+    """Pruebas para el listado paginado por cursor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password('password123')
+        cls.admin = Usuario.objects.create(
+            email='admin-lista@example.com', username='Admin', dni='A0', password=password, is_staff=True
+        )
+        Usuario.objects.bulk_create([
+            Usuario(email=f'lista{i}@example.com', username=f'Lista {i}', dni=f'D{i}', password=password)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.client = Client()
+        token = UsuarioService.generar_tokens_para_usuario(self.admin)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_requiere_staff(self):
+        """Prueba que el listado no sea público"""
+        response = self.client.get(reverse('usuarios'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_paginacion_por_cursor(self):
+        """Prueba que las páginas se encadenen con next_cursor sin repetir filas"""
+        vistos = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get(reverse('usuarios'), {'limit': 2, 'cursor': cursor}, **self.auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            datos = response.json()
+            self.assertLessEqual(len(datos['results']), 2)
+            vistos.extend(u['id'] for u in datos['results'])
+            cursor = datos['next_cursor']
+        self.assertEqual(vistos, list(Usuario.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_pagina_no_devuelve_password(self):
+        """Prueba que el listado tenga la forma de UsuarioSerializer"""
+        response = self.client.get(reverse('usuarios'), {'limit': 1}, **self.auth)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'username', 'email', 'dni'})
+
+    def test_parametros_invalidos(self):
+        """Prueba que un cursor o límite inválido devuelva 400"""
+        response = self.client.get(reverse('usuarios'), {'limit': 0}, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('usuarios'), {'cursor': 'abc'}, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listado_en_streaming(self):
+        """Prueba que el modo streaming devuelva todas las filas como un array JSON"""
+        response = self.client.get(reverse('usuarios'), {'stream': '1'}, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        datos = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(datos), Usuario.objects.count())
+        self.assertEqual(datos[0]['email'], 'admin-lista@example.com')
+        self.assertNotIn('password', datos[0])
+
+    async def test_listado_en_streaming_bajo_asgi(self):
+        """Prueba que bajo ASGI el listado completo se envíe con un iterador asíncrono, sin cargarlo entero"""
+        response = await AsyncClient().get(
+            reverse('usuarios'), {'stream': '1'}, headers={'Authorization': self.auth['HTTP_AUTHORIZATION']}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        datos = json.loads(b''.join([trozo async for trozo in response.streaming_content]))
+        self.assertEqual(len(datos), await Usuario.objects.acount())
+
+
+@override_settings(USUARIO_CACHE={'ACTIVA': True, 'MAX_ENTRADAS': 100, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60})
+class UsuarioCacheTests(TestCase):
+    """Pruebas para la caché de lectura de usuarios"""
+
+    def setUp(self):
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+        self.usuario = Usuario.objects.create_user(
+            email='cache@example.com',
+            username='Cache User',
+            dni='18181818S',
+            password='password123'
+        )
+
+    def tearDown(self):
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+
+    def test_segunda_lectura_sin_consultas(self):
+        """Prueba que la segunda lectura salga de la LRU local"""
+        with self.assertNumQueries(1):
+            UsuarioRepository.obtener_por_id(self.usuario.id)
+        with self.assertNumQueries(0):
+            usuario = UsuarioRepository.obtener_por_id(self.usuario.id)
+        self.assertEqual(usuario.email, 'cache@example.com')
+        stats = cache_usuarios.estadisticas()
+        self.assertEqual(stats['fallos'], 1)
+        self.assertEqual(stats['aciertos_local'], 1)
+
+    def test_lectura_desde_cache_compartida(self):
+        """Prueba que otro proceso (LRU local vacía) lea de la caché de Django"""
+        UsuarioRepository.obtener_por_id(self.usuario.id)
+        cache_usuarios.obtener_cache().local.limpiar()
+        with self.assertNumQueries(0):
+            UsuarioRepository.obtener_por_id(self.usuario.id)
+        self.assertEqual(cache_usuarios.estadisticas()['aciertos_compartida'], 1)
+
+    def test_devuelve_copias(self):
+        """Prueba que modificar el objeto devuelto no altere la caché"""
+        usuario = UsuarioRepository.obtener_por_id(self.usuario.id)
+        usuario.username = 'Modificado'
+        self.assertEqual(UsuarioRepository.obtener_por_id(self.usuario.id).username, 'Cache User')
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60})
+    def test_cache_sin_hash_de_password(self):
+        """Prueba que el usuario guardado en la caché compartida no lleve el hash de la contraseña"""
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        self.addCleanup(caches['default'].clear)
+        with CaptureQueriesContext(connection) as consultas:
+            UsuarioRepository.obtener_por_id(self.usuario.id)
+        self.assertNotIn('"password"', consultas.captured_queries[0]['sql'])
+        guardado = caches['default'].get(f'usuario:{self.usuario.id}')
+        self.assertEqual(guardado.email, self.usuario.email)
+        self.assertIn('password', guardado.get_deferred_fields())
+
+    def test_actualizar_invalida(self):
+        """Prueba que actualizar invalide la entrada"""
+        UsuarioRepository.obtener_por_id(self.usuario.id)
+        UsuarioService.actualizar_usuario(self.usuario.id, {'username': 'Nuevo Nombre'})
+        self.assertEqual(UsuarioRepository.obtener_por_id(self.usuario.id).username, 'Nuevo Nombre')
+
+    def test_eliminar_invalida(self):
+        """Prueba que eliminar invalide la entrada"""
+        UsuarioRepository.obtener_por_id(self.usuario.id)
+        UsuarioService.eliminar_usuario(self.usuario.id)
+        self.assertIsNone(UsuarioRepository.obtener_por_id(self.usuario.id))
+
+    def test_lru_desaloja_y_caduca(self):
+        """Prueba el desalojo por tamaño y la caducidad por TTL"""
+        lru = cache_usuarios.LRUConTTL(max_entradas=2, ttl=60)
+        lru.guardar('a', 1)
+        lru.guardar('b', 2)
+        lru.obtener('a')
+        lru.guardar('c', 3)
+        self.assertEqual(lru.obtener('b'), (False, None))
+        self.assertEqual(lru.obtener('a'), (True, 1))
+        self.assertEqual(lru.desalojos, 1)
+        caducada = cache_usuarios.LRUConTTL(max_entradas=2, ttl=-1)
+        caducada.guardar('a', 1)
+        self.assertEqual(caducada.obtener('a'), (False, None))
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 5, 'TTL_COMPARTIDO': 300, 'TTL_SNAPSHOT': 30})
+    def test_locmem_no_alarga_la_cota(self):
+        """Prueba que con una caché por proceso (locmem) el nivel compartido no dure más que el local"""
+        self.assertTrue(cache_usuarios.es_por_proceso('default'))
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        self.assertEqual(cache_usuarios.obtener_cache().ttl_compartido, 5)
+        self.assertEqual(cache_usuarios.obtener_cache('snapshot').ttl_compartido, 5)
+
+    def test_single_flight_agrupa_fallos(self):
+        """Prueba que fallos concurrentes para el mismo id hagan una sola carga"""
+        cache = cache_usuarios.CacheUsuarios(100, 60, 60, 'default', 5)
+        llamadas = []
+        liberar = threading.Event()
+
+        def cargar(id):
+            llamadas.append(id)
+            liberar.wait(5)
+            return self.usuario
+
+        resultados = []
+        hilos = [
+            threading.Thread(target=lambda: resultados.append(cache.obtener(999, cargar)))
+            for _ in range(5)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for _ in range(500):
+            if cache.estadisticas()['consultas_agrupadas'] == 4:
+                break
+            threading.Event().wait(0.01)
+        liberar.set()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(llamadas, [999])
+        self.assertEqual(len(resultados), 5)
+        self.assertTrue(all(u.email == 'cache@example.com' for u in resultados))
+
+    def test_single_flight_propaga_errores(self):
+        """Prueba que si la carga del líder falla, los que esperaban reciban el error y no un None"""
+        cache = cache_usuarios.CacheUsuarios(100, 60, 60, 'default', 5)
+        liberar = threading.Event()
+
+        def cargar(id):
+            liberar.wait(5)
+            raise DatabaseError('BD caída')
+
+        resultados = []
+
+        def obtener():
+            try:
+                resultados.append(cache.obtener(998, cargar))
+            except DatabaseError as e:
+                resultados.append(e)
+
+        hilos = [threading.Thread(target=obtener) for _ in range(3)]
+        for hilo in hilos:
+            hilo.start()
+        for _ in range(500):
+            if cache.estadisticas()['consultas_agrupadas'] == 2:
+                break
+            threading.Event().wait(0.01)
+        liberar.set()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(len(resultados), 3)
+        self.assertTrue(all(isinstance(resultado, DatabaseError) for resultado in resultados))
+
+
+@override_settings(LOGIN_THROTTLE={'ACTIVO': True, 'VENTANA': 60, 'MAX_FALLOS_EMAIL': 3, 'MAX_FALLOS_IP': 5})
+class LoginThrottleTests(TestCase):
+    """Pruebas para el límite de intentos de login fallidos"""
+
+    def setUp(self):
+        caches['default'].clear()
+        throttling.reiniciar_limitador()
+        self.client = Client()
+        self.usuario = Usuario.objects.create_user(
+            email='throttle@example.com',
+            username='Throttle User',
+            dni='19191919T',
+            password='password123'
+        )
+
+    def tearDown(self):
+        caches['default'].clear()
+        throttling.reiniciar_limitador()
+
+    def _login(self, email, password, ip='10.0.0.1'):
+        return self.client.post(
+            reverse('login'),
+            data=json.dumps({'email': email, 'password': password}),
+            content_type='application/json',
+            REMOTE_ADDR=ip
+        )
+
+    def test_bloquea_email_sin_calcular_hash(self):
+        """Prueba que superado el límite por email no se llegue a verificar la contraseña"""
+        for _ in range(3):
+            self.assertEqual(self._login('throttle@example.com', 'mala').status_code, status.HTTP_401_UNAUTHORIZED)
+        with mock.patch('usuario.services.hashing.verificar_y_rehashear') as verificar:
+            response = self._login('throttle@example.com', 'password123')
+            verificar.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_bloqueo_local_evita_la_cache(self):
+        """Prueba que un bloqueo conocido se resuelva sin consultar la caché compartida"""
+        for _ in range(3):
+            self._login('throttle@example.com', 'mala')
+        self._login('throttle@example.com', 'mala')
+        with mock.patch.object(throttling.LimitadorLogin, 'cache', new_callable=mock.PropertyMock) as cache:
+            self.assertEqual(self._login('throttle@example.com', 'mala').status_code, 429)
+            cache.assert_not_called()
+        self.assertEqual(throttling.estadisticas()['rechazos_locales'], 1)
+
+    def test_bloquea_ip(self):
+        """Prueba el límite por IP con emails distintos"""
+        for i in range(5):
+            self._login(f'otro{i}@example.com', 'mala', ip='10.0.0.9')
+        self.assertEqual(self._login('throttle@example.com', 'password123', ip='10.0.0.9').status_code, 429)
+        self.assertEqual(self._login('throttle@example.com', 'password123', ip='10.0.0.10').status_code, 200)
+
+    def test_x_forwarded_for_no_evade_limite_ip(self):
+        """Prueba que cambiar X-Forwarded-For en cada intento no evite el límite por IP"""
+        for i in range(5):
+            self.client.post(
+                reverse('login'),
+                data=json.dumps({'email': f'otro{i}@example.com', 'password': 'mala'}),
+                content_type='application/json',
+                REMOTE_ADDR='10.0.0.30',
+                HTTP_X_FORWARDED_FOR=f'203.0.113.{i}',
+            )
+        response = self.client.post(
+            reverse('login'),
+            data=json.dumps({'email': 'throttle@example.com', 'password': 'password123'}),
+            content_type='application/json',
+            REMOTE_ADDR='10.0.0.30',
+            HTTP_X_FORWARDED_FOR='203.0.113.99',
+        )
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE={
+        'ACTIVO': True, 'VENTANA': 60, 'MAX_FALLOS_EMAIL': 5, 'MAX_FALLOS_IP': 50, 'PROCESOS': 4,
+    })
+    def test_limites_por_worker_con_locmem(self):
+        """Prueba que con una caché por proceso los límites se repartan entre los workers"""
+        limitador = throttling.obtener_limitador()
+        self.assertEqual(limitador.limites, {'email': 1, 'ip': 12})
+        with mock.patch.object(throttling, 'es_por_proceso', return_value=False):
+            throttling.reiniciar_limitador()
+            self.assertEqual(throttling.obtener_limitador().limites, {'email': 5, 'ip': 50})
+
+    def test_login_correcto_reinicia_contador_email(self):
+        """Prueba que un login correcto reinicie los fallos del email"""
+        for _ in range(2):
+            self._login('throttle@example.com', 'mala')
+        self.assertEqual(self._login('throttle@example.com', 'password123').status_code, 200)
+        for _ in range(2):
+            self.assertEqual(self._login('throttle@example.com', 'mala').status_code, 401)
+
+    def test_email_sin_distinguir_mayusculas(self):
+        """Prueba que el contador por email no se evada cambiando mayúsculas"""
+        for email in ('throttle@example.com', 'THROTTLE@example.com', 'Throttle@Example.com'):
+            self._login(email, 'mala', ip='10.0.0.20')
+        self.assertEqual(self._login('throttle@example.com', 'mala', ip='10.0.0.21').status_code, 429)
+
+
+@override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60, 'TTL_SNAPSHOT': 60})
+class SnapshotJWTAuthenticationTests(TestCase):
+    """Pruebas para la autenticación JWT con instantánea cacheada"""
+
+    def setUp(self):
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+        self.client = Client()
+        self.admin = Usuario.objects.create_user(
+            email='jwt@example.com',
+            username='Jwt Admin',
+            dni='20202020U',
+            password='password123'
+        )
+        Usuario.objects.filter(pk=self.admin.pk).update(is_staff=True)
+        self.admin.is_staff = True
+        token = UsuarioService.generar_tokens_para_usuario(self.admin)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def tearDown(self):
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+
+    def test_token_incluye_claims(self):
+        """Prueba que los tokens lleven username e is_staff"""
+        token = AccessToken(self.auth['HTTP_AUTHORIZATION'].split()[1])
+        self.assertEqual(token['username'], 'Jwt Admin')
+        self.assertTrue(token['is_staff'])
+
+    def test_peticion_autenticada_sin_consultas_de_usuario(self):
+        """Prueba que con la instantánea en caché no se consulte la tabla de usuarios"""
+        self.client.get(reverse('usuarios'), {'limit': 1}, **self.auth)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('usuarios'), {'limit': 1}, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Solo la consulta del propio listado
+        self.assertEqual(len(consultas), 1)
+
+    def test_desactivar_usuario_invalida_instantanea(self):
+        """Prueba que desactivar un usuario corte su acceso"""
+        self.assertEqual(self.client.get(reverse('usuarios'), **self.auth).status_code, 200)
+        UsuarioService.actualizar_usuario(self.admin.id, {'is_active': False})
+        self.assertEqual(self.client.get(reverse('usuarios'), **self.auth).status_code, 401)
+
+    def test_quitar_staff_se_refleja(self):
+        """Prueba que is_staff salga de la instantánea y no del claim"""
+        UsuarioService.actualizar_usuario(self.admin.id, {'is_staff': False})
+        self.assertEqual(self.client.get(reverse('usuarios'), **self.auth).status_code, 403)
+
+    def test_usuario_eliminado(self):
+        """Prueba que un token de un usuario eliminado no autentique"""
+        UsuarioService.eliminar_usuario(self.admin.id)
+        self.assertEqual(self.client.get(reverse('usuarios'), **self.auth).status_code, 401)
+
+
+class PoolConexionesTests(TestCase):
+    """Pruebas para la instrumentación del pool de conexiones PostgreSQL"""
+
+    def _wrapper(self, alias):
+        return DatabaseWrapper({'OPTIONS': {'pool': {'max_size': 1}}, 'CONN_HEALTH_CHECKS': False}, alias=alias)
+
+    def test_registra_espera_de_checkout(self):
+        """Prueba que se mida el tiempo de obtener una conexión del pool"""
+        pool = mock.Mock()
+        pool.getconn.side_effect = lambda: threading.Event().wait(0.02) or mock.Mock()
+        pool.get_stats.return_value = {'pool_size': 1}
+        with mock.patch.object(DatabaseWrapper, 'pool', new_callable=mock.PropertyMock, return_value=pool):
+            wrapper = self._wrapper('pool-test')
+            wrapper.get_new_connection({})
+            datos = wrapper.estadisticas_pool()
+        self.assertEqual(datos['checkouts'], 1)
+        self.assertGreaterEqual(datos['espera_total_s'], 0.02)
+        self.assertEqual(datos['pool_size'], 1)
+        self.assertEqual(estadisticas_checkout.obtener('pool-test')['errores'], 0)
+
+    def test_registra_checkout_fallido(self):
+        """Prueba que un timeout del pool cuente como error"""
+        pool = mock.Mock()
+        pool.getconn.side_effect = RuntimeError('pool agotado')
+        with mock.patch.object(DatabaseWrapper, 'pool', new_callable=mock.PropertyMock, return_value=pool):
+            with self.assertRaises(RuntimeError):
+                self._wrapper('pool-error').get_new_connection({})
+        self.assertEqual(estadisticas_checkout.obtener('pool-error')['errores'], 1)
+
+
+def sentencias(consultas):
+    """SQL ejecutado sin los SAVEPOINT que añade TestCase alrededor de atomic()"""
+    return [
+        q['sql'] for q in consultas.captured_queries
+        if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))
+    ]
+
+
+class EscriturasUnaSentenciaTests(TestCase):
+    """Pruebas de número de consultas en las escrituras del repositorio y servicio"""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(
+            email='escritura@example.com',
+            username='Escritura User',
+            dni='21212121V',
+            password='password123'
+        )
+        self.datos = {
+            'email': 'nuevo-escritura@example.com',
+            'username': 'Nuevo',
+            'dni': '22222222W',
+            'password': 'password123'
+        }
+
+    def test_crear_usuario_un_insert(self):
+        """Prueba que crear_usuario haga un solo INSERT (más el del evento) sin exists() previo"""
+        with CaptureQueriesContext(connection) as consultas:
+            UsuarioService.crear_usuario(self.datos)
+        sql = sentencias(consultas)
+        self.assertEqual(len(sql), 2)
+        self.assertTrue(sql[0].startswith('INSERT INTO "usuario_usuario"'))
+        self.assertTrue(sql[1].startswith('INSERT INTO "usuario_eventousuario"'))
+
+    def test_crear_usuario_duplicados_mismo_mensaje(self):
+        """Prueba que los errores de unicidad mantengan los mensajes"""
+        with CaptureQueriesContext(connection) as consultas:
+            with self.assertRaisesMessage(ValueError, "El email ya está registrado."):
+                UsuarioService.crear_usuario({**self.datos, 'email': 'escritura@example.com'})
+        self.assertEqual(len(sentencias(consultas)), 1)
+        with self.assertRaisesMessage(ValueError, "El DNI ya está registrado."):
+            UsuarioService.crear_usuario({**self.datos, 'dni': '21212121V'})
+
+    def test_actualizar_solo_columnas_recibidas(self):
+        """Prueba que actualizar no reescriba toda la fila"""
+        with CaptureQueriesContext(connection) as consultas:
+            UsuarioRepository.actualizar(self.usuario.id, {'username': 'Otro'})
+        updates = [q for q in sentencias(consultas) if q.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        # Solo el SET: el RETURNING devuelve la fila para el evento
+        asignaciones = updates[0].split(' WHERE ')[0]
+        self.assertIn('"username"', asignaciones)
+        self.assertNotIn('"password"', updates[0])
+        self.assertNotIn('"email"', asignaciones)
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60})
+    def test_actualizar_con_cache_una_sentencia(self):
+        """Prueba que con la caché caliente actualizar sea un único UPDATE más su evento"""
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        self.addCleanup(caches['default'].clear)
+        UsuarioRepository.obtener_por_id(self.usuario.id)
+        with CaptureQueriesContext(connection) as consultas:
+            usuario = UsuarioRepository.actualizar(self.usuario.id, {'username': 'Cacheado'})
+        sql = sentencias(consultas)
+        # El UPDATE y el INSERT del evento, sin SELECT
+        self.assertEqual(len(sql), 2)
+        self.assertTrue(sql[0].startswith('UPDATE'))
+        self.assertTrue(sql[1].startswith('INSERT INTO "usuario_eventousuario"'))
+        self.assertEqual(usuario.username, 'Cacheado')
+        self.assertEqual(Usuario.objects.get(pk=self.usuario.id).username, 'Cacheado')
+
+    def test_actualizar_inexistente(self):
+        """Prueba que actualizar un id inexistente devuelva None"""
+        self.assertIsNone(UsuarioRepository.actualizar(9999, {'username': 'X'}))
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60})
+    def test_evento_con_la_fila_actual(self):
+        """Prueba que el evento lleve la fila de la BD aunque la caché local esté anticuada, y no se emita para una baja"""
+        caches['default'].clear()
+        cache_usuarios.reiniciar_cache()
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        self.addCleanup(caches['default'].clear)
+        UsuarioRepository.obtener_por_id(self.usuario.id)
+        # Otro worker cambia el dni sin que esta caché local se entere
+        Usuario.objects.filter(pk=self.usuario.id).update(dni='NUEVO1')
+        usuario = UsuarioRepository.actualizar(self.usuario.id, {'username': 'Fresco'})
+        self.assertEqual((usuario.username, usuario.dni), ('Fresco', 'NUEVO1'))
+        evento = EventoUsuario.objects.filter(user_id=self.usuario.id, event_type=EventoUsuario.ACTUALIZADO).get()
+        self.assertEqual(evento.payload['dni'], 'NUEVO1')
+        self.assertEqual(evento.payload['username'], 'Fresco')
+
+        UsuarioRepository.eliminar(self.usuario.id)
+        self.assertIsNone(UsuarioRepository.actualizar(self.usuario.id, {'username': 'Zombi'}))
+        self.assertEqual(EventoUsuario.objects.filter(event_type=EventoUsuario.ACTUALIZADO).count(), 1)
+        self.assertEqual(Usuario.todos.get(pk=self.usuario.id).username, 'Fresco')
+
+    def test_eliminar_sin_select(self):
+        """Prueba que eliminar sea un único UPDATE de la baja más su evento, sin tocar las filas M2M"""
+        self.usuario.groups.add(Group.objects.create(name='clientes'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertTrue(UsuarioRepository.eliminar(self.usuario.id))
+        sql = sentencias(consultas)
+        self.assertEqual(len(sql), 2)
+        self.assertTrue(sql[0].startswith('UPDATE "usuario_usuario" SET "deleted_at"'))
+        self.assertTrue(sql[1].startswith('INSERT INTO "usuario_eventousuario"'))
+        self.assertFalse(Usuario.objects.filter(pk=self.usuario.id).exists())
+        self.assertTrue(Usuario.groups.through.objects.filter(usuario_id=self.usuario.id).exists())
+
+
+class CalibracionHasherTests(TestCase):
+    """Pruebas para la calibración del hasher y el rehash en el login"""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(
+            email='rehash@example.com',
+            username='Rehash User',
+            dni='23232323X',
+            password='password123'
+        )
+
+    def test_hasher_usa_iteraciones_configuradas(self):
+        """Prueba que los hashes nuevos usen PBKDF2_ITERACIONES"""
+        with self.settings(PBKDF2_ITERACIONES=1234):
+            self.assertTrue(make_password('x').startswith('pbkdf2_sha256$1234$'))
+
+    def test_login_rehashea_parametros_antiguos(self):
+        """Prueba que un login correcto actualice un hash con iteraciones antiguas"""
+        with self.settings(PBKDF2_ITERACIONES=2000):
+            UsuarioService.autenticar_usuario('rehash@example.com', 'password123')
+        usuario = Usuario.objects.get(pk=self.usuario.pk)
+        self.assertTrue(usuario.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(usuario.check_password('password123'))
+
+    def test_login_fallido_no_rehashea(self):
+        """Prueba que un login fallido no toque el hash"""
+        antes = self.usuario.password
+        with self.settings(PBKDF2_ITERACIONES=2000):
+            with self.assertRaises(ValueError):
+                UsuarioService.autenticar_usuario('rehash@example.com', 'mala')
+        self.assertEqual(Usuario.objects.get(pk=self.usuario.pk).password, antes)
+
+    def test_login_sin_cambios_no_escribe(self):
+        """Prueba que sin parámetros nuevos el login no haga UPDATE"""
+        with CaptureQueriesContext(connection) as consultas:
+            UsuarioService.autenticar_usuario('rehash@example.com', 'password123')
+        self.assertFalse([q for q in sentencias(consultas) if q.startswith('UPDATE')])
+
+    def test_comando_calibrar_escribe_configuracion(self):
+        """Prueba que el comando escriba el JSON e informe de los pendientes"""
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = os.path.join(directorio, 'hasher.json')
+            stdout = io.StringIO()
+            call_command(
+                'calibrar_hasher', objetivo_ms=1, muestras=1, minimo=1000, salida=salida,
+                stdout=stdout, stderr=io.StringIO()
+            )
+            with open(salida) as archivo:
+                config = json.load(archivo)
+        informe = json.loads(stdout.getvalue())
+        self.assertEqual(config['algoritmo'], 'pbkdf2_sha256')
+        self.assertGreaterEqual(config['iteraciones'], 1000)
+        self.assertIn('pbkdf2_sha256', informe['hashers'])
+        self.assertEqual(informe['usuarios_total'], 1)
+        esperados = 0 if config['iteraciones'] == 1000 else 1
+        self.assertEqual(informe['usuarios_con_parametros_antiguos'], esperados)
+
+
+class BenchUsuarioCommandTests(TransactionTestCase):
+    """Pruebas para el comando de benchmark de carga"""
+
+    def test_informe_por_escenario(self):
+        """Prueba que cada escenario informe req/s, percentiles y consultas, y que limpie los datos"""
+        stdout = io.StringIO()
+        # La BD de tests en SQLite es en memoria con caché compartida: ahí dos
+        # transacciones de escritura a la vez fallan con "database table is
+        # locked" en lugar de esperarse, así que los hilos van de uno en uno.
+        concurrencia = 1 if connection.vendor == 'sqlite' else 2
+        call_command('bench_usuario', usuarios=5, peticiones=4, concurrencia=concurrencia, stdout=stdout)
+        informe = json.loads(stdout.getvalue())
+        self.assertEqual(informe['bd'], connection.vendor)
+        self.assertEqual(set(informe['escenarios']), {'login', 'register', 'lookup', 'search'})
+        for resultado in informe['escenarios'].values():
+            self.assertEqual(resultado['peticiones'], 4)
+            self.assertEqual(resultado['errores'], 0)
+            self.assertIsNotNone(resultado['p99_ms'])
+        self.assertEqual(informe['escenarios']['login']['consultas_por_peticion'], 1.0)
+        self.assertTrue(informe['planes']['search'])
+        self.assertFalse(Usuario.objects.filter(email__startswith='bench-').exists())
+
+    def test_dni_cabe_en_el_campo(self):
+        """Prueba que los DNI del benchmark quepan en la columna aunque haya millones de usuarios"""
+        from usuario.management.commands.bench_usuario import dni_bench
+        max_dni = Usuario._meta.get_field('dni').max_length
+        prefijo = f'bench-ataque-{uuid.uuid4().hex[:8]}-'
+        self.assertLessEqual(len(dni_bench(prefijo, 10 ** 9 - 1, 'R')), max_dni)
+        self.assertNotEqual(dni_bench(prefijo, 1), dni_bench(prefijo, 1, 'R'))
+
+
+class ServerTimingMiddlewareTests(TestCase):
+    """Pruebas para el desglose de tiempos por petición"""
+
+    def setUp(self):
+        self.client = Client()
+        Usuario.objects.create_user(
+            email='timing@example.com', username='Timing', dni='55555555T', password='password123'
+        )
+
+    def login(self):
+        return self.client.post(
+            reverse('login'),
+            data=json.dumps({'email': 'timing@example.com', 'password': 'password123'}),
+            content_type='application/json'
+        )
+
+    @override_settings(SERVER_TIMING_CABECERA=True)
+    def test_cabecera_con_fases_de_login(self):
+        """Prueba que el login informe de BD, hash, JWT, parseo y total en Server-Timing"""
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        fases = {parte.split(';')[0]: parte for parte in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(fases), {'db', 'hash', 'jwt', 'parse', 'total'})
+        self.assertIn('desc="1"', fases['db'])
+        self.assertIn('desc="1"', fases['hash'])
+
+    def test_linea_de_log_estructurada(self):
+        """Prueba que cada petición deje una línea de log con sus fases como campos"""
+        with self.assertLogs('usuario.timing', level='INFO') as logs:
+            self.login()
+        registro = logs.records[-1]
+        self.assertIn('ruta=/api/login/', registro.getMessage())
+        self.assertEqual(registro.server_timing['estado'], 200)
+        self.assertEqual(registro.server_timing['db_n'], 1)
+        self.assertIn('hash_ms', registro.server_timing)
+        self.assertIn('total_ms', registro.server_timing)
+
+    def test_fuera_de_peticion_no_mide(self):
+        """Prueba que sin petición en curso medir y acumular no guarden nada"""
+        with timing.medir('hash'):
+            pass
+        timing.acumular('db', 1.0)
+        token = timing.iniciar()
+        self.assertEqual(timing.terminar(token), {})
+
+    def test_sin_cabecera_por_defecto(self):
+        """Prueba que por defecto el desglose solo vaya al log y no a la respuesta"""
+        with self.assertLogs('usuario.timing', level='INFO'):
+            response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SERVER_TIMING=False, SERVER_TIMING_CABECERA=True)
+    def test_desactivado(self):
+        """Prueba que con SERVER_TIMING = False no se añada la cabecera"""
+        response = Client().post(
+            reverse('login'),
+            data=json.dumps({'email': 'timing@example.com', 'password': 'password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricasTests(TestCase):
+    """Pruebas para el endpoint /metrics de Prometheus"""
+
+    def setUp(self):
+        self.client = Client()
+        Usuario.objects.create_user(
+            email='metricas@example.com', username='Metricas', dni='66666666M', password='password123'
+        )
+
+    def valor(self, nombre, **etiquetas):
+        return REGISTRY.get_sample_value(nombre, etiquetas) or 0
+
+    def login(self, password):
+        return self.client.post(
+            reverse('login'),
+            data=json.dumps({'email': 'metricas@example.com', 'password': password}),
+            content_type='application/json'
+        )
+
+    def test_login_actualiza_metricas(self):
+        """Prueba que un login cuente su resultado, su latencia por vista, sus consultas y su hash"""
+        exitos = self.valor('usuario_logins_total', resultado='exito')
+        fallos = self.valor('usuario_logins_total', resultado='fallo')
+        peticiones = self.valor(
+            'usuario_peticion_duracion_segundos_count', vista='login_view', metodo='POST', estado='200'
+        )
+        consultas = self.valor('usuario_peticion_consultas_bd_sum', vista='login_view')
+        hashes = self.valor('usuario_hash_duracion_segundos_count')
+
+        self.login('password123')
+        self.login('incorrecta')
+
+        self.assertEqual(self.valor('usuario_logins_total', resultado='exito'), exitos + 1)
+        self.assertEqual(self.valor('usuario_logins_total', resultado='fallo'), fallos + 1)
+        self.assertEqual(
+            self.valor('usuario_peticion_duracion_segundos_count', vista='login_view', metodo='POST', estado='200'),
+            peticiones + 1
+        )
+        self.assertEqual(self.valor('usuario_peticion_consultas_bd_sum', vista='login_view'), consultas + 2)
+        self.assertEqual(self.valor('usuario_hash_duracion_segundos_count'), hashes + 2)
+
+    def test_endpoint_formato_texto(self):
+        """Prueba que /metrics responda en formato de texto de Prometheus sin JWT desde loopback"""
+        self.login('password123')
+        response = self.client.get(reverse('metricas'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        cuerpo = response.content.decode()
+        self.assertIn('usuario_logins_total{resultado="exito"}', cuerpo)
+        self.assertIn('usuario_peticion_duracion_segundos_bucket{', cuerpo)
+
+    def test_rechaza_redes_no_permitidas(self):
+        """Prueba que /metrics responda 403 fuera de METRICAS_REDES aunque se mande X-Forwarded-For"""
+        response = self.client.get(
+            reverse('metricas'), REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR='127.0.0.1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertNotIn(b'usuario_logins_total', response.content)
+        with self.settings(METRICAS_REDES=['203.0.113.0/24']):
+            response = self.client.get(reverse('metricas'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_de_scrape(self):
+        """Prueba que con METRICAS_TOKEN se acepte el Bearer correcto desde cualquier red y no otro"""
+        with self.settings(METRICAS_TOKEN='secreto'):
+            correcto = self.client.get(
+                reverse('metricas'), REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer secreto'
+            )
+            incorrecto = self.client.get(
+                reverse('metricas'), REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer otro'
+            )
+        self.assertEqual(correcto.status_code, status.HTTP_200_OK)
+        self.assertEqual(incorrecto.status_code, status.HTTP_403_FORBIDDEN)
+        sin_token = self.client.get(reverse('metricas'), REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(sin_token.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_agrega_varios_procesos(self):
+        """Prueba que con PROMETHEUS_MULTIPROC_DIR se sumen los valores de todos los procesos"""
+        with tempfile.TemporaryDirectory() as directorio:
+            entorno = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directorio}
+            codigo = "from usuario import metricas; metricas.logins.labels('exito').inc(3)"
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', codigo], env=entorno, cwd=settings.BASE_DIR, check=True)
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directorio}):
+                cuerpo, _ = metricas.exportar()
+        self.assertIn(b'usuario_logins_total{resultado="exito"} 6.0', cuerpo)
+
+
+class EmailSinMayusculasTests(TestCase):
+    """Pruebas para la búsqueda de emails sin distinguir mayúsculas"""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(
+            email='Mixto.Caso@Example.com', username='Mixto', dni='77777777C', password='password123'
+        )
+
+    def test_login_sin_distinguir_mayusculas(self):
+        """Prueba que el login encuentre al usuario escribiendo el email en otro caso"""
+        resultado = UsuarioService.autenticar_usuario(' mixto.caso@EXAMPLE.COM ', 'password123')
+        self.assertEqual(resultado['user_id'], self.usuario.id)
+
+    def test_registro_duplicado_en_otro_caso(self):
+        """Prueba que no se pueda registrar el mismo email cambiando mayúsculas"""
+        with self.assertRaisesMessage(ValueError, "El email ya está registrado."):
+            UsuarioService.crear_usuario({
+                'email': 'mixto.caso@example.com', 'username': 'Otro', 'dni': '77777778C', 'password': 'x'
+            })
+
+    def test_registro_guarda_el_email_limpio(self):
+        """Prueba que el alta guarde el email sin espacios para que el login y la unicidad lo encuentren"""
+        usuario = UsuarioService.crear_usuario({
+            'email': '  Espacios@Example.COM ', 'username': 'Esp', 'dni': '66666666E', 'password': 'clave'
+        })
+        self.assertEqual(Usuario.objects.get(pk=usuario.pk).email, 'Espacios@example.com')
+        self.assertEqual(UsuarioService.autenticar_usuario(' Espacios@Example.COM ', 'clave')['user_id'], usuario.id)
+        self.assertEqual(UsuarioService.autenticar_usuario('espacios@example.com', 'clave')['user_id'], usuario.id)
+        with self.assertRaisesMessage(ValueError, "El email ya está registrado."):
+            UsuarioService.crear_usuario({
+                'email': 'espacios@example.com', 'username': 'Otro', 'dni': '66666667E', 'password': 'x'
+            })
+        resultados = list(UsuarioService.crear_usuarios_bulk([
+            json.dumps({'email': ' bulk@example.com', 'username': 'B', 'dni': '4B', 'password': 'x'}),
+        ]))
+        self.assertEqual(Usuario.objects.get(pk=resultados[0]['id']).email, 'bulk@example.com')
+
+    async def test_registro_asincrono_guarda_el_email_limpio(self):
+        """Prueba que el alta asíncrona también guarde el email sin espacios"""
+        usuario = await UsuarioService.acrear_usuario({
+            'email': ' asincrono@example.com ', 'username': 'As', 'dni': '66666668E', 'password': 'clave'
+        })
+        self.assertEqual((await Usuario.objects.aget(pk=usuario.pk)).email, 'asincrono@example.com')
+
+    def test_mensaje_por_nombre_de_restriccion(self):
+        """Prueba que en PostgreSQL el duplicado se clasifique por la restricción y no por el valor del DETAIL"""
+        causa = Exception()
+        causa.diag = mock.Mock(constraint_name='usuario_email_lower_unico')
+        error = IntegrityError(
+            'duplicate key value violates unique constraint "usuario_email_lower_unico"\n'
+            'DETAIL:  Key (lower(email::text))=(adniel@x.com) already exists.'
+        )
+        error.__cause__ = causa
+        self.assertEqual(UsuarioService._mensaje_integridad(error), "El email ya está registrado.")
+        causa.diag.constraint_name = 'usuario_usuario_dni_key'
+        self.assertEqual(UsuarioService._mensaje_integridad(error), "El DNI ya está registrado.")
+
+    def test_email_con_dni_duplicado(self):
+        """Prueba que un email repetido que contiene "dni" no se confunda con un DNI repetido"""
+        UsuarioService.crear_usuario({'email': 'adniel@x.com', 'username': 'A', 'dni': '1D', 'password': 'x'})
+        with self.assertRaisesMessage(ValueError, "El email ya está registrado."):
+            UsuarioService.crear_usuario({'email': 'ADniel@x.com', 'username': 'B', 'dni': '2D', 'password': 'x'})
+        with self.assertRaisesMessage(ValueError, "El DNI ya está registrado."):
+            UsuarioService.crear_usuario({'email': 'otro@x.com', 'username': 'C', 'dni': '1D', 'password': 'x'})
+
+    def test_bulk_duplicado_en_otro_caso(self):
+        """Prueba que el registro masivo detecte duplicados sin distinguir mayúsculas"""
+        lineas = [
+            json.dumps({'email': 'MIXTO.caso@example.com', 'username': 'A', 'dni': '1A', 'password': 'x'}),
+            json.dumps({'email': 'nuevo@example.com', 'username': 'B', 'dni': '2B', 'password': 'x'}),
+            json.dumps({'email': 'Nuevo@Example.com', 'username': 'C', 'dni': '3C', 'password': 'x'}),
+        ]
+        resultados = list(UsuarioService.crear_usuarios_bulk(lineas))
+        self.assertEqual(resultados[0]['error'], "El email ya está registrado.")
+        self.assertIn('id', resultados[1])
+        self.assertEqual(resultados[2]['error'], "El email ya está registrado.")
+
+    def test_busqueda_usa_indice(self):
+        """Prueba que la búsqueda por email use el índice de LOWER(email) y no recorra la tabla"""
+        consulta = Usuario.objects.por_email('x@example.com').values('id').query
+        sql, params = consulta.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(fila[-1]) for fila in cursor.fetchall())
+        self.assertIn('usuario_email_lower_unico', plan)
+
+
+class BusquedaUsuariosTests(TestCase):
+    """Pruebas para la búsqueda por prefijo de email, username y DNI"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password('password123')
+        cls.admin = Usuario.objects.create(
+            email='admin-busqueda@example.com', username='Admin', dni='Z0', password=password, is_staff=True
+        )
+        Usuario.objects.bulk_create([
+            Usuario(email='Ana.Garcia@example.com', username='Ana García', dni='11111111A', password=password),
+            Usuario(email='anabel@example.com', username='Anabel Ruiz', dni='22222222B', password=password),
+            Usuario(email='bruno@example.com', username='Bruno Anaya', dni='33333333C', password=password),
+            Usuario(email='carla@example.com', username='Carla', dni='ana-dni-no', password=password),
+        ])
+
+    def setUp(self):
+        self.client = Client()
+        token = UsuarioService.generar_tokens_para_usuario(self.admin)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def buscar(self, **params):
+        return self.client.get(reverse('usuarios-search'), params, **self.auth)
+
+    def test_prefijo_sin_mayusculas(self):
+        """Prueba que se busque por prefijo en email y username sin distinguir mayúsculas"""
+        response = self.buscar(q='ANA')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        emails = [u['email'] for u in response.json()['results']]
+        # 'Bruno Anaya' no empieza por 'ana'; el DNI se compara en mayúsculas
+        self.assertEqual(emails, ['Ana.Garcia@example.com', 'anabel@example.com'])
+
+    def test_dni_y_campo(self):
+        """Prueba la búsqueda por DNI y la restricción a un solo campo"""
+        response = self.buscar(q='2222')
+        self.assertEqual([u['dni'] for u in response.json()['results']], ['22222222B'])
+        response = self.buscar(q='bru', campo='username')
+        self.assertEqual([u['email'] for u in response.json()['results']], ['bruno@example.com'])
+        response = self.buscar(q='bru', campo='dni')
+        self.assertEqual(response.json()['results'], [])
+
+    def test_paginacion_por_cursor(self):
+        """Prueba que los resultados se paginen con next_cursor"""
+        primera = self.buscar(q='an', limit=1).json()
+        self.assertEqual(len(primera['results']), 1)
+        segunda = self.buscar(q='an', limit=1, cursor=primera['next_cursor']).json()
+        self.assertEqual(segunda['results'][0]['email'], 'anabel@example.com')
+        self.assertIsNone(segunda['next_cursor'])
+
+    def test_parametros_invalidos(self):
+        """Prueba que se rechacen textos demasiado cortos, campos desconocidos y acceso sin staff"""
+        self.assertEqual(self.buscar(q='a').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.buscar(q='ana', campo='password').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('usuarios-search'), {'q': 'ana'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_plan_usa_indices(self):
+        """Prueba que cada condición de la búsqueda se resuelva con un índice"""
+        plan = Usuario.objects.por_prefijo('ana').order_by('id')[:51].explain()
+        self.assertIn('usuario_email_lower_unico', plan)
+        self.assertIn('usuario_username_lower', plan)
+        self.assertIn('(dni>? AND dni<?)', plan)
+        self.assertFalse(any(linea.endswith('SCAN usuario_usuario') for linea in plan.splitlines()))
+
+
+class VistasAsyncTests(TestCase):
+    """Pruebas para las vistas asíncronas de login y registro (modo ASGI)"""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.usuario = Usuario.objects.create_user(
+            email='async@example.com', username='Async User', dni='44444444A', password='password123'
+        )
+
+    def post(self, vista, datos):
+        return vista(self.factory.post('/', data=json.dumps(datos), content_type='application/json'))
+
+    async def test_login_async(self):
+        """Prueba el login asíncrono con credenciales correctas e incorrectas"""
+        response = await self.post(alogin_view, {'email': 'ASYNC@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        datos = json.loads(response.content)
+        self.assertEqual(datos['user_id'], self.usuario.id)
+        self.assertIn('access', datos)
+
+        response = await self.post(alogin_view, {'email': 'async@example.com', 'password': 'mala'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_login_async_rehashea(self):
+        """Prueba que el login asíncrono actualice un hash con parámetros antiguos"""
+        antiguo = make_password('password123', hasher='pbkdf2_sha1')
+        await Usuario.objects.filter(pk=self.usuario.pk).aupdate(password=antiguo)
+        response = await self.post(alogin_view, {'email': 'async@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        usuario = await Usuario.objects.aget(pk=self.usuario.pk)
+        self.assertNotEqual(usuario.password, antiguo)
+
+    async def test_registro_async(self):
+        """Prueba el registro asíncrono, los duplicados y el cuerpo inválido"""
+        datos = {'email': 'nuevo-async@example.com', 'username': 'Nuevo', 'dni': '44444445B', 'password': 'clave'}
+        response = await self.post(aregister_view, datos)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(await Usuario.objects.filter(email='nuevo-async@example.com').aexists())
+
+        response = await self.post(aregister_view, {**datos, 'dni': '44444446C'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content)['error'], "El email ya está registrado.")
+
+        response = await aregister_view(self.factory.post('/', data='[1]', content_type='application/json'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(USUARIO_HASH_POOL={'WORKERS': 0, 'MAX_COLA': 0})
+    async def test_pool_saturado(self):
+        """Prueba que el login asíncrono responda 503 con Retry-After si el pool está lleno"""
+        pool = hashing.obtener_pool()
+        pool._permisos.acquire()
+        try:
+            response = await self.post(alogin_view, {'email': 'async@example.com', 'password': 'password123'})
+        finally:
+            pool._permisos.release()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response.headers)
+
+    @override_settings(SERVER_TIMING_CABECERA=True)
+    async def test_middleware_en_modo_asincrono(self):
+        """Prueba que Server-Timing funcione bajo el manejador ASGI"""
+        response = await AsyncClient().post(
+            reverse('login'),
+            data=json.dumps({'email': 'async@example.com', 'password': 'password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('hash;dur=', response['Server-Timing'])
+
+
+class ProyeccionLecturaTests(TestCase):
+    """Pruebas para la proyección de lectura que sustituye a UsuarioSerializer en las respuestas"""
+
+    def setUp(self):
+        Usuario.objects.create_user(
+            email='proyeccion@example.com', username='Íñigo "Ñu" \\ Peña', dni='12345678Ñ', password='password123'
+        )
+        Usuario.objects.create_user(
+            email='otra@example.com', username='Otra', dni='87654321X', password='password123'
+        )
+
+    def test_mismo_json_que_el_serializer(self):
+        """Prueba que la proyección genere exactamente el JSON que DRF renderiza para UsuarioSerializer"""
+        usuarios = Usuario.objects.order_by('id')
+        esperado = JSONRenderer().render(UsuarioSerializer(usuarios, many=True).data)
+        filas = usuarios.values_list(*proyecciones.CAMPOS_LECTURA)
+        self.assertEqual(proyecciones.lista_a_json(proyecciones.desde_filas(filas)).encode(), esperado)
+        esperado = JSONRenderer().render(UsuarioSerializer(usuarios[0]).data)
+        self.assertEqual(proyecciones.a_json(proyecciones.desde_modelo(usuarios[0])).encode(), esperado)
+
+    def test_separadores_de_linea_como_drf(self):
+        """Prueba que U+2028 y U+2029 se escapen igual que en JSONRenderer de DRF"""
+        Usuario.objects.create_user(
+            email='sep@example.com', username='Línea\u2028y\u2029párrafo', dni='2028X', password='password123'
+        )
+        usuarios = Usuario.objects.order_by('id')
+        esperado = JSONRenderer().render(UsuarioSerializer(usuarios, many=True).data)
+        filas = list(usuarios.values_list(*proyecciones.CAMPOS_LECTURA))
+        self.assertIn(b'\\u2028', esperado)
+        self.assertEqual(proyecciones.lista_a_json(proyecciones.desde_filas(filas)).encode(), esperado)
+        usuario = usuarios.get(dni='2028X')
+        esperado = JSONRenderer().render(UsuarioSerializer(usuario).data)
+        self.assertEqual(proyecciones.a_json(proyecciones.desde_modelo(usuario)).encode(), esperado)
+        lote = proyecciones.lote_a_json(proyecciones.desde_filas(filas), ('id', 'username'), ['x\u2029@example.com'])
+        self.assertNotIn('\u2028', lote)
+        self.assertNotIn('\u2029', lote)
+        self.assertEqual(json.loads(lote)['results'][-1]['username'], 'Línea\u2028y\u2029párrafo')
+
+    def test_pagina_solo_consulta_campos_de_lectura(self):
+        """Prueba que el listado no cargue el hash de la contraseña ni instancias del modelo"""
+        with CaptureQueriesContext(connection) as consultas:
+            usuarios = UsuarioRepository.listar_pagina(limite=10)
+        self.assertNotIn('password', consultas.captured_queries[0]['sql'])
+        self.assertIsInstance(usuarios[0], proyecciones.UsuarioLectura)
+        self.assertEqual(usuarios[0].email, 'proyeccion@example.com')
+
+    def test_registro_con_la_forma_del_serializer(self):
+        """Prueba que el registro responda con los mismos campos que UsuarioSerializer"""
+        response = Client().post(
+            reverse('register'),
+            data=json.dumps({'email': 'n@example.com', 'username': 'N', 'dni': '1N', 'password': 'x'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), UsuarioSerializer(Usuario.objects.get(email='n@example.com')).data)
+
+    def test_registro_con_valores_no_texto(self):
+        """Prueba que un dni numérico en el JSON se devuelva como texto, igual que con el serializer"""
+        response = Client().post(
+            reverse('register'),
+            data=json.dumps({'email': 'num@example.com', 'username': 'Num', 'dni': 12345678, 'password': 'x'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['dni'], '12345678')
+        self.assertEqual(response.json(), UsuarioSerializer(Usuario.objects.get(email='num@example.com')).data)
+
+    def test_bench_proyeccion(self):
+        """Prueba que el micro-benchmark informe objetos/s y bytes por fila de cada método"""
+        stdout = io.StringIO()
+        call_command('bench_proyeccion', filas=20, repeticiones=1, stdout=stdout)
+        informe = json.loads(stdout.getvalue())
+        self.assertTrue(informe['mismo_json'])
+        self.assertEqual(set(informe['metodos']), {'serializer', 'values_dict', 'proyeccion'})
+        self.assertGreater(informe['metodos']['proyeccion']['objetos_s'], 0)
+        self.assertFalse(Usuario.objects.filter(email__startswith='bench-').exists())
+
+
+class ArranqueGunicornTests(TestCase):
+    """Pruebas para la configuración de gunicorn y el calentamiento de los workers"""
+
+    def _cargar_configuracion(self, **entorno):
+        sys.modules.pop('servicio_usuario.gunicorn_conf', None)
+        with mock.patch.dict(os.environ, entorno):
+            conf = importlib.import_module('servicio_usuario.gunicorn_conf')
+        # Al importarse instala el medidor de imports; gunicorn lo quita en when_ready
+        conf.medidor.desinstalar()
+        self.addCleanup(sys.modules.pop, 'servicio_usuario.gunicorn_conf', None)
+        return conf
+
+    def test_configuracion_segun_modo(self):
+        """Prueba que la configuración precargue la app y elija wsgi o asgi según MODO_SERVIDOR"""
+        conf = self._cargar_configuracion(MODO_SERVIDOR='wsgi')
+        self.assertTrue(conf.preload_app)
+        self.assertEqual(conf.wsgi_app, 'servicio_usuario.wsgi:application')
+        self.assertFalse(hasattr(conf, 'worker_class'))
+        conf = self._cargar_configuracion(MODO_SERVIDOR='asgi')
+        self.assertEqual(conf.wsgi_app, 'servicio_usuario.asgi:application')
+        self.assertEqual(conf.worker_class, 'uvicorn_worker.UvicornWorker')
+
+    def test_vacia_directorio_de_metricas(self):
+        """Prueba que se borren los archivos de métricas de un arranque anterior"""
+        with tempfile.TemporaryDirectory() as directorio:
+            antiguo = os.path.join(directorio, 'histogram_123.db')
+            open(antiguo, 'w').close()
+            self._cargar_configuracion(PROMETHEUS_MULTIPROC_DIR=directorio)
+            self.assertFalse(os.path.exists(antiguo))
+
+    def test_medidor_importaciones(self):
+        """Prueba que el medidor agrupe el tiempo de import por paquete sin cambiar el tipo de loader"""
+        sys.modules.pop('colorsys', None)
+        medidor = arranque.MedidorImportaciones.instalar()
+        try:
+            modulo = importlib.import_module('colorsys')
+        finally:
+            medidor.desinstalar()
+        self.assertNotIn(medidor, sys.meta_path)
+        self.assertIn('colorsys', medidor.por_paquete)
+        self.assertEqual(type(modulo.__loader__).__name__, 'SourceFileLoader')
+        informe = medidor.informe(maximo=0)
+        self.assertEqual(set(informe), {'otros', 'total'})
+        self.assertEqual(informe['otros'], informe['total'])
+
+    def test_calentar(self):
+        """Prueba que calentar resuelva URLs, conecte a la BD e inicialice hasher, pool, JWT y revocados"""
+        pasos = arranque.calentar()
+        self.assertEqual(set(pasos), {'urls', 'hasher', 'jwt', 'bd', 'pool_hash', 'revocacion'})
+        with self.assertLogs('usuario.arranque', 'INFO') as logs:
+            arranque.registrar_worker(1234, pasos, 0.01, 0.5)
+        self.assertIn('evento=worker_listo pid=1234', logs.output[0])
+        self.assertEqual(logs.records[0].arranque['desde_fork_ms'], 10.0)
+
+
+class RotacionRefreshTokenTests(TestCase):
+    """Pruebas para la rotación de refresh tokens con lista de revocados"""
+
+    def setUp(self):
+        revocacion.reiniciar_lista()
+        self.addCleanup(revocacion.reiniciar_lista)
+        self.client = Client()
+        self.usuario = Usuario.objects.create_user(
+            email='rotacion@example.com', username='Rotación', dni='30303030R', password='password123'
+        )
+        self.refresh = str(RefreshToken.for_user(self.usuario))
+
+    def _refrescar(self, refresh):
+        return self.client.post(reverse('token-refresh'), data={'refresh': refresh}, content_type='application/json')
+
+    def test_refresco_rota_el_token(self):
+        """Prueba que el refresco devuelva un par nuevo con los claims del usuario y revoque el anterior"""
+        response = self._refrescar(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        nuevo = response.json()
+        self.assertNotEqual(nuevo['refresh'], self.refresh)
+        access = AccessToken(nuevo['access'])
+        self.assertEqual(access['username'], 'Rotación')
+        self.assertFalse(access['is_staff'])
+        self.assertTrue(TokenRevocado.objects.filter(jti=RefreshToken(self.refresh)['jti']).exists())
+        self.assertEqual(self._refrescar(nuevo['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_reutilizar_token_rotado(self):
+        """Prueba que un refresh token ya usado se rechace"""
+        self.assertEqual(self._refrescar(self.refresh).status_code, status.HTTP_200_OK)
+        response = self._refrescar(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json()['error'], 'Token revocado.')
+
+    def test_token_invalido_o_ausente(self):
+        """Prueba que se rechacen tokens mal formados, access tokens y peticiones sin token"""
+        self.assertEqual(self._refrescar('no-es-un-jwt').status_code, status.HTTP_401_UNAUTHORIZED)
+        access = str(AccessToken.for_user(self.usuario))
+        self.assertEqual(self._refrescar(access).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('token-refresh'), data={}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_usuario_inactivo(self):
+        """Prueba que un usuario desactivado no pueda renovar sus tokens"""
+        Usuario.objects.filter(pk=self.usuario.pk).update(is_active=False)
+        self.assertEqual(self._refrescar(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(TokenRevocado.objects.exists())
+
+    def test_refresco_sin_consulta_de_revocados(self):
+        """Prueba que con el filtro construido un token no revocado solo cueste el INSERT de su revocación"""
+        revocacion.obtener_lista().sincronizar(forzar=True)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self._refrescar(self.refresh).status_code, status.HTTP_200_OK)
+        # Instantánea del usuario (la caché está desactivada en tests) + INSERT; los
+        # SAVEPOINT solo aparecen porque el test corre dentro de una transacción.
+        sentencias = [c['sql'].split()[0] for c in consultas.captured_queries if 'SAVEPOINT' not in c['sql']]
+        self.assertEqual(sentencias, ['SELECT', 'INSERT'])
+        self.assertEqual(revocacion.estadisticas()['negativos'], 1)
+
+    def test_revocado_por_otro_worker(self):
+        """Prueba que un token revocado en otro proceso se rechace aunque el filtro local no lo tenga"""
+        lista = revocacion.obtener_lista()
+        lista.sincronizar(forzar=True)
+        token = RefreshToken(self.refresh)
+        TokenRevocado.objects.create(jti=token['jti'], expires_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(self._refrescar(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+        lista.sincronizar(forzar=True)
+        self.assertTrue(lista.esta_revocado(token['jti']))
+
+    def test_reconstruccion_ignora_caducados(self):
+        """Prueba que el filtro del arranque solo cargue revocaciones vigentes y que la purga borre las caducadas"""
+        ahora = timezone.now()
+        TokenRevocado.objects.create(jti='vigente', expires_at=ahora + timedelta(hours=1))
+        TokenRevocado.objects.create(jti='caducado', expires_at=ahora - timedelta(hours=1))
+        lista = revocacion.obtener_lista()
+        lista.sincronizar(forzar=True)
+        self.assertIn('vigente', lista.filtro)
+        self.assertEqual(lista.filtro.elementos, 1)
+
+        stdout = io.StringIO()
+        call_command('purgar_tokens_revocados', stdout=stdout)
+        self.assertIn('1', stdout.getvalue())
+        self.assertEqual(list(TokenRevocado.objects.values_list('jti', flat=True)), ['vigente'])
+
+    def test_filtro_bloom(self):
+        """Prueba que el filtro no tenga falsos negativos y respete la tasa de falsos positivos"""
+        filtro = revocacion.FiltroBloom(1000, 0.01)
+        # Cadenas fijas: con uuid4 el resultado variaba entre ejecuciones
+        presentes = [f'presente-{i}' for i in range(1000)]
+        for jti in presentes:
+            filtro.agregar(jti)
+        elementos = filtro.elementos
+        filtro.agregar(presentes[0])
+        self.assertEqual(filtro.elementos, elementos)
+        self.assertGreater(elementos, 990)
+        self.assertTrue(all(jti in filtro for jti in presentes))
+        falsos_positivos = sum(f'ausente-{i}' in filtro for i in range(20000))
+        self.assertLess(falsos_positivos / 20000, 0.03)
+        self.assertAlmostEqual(filtro.tasa_estimada(), 0.01, delta=0.002)
+        self.assertLess(filtro.bytes, 1300)
+
+    def test_bench_revocacion(self):
+        """Prueba que el benchmark informe tasa de falsos positivos, memoria y consultas por refresco"""
+        stdout = io.StringIO()
+        call_command('bench_revocacion', revocados=200, consultas=1000, capacidad=200, refrescos=3, stdout=stdout)
+        informe = json.loads(stdout.getvalue())
+        self.assertLess(informe['filtro']['bytes_filtro'], informe['filtro']['bytes_set_python'])
+        self.assertEqual(informe['refresco']['estado_reutilizado'], 401)
+        self.assertFalse(TokenRevocado.objects.exists())
+
+
+class UsuariosLoteTests(TestCase):
+    """Pruebas para la consulta de usuarios por lotes (/api/usuarios/batch)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password('password123')
+        cls.usuarios = Usuario.objects.bulk_create([
+            Usuario(email=f'Lote{i}@Example.com', username=f'Lote {i}', dni=f'L{i}', password=password)
+            for i in range(5)
+        ])
+        cls.ids = [usuario.id for usuario in cls.usuarios]
+        cls.servicio = Usuario.objects.create(
+            email='servicio-lote@example.com', username='Servicio', dni='LS', password=password, is_staff=True
+        )
+
+    def setUp(self):
+        self.client = Client()
+        token = UsuarioService.generar_tokens_para_usuario(self.servicio)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_solo_staff(self):
+        """Prueba que un usuario final no pueda consultar lotes de usuarios"""
+        token = UsuarioService.generar_tokens_para_usuario(self.usuarios[0])['access']
+        response = self._pedir({'ids': self.ids}, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def _pedir(self, datos, **extra):
+        return self.client.post(
+            reverse('usuarios-batch'), data=json.dumps(datos), content_type='application/json', **{**self.auth, **extra}
+        )
+
+    def test_lote_por_ids(self):
+        """Prueba que el lote respete el orden pedido, ignore repetidos y liste los ids inexistentes"""
+        pedidos = [self.ids[3], 999999, self.ids[0], self.ids[3]]
+        response = self._pedir({'ids': pedidos})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        datos = response.json()
+        self.assertEqual([u['id'] for u in datos['results']], [self.ids[3], self.ids[0]])
+        self.assertEqual(datos['results'][0], {'id': self.ids[3], 'username': 'Lote 3', 'email': 'Lote3@Example.com', 'dni': 'L3'})
+        self.assertEqual(datos['missing'], [999999])
+
+    def test_una_consulta_por_lote(self):
+        """Prueba que el lote se resuelva con un único id__in, partido en trozos si es grande"""
+        with self.assertNumQueries(1):
+            usuarios, faltantes = UsuarioService.obtener_usuarios_lote(ids=self.ids)
+        self.assertEqual(len(usuarios), 5)
+        self.assertEqual(faltantes, [])
+        with self.assertNumQueries(3):
+            encontrados = UsuarioRepository._cargar_lecturas(self.ids, tam_lote=2)
+        self.assertEqual(set(encontrados), set(self.ids))
+
+    def test_lote_por_emails(self):
+        """Prueba que los emails se busquen sin distinguir mayúsculas"""
+        response = self._pedir({'emails': ['lote1@example.com', 'LOTE2@example.COM', 'nadie@example.com']})
+        datos = response.json()
+        self.assertEqual([u['dni'] for u in datos['results']], ['L1', 'L2'])
+        self.assertEqual(datos['missing'], ['nadie@example.com'])
+
+    def test_seleccion_de_campos(self):
+        """Prueba que fields limite la respuesta (la clave del lote se incluye siempre)"""
+        response = self._pedir({'ids': self.ids[:2], 'fields': ['username']})
+        self.assertEqual(response.json()['results'][0], {'id': self.ids[0], 'username': 'Lote 0'})
+        response = self._pedir({'emails': ['lote0@example.com'], 'fields': 'dni'})
+        self.assertEqual(response.json()['results'][0], {'id': self.ids[0], 'email': 'Lote0@Example.com', 'dni': 'L0'})
+        response = self._pedir({'ids': self.ids, 'fields': ['password']})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_json_de_campos_igual_que_json_dumps(self):
+        """Prueba que la codificación por plantilla coincida con json.dumps"""
+        usuario = proyecciones.UsuarioLectura(7, 'Ñandú "x" \\ y', 'ñ@example.com', '1Ñ')
+        campos = ('id', 'email')
+        esperado = json.dumps([{'id': 7, 'email': 'ñ@example.com'}], ensure_ascii=False, separators=(',', ':'))
+        self.assertEqual(proyecciones.lista_campos_a_json([usuario], campos), esperado)
+        esperado = json.dumps([usuario._asdict()], ensure_ascii=False, separators=(',', ':'))
+        self.assertEqual(proyecciones.lista_campos_a_json([usuario], proyecciones.CAMPOS_LECTURA), esperado)
+
+    def test_peticiones_invalidas(self):
+        """Prueba que se rechacen peticiones anónimas, mixtas, mal tipadas o demasiado grandes"""
+        response = self.client.post(reverse('usuarios-batch'), data={'ids': [1]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._pedir({'ids': [1], 'emails': ['a@b.c']}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._pedir({}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._pedir({'ids': ['1']}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._pedir({'ids': [True]}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._pedir({'ids': list(range(1001))}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60})
+    def test_lote_desde_cache(self):
+        """Prueba que el lote lea de la caché, consulte solo los que faltan y se invalide al escribir"""
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        with self.assertNumQueries(1):
+            UsuarioService.obtener_usuarios_lote(ids=self.ids[:3])
+        with CaptureQueriesContext(connection) as consultas:
+            usuarios, _ = UsuarioService.obtener_usuarios_lote(ids=self.ids)
+        self.assertEqual(len(consultas), 1)
+        self.assertIn(str(self.ids[4]), consultas[0]['sql'])
+        self.assertNotIn(str(self.ids[0]), consultas[0]['sql'].split('IN')[1])
+        self.assertEqual(len(usuarios), 5)
+
+        # Otro proceso: la LRU local está vacía pero la caché compartida no
+        cache_usuarios.obtener_cache('lectura').local.limpiar()
+        with self.assertNumQueries(0):
+            UsuarioService.obtener_usuarios_lote(ids=self.ids)
+
+        UsuarioRepository.actualizar(self.ids[0], {'username': 'Renombrado'})
+        usuarios, _ = UsuarioService.obtener_usuarios_lote(ids=self.ids[:1])
+        self.assertEqual(usuarios[0].username, 'Renombrado')
+
+
+class EventosUsuarioTests(TestCase):
+    """Pruebas para el outbox de eventos de usuarios y su despachador"""
+
+    def setUp(self):
+        self.datos = {'email': 'evento@example.com', 'username': 'Evento', 'dni': '31313131E', 'password': 'password123'}
+
+    def _eventos(self):
+        return list(EventoUsuario.objects.order_by('id').values_list('event_type', 'user_id'))
+
+    def test_escrituras_registran_eventos(self):
+        """Prueba que crear, actualizar y eliminar escriban su evento con el estado del usuario"""
+        usuario = UsuarioService.crear_usuario(self.datos)
+        UsuarioService.actualizar_usuario(usuario.id, {'username': 'Renombrado'})
+        UsuarioService.eliminar_usuario(usuario.id)
+        self.assertEqual(self._eventos(), [('created', usuario.id), ('updated', usuario.id), ('deleted', usuario.id)])
+        creado, actualizado, eliminado = EventoUsuario.objects.order_by('id')
+        self.assertEqual(creado.payload, {'id': usuario.id, 'username': 'Evento', 'email': 'evento@example.com', 'dni': '31313131E'})
+        self.assertEqual(actualizado.payload['username'], 'Renombrado')
+        self.assertNotIn('password', actualizado.payload)
+        self.assertEqual(eliminado.payload, {'id': usuario.id})
+        self.assertFalse(EventoUsuario.objects.filter(dispatched_at__isnull=False).exists())
+
+    def test_sin_cambio_no_hay_evento(self):
+        """Prueba que un alta duplicada o un borrado de un id inexistente no dejen eventos"""
+        UsuarioService.crear_usuario(self.datos)
+        with self.assertRaises(ValueError):
+            UsuarioService.crear_usuario({**self.datos, 'dni': '32323232F'})
+        self.assertFalse(UsuarioService.eliminar_usuario(999999))
+        self.assertIsNone(UsuarioService.actualizar_usuario(999999, {'username': 'X'}))
+        self.assertEqual([tipo for tipo, _ in self._eventos()], ['created'])
+
+    def test_registro_masivo_registra_eventos(self):
+        """Prueba que el registro masivo escriba un evento por usuario creado"""
+        lineas = [
+            json.dumps({'email': f'masivo{i}@example.com', 'username': f'M{i}', 'dni': f'4000000{i}M', 'password': 'x'})
+            for i in range(3)
+        ] + [json.dumps({'email': 'masivo0@example.com', 'username': 'Dup', 'dni': 'otro', 'password': 'x'})]
+        resultados = list(UsuarioService.crear_usuarios_bulk(lineas))
+        ids = [resultado['id'] for resultado in resultados if 'id' in resultado]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(self._eventos(), [('created', id) for id in ids])
+
+    def test_evento_se_deshace_con_la_transaccion(self):
+        """Prueba que si la transacción exterior se deshace el evento desaparezca con el cambio"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                UsuarioService.crear_usuario(self.datos)
+                raise RuntimeError
+        self.assertFalse(EventoUsuario.objects.exists())
+
+    def test_despacha_por_lotes_en_orden(self):
+        """Prueba que el despachador entregue en orden de id, por lotes, y marque lo entregado"""
+        usuario = UsuarioService.crear_usuario(self.datos)
+        for i in range(4):
+            UsuarioService.actualizar_usuario(usuario.id, {'username': f'Nombre {i}'})
+        sink = eventos.SinkMemoria()
+        despachador = eventos.Despachador(sink, lote=2)
+        self.assertEqual([despachador.despachar_lote() for _ in range(4)], [2, 2, 1, 0])
+        ids = list(EventoUsuario.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual([evento['id'] for evento in sink.entregados], ids)
+        self.assertEqual(sink.entregados[-1]['data']['username'], 'Nombre 3')
+        self.assertEqual(sink.entregados[0]['type'], 'created')
+        self.assertFalse(EventoUsuario.objects.pendientes().exists())
+        self.assertEqual(despachador.totales['eventos'], 5)
+
+    def test_fallo_del_sink_reintenta_el_mismo_lote(self):
+        """Prueba que un lote rechazado no se marque, cuente el intento y se reenvíe entero"""
+        usuario = UsuarioService.crear_usuario(self.datos)
+        UsuarioService.eliminar_usuario(usuario.id)
+        sink = eventos.SinkMemoria(fallos=1)
+        despachador = eventos.Despachador(sink)
+        antes = REGISTRY.get_sample_value('usuario_eventos_fallos_entrega_total') or 0
+        with self.assertRaises(eventos.ErrorEntrega):
+            despachador.despachar_lote()
+        self.assertEqual(REGISTRY.get_sample_value('usuario_eventos_fallos_entrega_total'), antes + 1)
+        self.assertEqual(list(EventoUsuario.objects.pendientes().values_list('attempts', flat=True)), [1, 1])
+        self.assertEqual(despachador.despachar_lote(), 2)
+        self.assertEqual([evento['type'] for evento in sink.entregados], ['created', 'deleted'])
+
+    def test_particiones_reparten_usuarios(self):
+        """Prueba que cada partición entregue solo sus usuarios y entre todas cubran todos los eventos"""
+        for i in range(6):
+            UsuarioService.crear_usuario({**self.datos, 'email': f'p{i}@example.com', 'dni': f'5000000{i}P'})
+        entregados = []
+        for particion in range(2):
+            sink = eventos.SinkMemoria()
+            eventos.Despachador(sink, particion=particion, particiones=2).despachar_lote()
+            self.assertTrue(all(evento['user_id'] % 2 == particion for evento in sink.entregados))
+            entregados += sink.entregados
+        self.assertEqual(len(entregados), 6)
+        self.assertFalse(EventoUsuario.objects.pendientes().exists())
+
+    def test_sink_webhook(self):
+        """Prueba que el webhook envíe el lote en JSON con clave de idempotencia y traduzca los errores"""
+        lote = [{'id': 3, 'type': 'created'}, {'id': 4, 'type': 'deleted'}]
+        sink = eventos.SinkWebhook('http://eventos.invalid/hook', timeout=2)
+        with mock.patch('urllib.request.urlopen') as urlopen:
+            sink.enviar(lote)
+        peticion = urlopen.call_args.args[0]
+        self.assertEqual(peticion.get_method(), 'POST')
+        self.assertEqual(json.loads(peticion.data), {'events': lote})
+        self.assertEqual(peticion.get_header('Idempotency-key'), 'eventos-3-4')
+        self.assertEqual(urlopen.call_args.kwargs['timeout'], 2)
+        with mock.patch('urllib.request.urlopen', side_effect=urllib.error.URLError('caído')):
+            with self.assertRaises(eventos.ErrorEntrega):
+                sink.enviar(lote)
+        with self.assertRaises(ValueError):
+            eventos.SinkWebhook('')
+
+    def test_comando_una_vez_con_archivo(self):
+        """Prueba que el comando vuelque lo pendiente en NDJSON e informe ritmo y retraso"""
+        usuario = UsuarioService.crear_usuario(self.datos)
+        UsuarioService.actualizar_usuario(usuario.id, {'username': 'Otro'})
+        antes = REGISTRY.get_sample_value('usuario_eventos_despachados_total', {'tipo': 'updated'}) or 0
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'eventos.ndjson')
+            stdout = io.StringIO()
+            with self.settings(USUARIO_EVENTOS={'ARCHIVO': ruta}):
+                call_command('despachar_eventos', sink='archivo', una_vez=True, lote=1, stdout=stdout)
+            with open(ruta, encoding='utf-8') as archivo:
+                lineas = [json.loads(linea) for linea in archivo]
+        informe = json.loads(stdout.getvalue())
+        self.assertEqual([linea['type'] for linea in lineas], ['created', 'updated'])
+        self.assertEqual(informe['eventos'], 2)
+        self.assertEqual(informe['lotes'], 2)
+        self.assertEqual(informe['pendientes'], 0)
+        self.assertIsNotNone(informe['eventos_s'])
+        self.assertGreaterEqual(informe['retraso_max_ms'], 0)
+        self.assertEqual(REGISTRY.get_sample_value('usuario_eventos_despachados_total', {'tipo': 'updated'}), antes + 1)
+        with self.assertRaises(CommandError):
+            call_command('despachar_eventos', particion='2/2', una_vez=True, stdout=io.StringIO())
+
+    def test_purga_despachados_antiguos(self):
+        """Prueba que solo se borren los eventos entregados antes de la retención"""
+        UsuarioService.crear_usuario(self.datos)
+        UsuarioService.crear_usuario({**self.datos, 'email': 'otro@example.com', 'dni': '33333333G'})
+        antiguo, reciente = EventoUsuario.objects.order_by('id')
+        EventoUsuario.objects.filter(pk=antiguo.pk).update(dispatched_at=timezone.now() - timedelta(hours=48))
+        self.assertEqual(eventos.Despachador(eventos.SinkMemoria()).purgar_despachados(24), 1)
+        self.assertEqual(list(EventoUsuario.objects.values_list('id', flat=True)), [reciente.id])
+
+
+class ExportacionUsuariosTests(TestCase):
+    """Pruebas para la exportación en streaming (comando exportar_usuarios y /api/usuarios/export/)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password('password123')
+        cls.admin = Usuario.objects.create(
+            email='admin-export@example.com', username='Admin', dni='X0', password=password, is_staff=True
+        )
+        Usuario.objects.bulk_create([
+            Usuario(email=f'export{i}@example.com', username=f'Ñandú "{i}", sí', dni=f'X{i + 1}', password=password)
+            for i in range(6)
+        ])
+        cls.ids = list(Usuario.objects.order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client = Client()
+        token = UsuarioService.generar_tokens_para_usuario(self.admin)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def _exportar(self, **parametros):
+        cabeceras = {**self.auth, **parametros.pop('cabeceras', {})}
+        return self.client.get(reverse('usuarios-export'), parametros, **cabeceras)
+
+    def _ndjson(self, contenido):
+        return [json.loads(linea) for linea in contenido.decode().splitlines()]
+
+    def test_ndjson_sin_password(self):
+        """Prueba que el NDJSON tenga todas las filas en orden de id y sin la contraseña"""
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._exportar()
+            filas = self._ndjson(b''.join(response.streaming_content))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([fila['id'] for fila in filas], self.ids)
+        self.assertEqual(list(filas[1]), list(exportacion.CAMPOS_EXPORTACION))
+        self.assertEqual(filas[1]['username'], 'Ñandú "0", sí')
+        self.assertIs(filas[0]['is_staff'], True)
+        exportacion_sql = [q['sql'] for q in consultas.captured_queries if '"updated_at"' in q['sql']]
+        self.assertEqual(len(exportacion_sql), 1)
+        self.assertNotIn('password', exportacion_sql[0])
+
+    def test_csv_y_gzip(self):
+        """Prueba el CSV con cabecera y que con Accept-Encoding: gzip el cuerpo vaya comprimido"""
+        response = self._exportar(formato='csv')
+        plano = b''.join(response.streaming_content)
+        filas = list(csv.reader(io.StringIO(plano.decode())))
+        self.assertEqual(tuple(filas[0]), exportacion.CAMPOS_EXPORTACION)
+        self.assertEqual([int(fila[0]) for fila in filas[1:]], self.ids)
+        self.assertEqual(filas[2][1], 'Ñandú "0", sí')
+        self.assertEqual(filas[2][4:6], ['true', 'false'])
+
+        response = self._exportar(formato='csv', cabeceras={'HTTP_ACCEPT_ENCODING': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plano)
+
+    def test_gzip_segun_calidades(self):
+        """Prueba que Accept-Encoding se negocie con sus q: gzip;q=0 recibe el cuerpo sin comprimir"""
+        for cabecera, comprimido in (
+            ('gzip;q=0, deflate', False),
+            ('GZIP ; q=0.5', True),
+            ('x-gzip', True),
+            ('identity', False),
+            ('*', True),
+            ('*;q=1, gzip;q=0', False),
+            ('br;q=1.0, gzip;q=0.000', False),
+        ):
+            with self.subTest(cabecera=cabecera):
+                response = self._exportar(cabeceras={'HTTP_ACCEPT_ENCODING': cabecera})
+                self.assertEqual(response.get('Content-Encoding') == 'gzip', comprimido)
+
+    def test_cursor_y_since(self):
+        """Prueba que cursor retome tras un id y since filtre por fecha de modificación"""
+        filas = self._ndjson(b''.join(self._exportar(cursor=self.ids[2]).streaming_content))
+        self.assertEqual([fila['id'] for fila in filas], self.ids[3:])
+
+        Usuario.objects.update(updated_at=timezone.now() - timedelta(days=10))
+        UsuarioService.actualizar_usuario(self.ids[4], {'username': 'Cambiado'})
+        desde = (timezone.now() - timedelta(days=1)).date().isoformat()
+        filas = self._ndjson(b''.join(self._exportar(since=desde).streaming_content))
+        self.assertEqual([(fila['id'], fila['username']) for fila in filas], [(self.ids[4], 'Cambiado')])
+
+    def test_peticiones_invalidas(self):
+        """Prueba que se exija staff y se rechacen formato, cursor o since inválidos"""
+        usuario = Usuario.objects.get(pk=self.ids[1])
+        token = UsuarioService.generar_tokens_para_usuario(usuario)['access']
+        response = self.client.get(reverse('usuarios-export'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self._exportar(formato='xml').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._exportar(cursor='x').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._exportar(since='ayer').status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_streaming_bajo_asgi(self):
+        """Prueba que bajo ASGI la respuesta sea un iterador asíncrono y no se cargue entera"""
+        response = await AsyncClient().get(
+            reverse('usuarios-export'), headers={'Authorization': self.auth['HTTP_AUTHORIZATION']}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        contenido = b''.join([trozo async for trozo in response.streaming_content])
+        self.assertEqual([fila['id'] for fila in self._ndjson(contenido)], self.ids)
+
+    def test_comando_retoma_con_cursor(self):
+        """Prueba que el comando informe el último id y que --cursor continúe desde ahí"""
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'usuarios.ndjson.gz')
+            stderr = io.StringIO()
+            call_command('exportar_usuarios', salida=ruta, gzip=True, cursor=self.ids[1], stderr=stderr)
+            with gzip.open(ruta) as archivo:
+                filas = self._ndjson(archivo.read())
+            resumen = json.loads(stderr.getvalue())
+            self.assertEqual([fila['id'] for fila in filas], self.ids[2:])
+            self.assertEqual(resumen['filas'], len(self.ids) - 2)
+            self.assertEqual(resumen['ultimo_id'], self.ids[-1])
+            self.assertGreater(resumen['memoria_max_kib'], 0)
+
+            ruta = os.path.join(directorio, 'usuarios.csv')
+            call_command('exportar_usuarios', salida=ruta, formato='csv', since='2000-01-01', stderr=io.StringIO())
+            with open(ruta, encoding='utf-8') as archivo:
+                self.assertEqual(len(list(csv.reader(archivo))), len(self.ids) + 1)
+        with self.assertRaises(CommandError):
+            call_command('exportar_usuarios', since='no-es-fecha', stderr=io.StringIO())
+
+    def test_trozos_acotados(self):
+        """Prueba que la salida se emita en trozos de tamaño acotado y no de golpe"""
+        filas = ((i, f'u{i}', f'u{i}@example.com', f'D{i}', True, False, timezone.now()) for i in range(5000))
+        trozos = list(exportacion.codificar(filas, 'ndjson', tam_trozo=4096))
+        self.assertGreater(len(trozos), 50)
+        self.assertTrue(all(len(trozo) < 4096 + 200 for trozo in trozos))
+
+
+class ImportacionUsuariosTests(TestCase):
+    """Pruebas para la importación masiva desde CSV (comando importar_usuarios)"""
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        self.ruta = os.path.join(self.directorio.name, 'usuarios.csv')
+        Usuario.objects.create_user(
+            email='existente@example.com', username='Existente', dni='IMP-0', password='password123'
+        )
+
+    def _escribir(self, filas, cabecera=('email', 'username', 'dni', 'password', 'password_hash')):
+        with open(self.ruta, 'w', newline='', encoding='utf-8') as archivo:
+            escritor = csv.writer(archivo)
+            escritor.writerow(cabecera)
+            escritor.writerows(filas)
+
+    def _importar(self, **opciones):
+        stdout = io.StringIO()
+        call_command('importar_usuarios', self.ruta, procesos=0, stdout=stdout, stderr=io.StringIO(), **opciones)
+        return json.loads(stdout.getvalue())
+
+    def _informe(self):
+        with open(f'{self.ruta}.rechazados.csv', encoding='utf-8') as archivo:
+            return list(csv.DictReader(archivo))
+
+    def test_importa_en_claro_y_hasheadas(self):
+        """Prueba que se importen contraseñas en claro y ya hasheadas y que ambas sirvan para el login"""
+        self._escribir([
+            ('Ana@EXAMPLE.com', 'Ana', 'IMP-1', 'clave-ana', ''),
+            ('beto@example.com', 'Beto', 'IMP-2', '', make_password('clave-beto')),
+        ])
+        resumen = self._importar()
+        self.assertEqual(resumen['insertadas'], 2)
+        self.assertEqual(resumen['hasheadas'], 1)
+        self.assertTrue(Usuario.objects.get(email='Ana@example.com').check_password('clave-ana'))
+        for email, password in (('ana@example.com', 'clave-ana'), ('beto@example.com', 'clave-beto')):
+            response = Client().post(
+                reverse('login'), {'email': email, 'password': password}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(EventoUsuario.objects.filter(event_type=EventoUsuario.CREADO).count(), 2)
+        self.assertFalse(os.path.exists(f'{self.ruta}.checkpoint.json'))
+
+    def test_informe_de_rechazos(self):
+        """Prueba que las filas inválidas y los duplicados del archivo o de la BD vayan al informe"""
+        self._escribir([
+            ('nueva@example.com', 'Nueva', 'IMP-1', 'clave', ''),
+            ('NUEVA@example.com', 'Otra', 'IMP-2', 'clave', ''),
+            ('existente@EXAMPLE.com', 'Repetida', 'IMP-3', 'clave', ''),
+            ('dni@example.com', 'Dni', 'IMP-0', 'clave', ''),
+            ('no-es-email', 'Mala', 'IMP-4', 'clave', ''),
+            ('sin-clave@example.com', 'SinClave', 'IMP-5', '', ''),
+            ('hash@example.com', 'Hash', 'IMP-6', '', 'md5$no-existe'),
+        ])
+        resumen = self._importar(sin_eventos=True)
+        self.assertEqual((resumen['insertadas'], resumen['duplicadas'], resumen['invalidas']), (1, 3, 3))
+        informe = self._informe()
+        self.assertEqual([fila['linea'] for fila in informe], ['3', '4', '5', '6', '7', '8'])
+        self.assertEqual(informe[0]['motivo'], importacion.MENSAJE_EMAIL_DUPLICADO)
+        self.assertEqual(informe[1]['motivo'], importacion.MENSAJE_EMAIL_DUPLICADO)
+        self.assertEqual(informe[2]['motivo'], importacion.MENSAJE_DNI_DUPLICADO)
+        self.assertEqual(informe[3]['motivo'], importacion.MENSAJE_EMAIL_INVALIDO)
+        self.assertEqual(informe[4]['motivo'], importacion.MENSAJE_SIN_PASSWORD)
+        self.assertEqual(informe[5]['motivo'], importacion.MENSAJE_HASH_DESCONOCIDO)
+        self.assertFalse(EventoUsuario.objects.exists())
+
+    def test_reanuda_desde_checkpoint(self):
+        """Prueba que tras un corte --reanudar siga desde el último lote confirmado"""
+        encoded = make_password('clave')
+        self._escribir([(f'lote{i}@example.com', f'Lote{i}', f'IMP-{i + 1}', '', encoded) for i in range(5)])
+        original = importacion.Importador.procesar_lote
+        llamadas = []
+
+        def cortar_en_el_segundo(importador, filas):
+            llamadas.append(len(filas))
+            if len(llamadas) == 2:
+                raise KeyboardInterrupt
+            return original(importador, filas)
+
+        with mock.patch.object(importacion.Importador, 'procesar_lote', cortar_en_el_segundo):
+            with self.assertRaises(KeyboardInterrupt):
+                self._importar(lote=2)
+        self.assertEqual(Usuario.objects.filter(email__startswith='lote').count(), 2)
+        with self.assertRaises(CommandError):
+            self._importar(lote=2)
+
+        resumen = self._importar(lote=2, reanudar=True)
+        self.assertEqual(resumen['leidas'], 5)
+        self.assertEqual(resumen['insertadas'], 5)
+        self.assertEqual(resumen['duplicadas'], 0)
+        self.assertEqual(Usuario.objects.filter(email__startswith='lote').count(), 5)
+        self.assertFalse(os.path.exists(f'{self.ruta}.checkpoint.json'))
+
+    def test_cabecera_incompleta(self):
+        """Prueba que un CSV sin columnas obligatorias se rechace antes de importar nada"""
+        self._escribir([('a@example.com', 'clave')], cabecera=('email', 'password'))
+        with self.assertRaises(CommandError):
+            self._importar()
+
+
+class UsuarioDetalleETagTests(TestCase):
+    """Pruebas para el detalle de usuario con ETag (/api/usuarios/<id>/)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create(
+            email='etag@example.com', username='Etag', dni='ET1', password=make_password('password123')
+        )
+
+    def setUp(self):
+        self.client = Client()
+        token = UsuarioService.generar_tokens_para_usuario(self.usuario)['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        cache_usuarios.reiniciar_cache()
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+
+    def _pedir(self, id=None, **cabeceras):
+        return self.client.get(reverse('usuario-detalle', args=[id or self.usuario.id]), **self.auth, **cabeceras)
+
+    def test_detalle_con_etag(self):
+        """Prueba que el detalle devuelva la proyección de lectura con ETag fuerte y sin caché compartida"""
+        response = self._pedir()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'id': self.usuario.id, 'username': 'Etag', 'email': 'etag@example.com', 'dni': 'ET1'})
+        self.assertRegex(response['ETag'], r'^"\d+-\d+"$')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_solo_el_propio_usuario_o_staff(self):
+        """Prueba que otro usuario reciba 404 (también con If-None-Match) y que el staff pueda leerlo"""
+        otro = Usuario.objects.create(
+            email='otro-etag@example.com', username='Otro', dni='ET2', password=make_password('password123')
+        )
+        etag = self._pedir()['ETag']
+        token_otro = UsuarioService.generar_tokens_para_usuario(otro)['access']
+        url = reverse('usuario-detalle', args=[self.usuario.id])
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token_otro}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token_otro}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
+        Usuario.objects.filter(pk=otro.pk).update(is_staff=True)
+        otro.is_staff = True
+        token_staff = UsuarioService.generar_tokens_para_usuario(otro)['access']
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token_staff}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'etag@example.com')
+        self.assertEqual(
+            self.client.get(reverse('usuario-detalle', args=[999999]), HTTP_AUTHORIZATION=f'Bearer {token_staff}').status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_304_solo_con_la_version(self):
+        """Prueba que If-None-Match responda 304 consultando solo updated_at"""
+        etag = self._pedir()['ETag']
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._pedir(HTTP_IF_NONE_MATCH=f'"otro", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        # La otra consulta es la instantánea de la autenticación JWT (caché desactivada)
+        sql = sentencias(consultas)
+        self.assertEqual(len(sql), 2)
+        self.assertEqual(sum('"updated_at"' in consulta for consulta in sql), 1)
+        self.assertFalse(any('"password"' in consulta for consulta in sql))
+
+    @override_settings(USUARIO_CACHE={'ACTIVA': True, 'TTL_LOCAL': 60, 'TTL_COMPARTIDO': 60, 'TTL_SNAPSHOT': 60})
+    def test_304_desde_cache_y_cambio_tras_escritura(self):
+        """Prueba que con la caché caliente el 304 no consulte la BD y que una escritura cambie el ETag"""
+        etag = self._pedir()['ETag']
+        self._pedir(HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._pedir(HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        UsuarioRepository.actualizar(self.usuario.id, {'username': 'Etag 2'})
+        response = self._pedir(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['username'], 'Etag 2')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class BajaLogicaTests(TestCase):
+    """Pruebas para la baja lógica de usuarios y su purga (comando purgar_usuarios)"""
+
+    def setUp(self):
+        self.password = 'password123'
+        self.usuario = Usuario.objects.create_user(
+            email='baja@example.com', username='Baja', dni='BAJA1', password=self.password
+        )
+        self.usuario.groups.add(Group.objects.create(name='bajas'))
+
+    def test_baja_oculta_al_usuario(self):
+        """Prueba que tras la baja el usuario no pueda hacer login ni aparezca en lecturas, y que no se reutilice su email"""
+        token = UsuarioService.generar_tokens_para_usuario(self.usuario)['access']
+        self.assertTrue(UsuarioService.eliminar_usuario(self.usuario.id))
+        self.assertFalse(UsuarioService.eliminar_usuario(self.usuario.id))
+
+        self.assertIsNotNone(Usuario.todos.get(pk=self.usuario.id).deleted_at)
+        self.assertIsNone(UsuarioService.obtener_usuario(self.usuario.id))
+        self.assertEqual(UsuarioService.obtener_usuarios_lote(ids=[self.usuario.id])[1], [self.usuario.id])
+        with self.assertRaises(ValueError):
+            UsuarioService.autenticar_usuario('baja@example.com', self.password)
+        response = Client().get(
+            reverse('usuario-detalle', args=[self.usuario.id]), HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with self.assertRaisesMessage(ValueError, 'El email ya está registrado.'):
+            UsuarioService.crear_usuario({'email': 'BAJA@example.com', 'username': 'Otra', 'dni': 'BAJA2', 'password': 'x'})
+        resultados = list(UsuarioService.crear_usuarios_bulk([json.dumps(
+            {'email': 'baja@example.com', 'username': 'Otra', 'dni': 'BAJA3', 'password': 'x'}
+        )]))
+        self.assertEqual(resultados, [{'linea': 1, 'error': 'El email ya está registrado.'}])
+
+    def test_purga_por_lotes(self):
+        """Prueba que la purga borre las bajas y sus filas M2M por lotes, respetando la antigüedad"""
+        Usuario.objects.bulk_create([
+            Usuario(email=f'purga{i}@example.com', username=f'Purga {i}', dni=f'PURGA{i}', password='x')
+            for i in range(4)
+        ])
+        ids = list(Usuario.objects.filter(email__startswith='purga').values_list('id', flat=True))
+        for id in [self.usuario.id, *ids[:3]]:
+            UsuarioRepository.eliminar(id)
+
+        stdout = io.StringIO()
+        call_command('purgar_usuarios', antiguedad_horas=1, pausa=0, stdout=stdout)
+        self.assertEqual(json.loads(stdout.getvalue())['usuarios'], 0)
+
+        stdout = io.StringIO()
+        call_command('purgar_usuarios', lote=2, pausa=0, stdout=stdout)
+        resumen = json.loads(stdout.getvalue())
+        self.assertEqual((resumen['usuarios'], resumen['lotes'], resumen['abortados']), (4, 2, 0))
+        self.assertIn('espera_bloqueo_max_ms', resumen)
+        self.assertEqual(list(Usuario.todos.filter(email__contains='@example.com').values_list('id', flat=True)), ids[3:])
+        self.assertFalse(Usuario.groups.through.objects.filter(usuario_id=self.usuario.id).exists())
+
+
+class PermisosBitsetTests(TestCase):
+    """Pruebas para el bitset de permisos de la columna, los tokens y has_perm"""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create(
+            email='perms@example.com', username='Perms', dni='PE1', password=make_password('password123')
+        )
+        self.grupo = Group.objects.create(name='editores')
+        self.cambiar = Permission.objects.get(content_type__app_label='usuario', codename='change_usuario')
+        self.ver = Permission.objects.get(content_type__app_label='usuario', codename='view_usuario')
+        self.grupo.permissions.add(self.cambiar)
+        cache_usuarios.reiniciar_cache()
+        self.addCleanup(cache_usuarios.reiniciar_cache)
+        permisos.reiniciar_mapa()
+        self.addCleanup(permisos.reiniciar_mapa)
+
+    def _bitset(self):
+        return permisos.decodificar(Usuario.objects.values_list('permisos', flat=True).get(pk=self.usuario.pk))
+
+    def _token_user(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return SnapshotJWTAuthentication().authenticate(request)[0]
+
+    def test_bits_asignados_al_migrar(self):
+        """Prueba que cada permiso tenga un bit distinto tras migrar"""
+        mapa = permisos.obtener_mapa()
+        self.assertEqual(len(mapa), Permission.objects.count())
+        self.assertEqual(sorted(mapa.values()), list(range(len(mapa))))
+        self.assertIn('usuario.change_usuario', mapa)
+
+    def test_recalculo_con_grupos_y_permisos(self):
+        """Prueba que la columna siga a los grupos, los permisos directos y los del grupo"""
+        mapa = permisos.obtener_mapa()
+        self.assertIsNone(Usuario.objects.get(pk=self.usuario.pk).permisos)
+        self.usuario.groups.add(self.grupo)
+        self.assertEqual(self._bitset(), 1 << mapa['usuario.change_usuario'])
+        self.usuario.user_permissions.add(self.ver)
+        self.grupo.permissions.remove(self.cambiar)
+        self.assertEqual(self._bitset(), 1 << mapa['usuario.view_usuario'])
+        self.usuario.user_permissions.clear()
+        self.grupo.permissions.add(self.cambiar)
+        self.assertEqual(self._bitset(), 1 << mapa['usuario.change_usuario'])
+        self.grupo.delete()
+        self.assertEqual(self._bitset(), 0)
+
+    def test_has_perm_sin_consultas(self):
+        """Prueba que has_perm del modelo resuelva con la columna y sin consultas"""
+        self.usuario.groups.add(self.grupo)
+        usuario = Usuario.objects.get(pk=self.usuario.pk)
+        permisos.obtener_mapa()
+        with self.assertNumQueries(0):
+            self.assertTrue(usuario.has_perm('usuario.change_usuario'))
+            self.assertFalse(usuario.has_perm('usuario.delete_usuario'))
+            self.assertTrue(usuario.has_perms(['usuario.change_usuario']))
+        usuario.is_active = False
+        self.assertFalse(usuario.has_perm('usuario.change_usuario'))
+
+    def test_claims_y_has_perm_del_token(self):
+        """Prueba que el token lleve perms e is_superuser y que el usuario del token los use"""
+        self.usuario.groups.add(self.grupo)
+        usuario = Usuario.objects.get(pk=self.usuario.pk)
+        tokens = UsuarioService.generar_tokens_para_usuario(usuario)
+        access = AccessToken(tokens['access'])
+        self.assertEqual(access[permisos.CLAIM], usuario.permisos)
+        self.assertFalse(access['is_superuser'])
+
+        token_user = self._token_user(tokens['access'])
+        permisos.obtener_mapa()
+        with self.assertNumQueries(0):
+            self.assertTrue(token_user.has_perm('usuario.change_usuario'))
+            self.assertFalse(token_user.has_perm('usuario.view_usuario'))
+        self.assertFalse(token_user.has_perm('usuario.change_usuario', obj=usuario))
+
+    def test_refresh_refleja_cambios(self):
+        """Prueba que el refresco emita el bitset vigente del usuario"""
+        refresh = UsuarioService.generar_tokens_para_usuario(self.usuario)['refresh']
+        self.assertEqual(RefreshToken(refresh)[permisos.CLAIM], '')
+        self.usuario.user_permissions.add(self.ver)
+        nuevos = UsuarioService.refrescar_tokens(refresh)
+        bitset = permisos.decodificar(AccessToken(nuevos['access'])[permisos.CLAIM])
+        self.assertEqual(bitset, 1 << permisos.obtener_mapa()['usuario.view_usuario'])
+
+    def test_endpoint_de_bits(self):
+        """Prueba que /api/permisos/bits/ devuelva el mapa nombre -> bit"""
+        token = UsuarioService.generar_tokens_para_usuario(self.usuario)['access']
+        response = self.client.get(reverse('permisos-bits'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), dict(PermisoBit.objects.values_list('nombre', 'bit')))
+        self.assertEqual(self.client.get(reverse('permisos-bits')).status_code, status.HTTP_401_UNAUTHORIZED)
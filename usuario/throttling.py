@@ -0,0 +1,188 @@
+"""
+Límite de intentos de login fallidos por email y por IP.
+
+Cada contador es una ventana deslizante aproximada: dos cubetas fijas
+(actual y anterior) en el backend de caché, ponderando la anterior por la
+fracción de ventana que aún se solapa. Ambas identidades se leen con un único
+`get_many`.
+
+Cuando una identidad supera el límite se recuerda en una LRU local hasta que
+pueda volver a intentarlo, así que durante un ataque las peticiones rechazadas
+no tocan ni la caché compartida ni la BD, y nunca llegan a calcular PBKDF2.
+
+Los contadores solo son globales si el backend de caché es compartido (Redis).
+Con locmem cada worker cuenta por su cuenta: los límites se dividen entre los
+PROCESOS (WEB_CONCURRENCY) para que el total por nodo siga siendo el
+configurado, aunque se pierden al reiniciar.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from usuario.cache import LRUConTTL, es_por_proceso
+
+
+CONFIG_POR_DEFECTO = {
+    'ACTIVO': True,
+    'VENTANA': 300,
+    'MAX_FALLOS_EMAIL': 5,
+    'MAX_FALLOS_IP': 50,
+    'ALIAS': 'default',
+    'MAX_BLOQUEOS_LOCALES': 100000,
+    'PROCESOS': 1,
+}
+
+
+class LoginBloqueado(Exception):
+    """Demasiados intentos fallidos: se rechaza sin verificar la contraseña."""
+
+    def __init__(self, retry_after):
+        super().__init__("Demasiados intentos fallidos, intente más tarde.")
+        self.retry_after = retry_after
+
+
+class LimitadorLogin:
+
+    def __init__(self, ventana, max_fallos_email, max_fallos_ip, alias, max_bloqueos_locales):
+        self.ventana = ventana
+        self.limites = {'email': max_fallos_email, 'ip': max_fallos_ip}
+        self.alias = alias
+        self.bloqueos = LRUConTTL(max_bloqueos_locales, ventana)
+        self._lock = threading.Lock()
+        self._contadores = {'rechazos_locales': 0, 'rechazos': 0, 'fallos': 0}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    @staticmethod
+    def _identidades(email, ip):
+        identidades = []
+        if email:
+            identidades.append(('email', str(email).strip().lower()))
+        if ip:
+            identidades.append(('ip', ip))
+        return identidades
+
+    def _clave(self, tipo, identidad, cubeta):
+        resumen = hashlib.sha1(identidad.encode()).hexdigest()
+        return f'login:fallos:{tipo}:{resumen}:{cubeta}'
+
+    def _claves(self, identidades, ahora):
+        cubeta = int(ahora // self.ventana)
+        return {
+            (tipo, identidad): (self._clave(tipo, identidad, cubeta), self._clave(tipo, identidad, cubeta - 1))
+            for tipo, identidad in identidades
+        }
+
+    def verificar(self, email, ip):
+        """Lanza LoginBloqueado si el email o la IP superan su límite."""
+        ahora = time.time()
+        identidades = self._identidades(email, ip)
+
+        # Camino rápido: bloqueo ya conocido por este proceso.
+        for tipo, identidad in identidades:
+            encontrado, hasta = self.bloqueos.obtener((tipo, identidad))
+            if encontrado and hasta > ahora:
+                self._contar('rechazos_locales')
+                raise LoginBloqueado(max(int(hasta - ahora), 1))
+
+        claves = self._claves(identidades, ahora)
+        valores = self.cache.get_many([clave for par in claves.values() for clave in par])
+        solapamiento = 1 - (ahora % self.ventana) / self.ventana
+        for (tipo, identidad), (actual, anterior) in claves.items():
+            fallos = valores.get(actual, 0) + valores.get(anterior, 0) * solapamiento
+            if fallos >= self.limites[tipo]:
+                hasta = ahora + self.ventana - ahora % self.ventana
+                self.bloqueos.guardar((tipo, identidad), hasta)
+                self._contar('rechazos')
+                raise LoginBloqueado(max(int(hasta - ahora), 1))
+
+    def registrar_fallo(self, email, ip):
+        self._contar('fallos')
+        ahora = time.time()
+        for actual, _ in self._claves(self._identidades(email, ip), ahora).values():
+            # add() + incr(): incr falla si la clave no existe todavía.
+            self.cache.add(actual, 0, self.ventana * 2)
+            try:
+                self.cache.incr(actual)
+            except ValueError:
+                self.cache.set(actual, 1, self.ventana * 2)
+
+    def registrar_exito(self, email):
+        # Un login correcto reinicia el contador del email, no el de la IP.
+        claves = self._claves(self._identidades(email, None), time.time())
+        self.cache.delete_many([clave for par in claves.values() for clave in par])
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._contadores)
+
+
+_limitador = None
+_limitador_lock = threading.Lock()
+
+
+def obtener_limitador():
+    """Devuelve el limitador del proceso, o None si está desactivado."""
+    global _limitador
+    if _limitador is None:
+        with _limitador_lock:
+            conf = {**CONFIG_POR_DEFECTO, **getattr(settings, 'LOGIN_THROTTLE', {})}
+            if _limitador is None and conf['ACTIVO']:
+                # Contadores por worker: cada uno admite su parte del límite
+                procesos = max(1, conf['PROCESOS']) if es_por_proceso(conf['ALIAS']) else 1
+                _limitador = LimitadorLogin(
+                    conf['VENTANA'],
+                    max(1, conf['MAX_FALLOS_EMAIL'] // procesos),
+                    max(1, conf['MAX_FALLOS_IP'] // procesos),
+                    conf['ALIAS'],
+                    conf['MAX_BLOQUEOS_LOCALES'],
+                )
+    return _limitador
+
+
+def reiniciar_limitador():
+    global _limitador
+    with _limitador_lock:
+        _limitador = None
+
+
+@receiver(setting_changed)
+def _reiniciar_si_cambia_config(*, setting, **kwargs):
+    if setting in ('LOGIN_THROTTLE', 'CACHES'):
+        reiniciar_limitador()
+
+
+# --- API pública ---
+
+def verificar_intento(email, ip):
+    limitador = obtener_limitador()
+    if limitador is not None:
+        limitador.verificar(email, ip)
+
+
+def registrar_fallo(email, ip):
+    limitador = obtener_limitador()
+    if limitador is not None:
+        limitador.registrar_fallo(email, ip)
+
+
+def registrar_exito(email):
+    limitador = obtener_limitador()
+    if limitador is not None:
+        limitador.registrar_exito(email)
+
+
+def estadisticas():
+    limitador = obtener_limitador()
+    return limitador.estadisticas() if limitador is not None else {}
@@ -0,0 +1,69 @@
+"""
+Mediciones por petición para la cabecera Server-Timing.
+
+`ServerTimingMiddleware` abre un contexto al empezar la petición; el código
+instrumentado (consultas SQL, hash de contraseñas, firma de JWT, parseo de
+DRF) acumula en él duración y número de llamadas por fase. Fuera de una
+petición (comandos, tests de servicio) `medir` y `acumular` no hacen nada.
+
+Las consultas se miden con un execute wrapper instalado una sola vez en cada
+conexión al crearse (`connection_created`, ver apps.py) y no por petición:
+resolver `django.db.connection` cuesta varios microsegundos.
+"""
+import time
+from contextvars import ContextVar
+
+
+_mediciones = ContextVar('server_timing', default=None)
+
+
+def iniciar():
+    return _mediciones.set({})
+
+
+def terminar(token):
+    mediciones = _mediciones.get()
+    _mediciones.reset(token)
+    return mediciones or {}
+
+
+def acumular(fase, segundos):
+    mediciones = _mediciones.get()
+    if mediciones is None:
+        return
+    acumulado = mediciones.get(fase)
+    if acumulado is None:
+        mediciones[fase] = [segundos, 1]
+    else:
+        acumulado[0] += segundos
+        acumulado[1] += 1
+
+
+class medir:
+    """Context manager que suma el tiempo del bloque a la fase `fase`."""
+
+    __slots__ = ('fase', 'inicio')
+
+    def __init__(self, fase):
+        self.fase = fase
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        acumular(self.fase, time.perf_counter() - self.inicio)
+
+
+def medir_consulta(execute, sql, params, many, context):
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        acumular('db', time.perf_counter() - inicio)
+
+
+def instalar_en_conexion(sender, connection, **kwargs):
+    """Receptor de `connection_created`: la señal se repite en cada reconexión."""
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consulta)
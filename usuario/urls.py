@@ -1,7 +1,23 @@
-from django.urls import path
-from usuario.views import login_view, register_view
+from django.conf import settings
+from django.urls import path, re_path
+from usuario.views import login_view, register_view, register_bulk_view, usuarios_view, usuarios_search_view
+from usuario.views import usuarios_batch_view, usuarios_export_view, usuario_detalle_view, permisos_bits_view
+from usuario.views import alogin_view, aregister_view, token_refresh_view
+
+# Con MODO_SERVIDOR=asgi (worker uvicorn) login y registro son vistas asíncronas
+if settings.VISTAS_ASYNC:
+    login_view, register_view = alogin_view, aregister_view
 
 urlpatterns = [
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
+    path('token/refresh/', token_refresh_view, name='token-refresh'),
+    path('register/bulk/', register_bulk_view, name='register-bulk'),
+    path('usuarios/', usuarios_view, name='usuarios'),
+    path('usuarios/search/', usuarios_search_view, name='usuarios-search'),
+    path('usuarios/export/', usuarios_export_view, name='usuarios-export'),
+    path('usuarios/<int:id>/', usuario_detalle_view, name='usuario-detalle'),
+    # Con y sin barra final: APPEND_SLASH no puede redirigir un POST
+    re_path(r'^usuarios/batch/?$', usuarios_batch_view, name='usuarios-batch'),
+    path('permisos/bits/', permisos_bits_view, name='permisos-bits'),
 ]
\ No newline at end of file
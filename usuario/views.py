@@ -1,8 +1,69 @@
-from rest_framework.decorators import api_view
+import hmac
+import ipaddress
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.throttling import BaseThrottle
 from rest_framework.response import Response
 from rest_framework import status
 from usuario.services import UsuarioService
-from usuario.serializers import UsuarioSerializer
+from usuario import metricas
+from usuario import timing
+from usuario.hashing import PoolHashSaturado
+from usuario.throttling import LoginBloqueado
+from usuario import proyecciones
+from usuario import exportacion
+from usuario import permisos
+from usuario.models import CAMPOS_BUSQUEDA
+
+# Longitud máxima de una línea NDJSON en el registro masivo
+MAX_LINEA_BULK = 64 * 1024
+
+# Tamaño de página del listado de usuarios
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+# Máximo de ids o emails por petición a /api/usuarios/batch
+LIMITE_LOTE = 1000
+
+# Longitud mínima del texto buscado: un prefijo de 1 carácter recorre demasiado índice
+MIN_BUSQUEDA = 2
+
+# El detalle de un usuario solo lo guarda el cliente, y siempre revalidando con su ETag
+CACHE_CONTROL_DETALLE = 'private, no-cache'
+EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def respuesta_saturado(error):
+    # 503 rápido: el pool de hashing no admite más trabajo en este momento.
+    return Response(
+        {'error': str(error)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(error.retry_after)},
+    )
+
+
+def respuesta_lectura(texto, estado=status.HTTP_200_OK):
+    # JSON ya codificado por usuario/proyecciones.py: no pasa por el renderer de DRF.
+    return HttpResponse(texto, status=estado, content_type='application/json')
+
+
+def respuesta_bloqueado(error):
+    # 429: demasiados intentos fallidos para este email o IP.
+    return Response(
+        {'error': str(error)},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(error.retry_after)},
+    )
 
 
 @api_view(['POST'])
@@ -10,11 +71,21 @@ def login_view(request):
     if request.method == 'POST':
         email = request.data.get('email')
         password = request.data.get('password')
+        # IP del cliente según REST_FRAMEWORK['NUM_PROXIES'] (X-Forwarded-For detrás de proxies)
+        ip = BaseThrottle().get_ident(request)
         try:
-            auth_data = UsuarioService.autenticar_usuario(email, password)
+            auth_data = UsuarioService.autenticar_usuario(email, password, ip=ip)
+            metricas.logins.labels('exito').inc()
             return Response(auth_data)  
         except ValueError as e:
+            metricas.logins.labels('fallo').inc()
             return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+        except LoginBloqueado as e:
+            metricas.logins.labels('bloqueado').inc()
+            return respuesta_bloqueado(e)
+        except PoolHashSaturado as e:
+            metricas.logins.labels('saturado').inc()
+            return respuesta_saturado(e)
     return Response({'error': 'Método no permitido'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
@@ -25,11 +96,355 @@ def register_view(request):
         try:
             nuevo_usuario = UsuarioService.crear_usuario(usuario_data)
             
-            #  CORRECCIÓN: Usar el Serializer para la respuesta
-            serializer = UsuarioSerializer(nuevo_usuario)
-            
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # Misma forma que UsuarioSerializer, sin construir el serializer
+            return respuesta_lectura(proyecciones.a_json(proyecciones.desde_modelo(nuevo_usuario)), status.HTTP_201_CREATED)
         
         except ValueError as e:
             #  Usamos 400 BAD REQUEST aquí, ya que el error viene de datos incompletos o duplicados.
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PoolHashSaturado as e:
+            return respuesta_saturado(e)
+
+
+@api_view(['POST'])
+@authentication_classes([])  # Se llama con el access token ya caducado: no debe validarse
+def token_refresh_view(request):
+    refresh = request.data.get('refresh')
+    if not refresh:
+        return Response({'error': 'El refresh token es obligatorio'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(UsuarioService.refrescar_tokens(refresh))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+# --- Versiones asíncronas (MODO_SERVIDOR=asgi, ver urls.py) ---
+# Vistas de Django y no de DRF: APIView es síncrona y bajo ASGI ocuparía un hilo
+# por petición. Solo aceptan JSON y responden lo mismo que las síncronas.
+
+def _json_error(mensaje, estado, retry_after=None):
+    headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+    return JsonResponse({'error': mensaje}, status=estado, headers=headers)
+
+
+def _cuerpo_json(request):
+    with timing.medir('parse'):
+        try:
+            datos = json.loads(request.body or b'{}')
+        except ValueError:
+            datos = None
+    if not isinstance(datos, dict):
+        raise ValueError('El cuerpo debe ser un objeto JSON.')
+    return datos
+
+
+@csrf_exempt
+@require_POST
+async def alogin_view(request):
+    try:
+        datos = _cuerpo_json(request)
+    except ValueError as e:
+        return _json_error(str(e), status.HTTP_400_BAD_REQUEST)
+    ip = BaseThrottle().get_ident(request)
+    try:
+        auth_data = await UsuarioService.aautenticar_usuario(datos.get('email'), datos.get('password'), ip=ip)
+        metricas.logins.labels('exito').inc()
+        return JsonResponse(auth_data)
+    except ValueError as e:
+        metricas.logins.labels('fallo').inc()
+        return _json_error(str(e), status.HTTP_401_UNAUTHORIZED)
+    except LoginBloqueado as e:
+        metricas.logins.labels('bloqueado').inc()
+        return _json_error(str(e), status.HTTP_429_TOO_MANY_REQUESTS, e.retry_after)
+    except PoolHashSaturado as e:
+        metricas.logins.labels('saturado').inc()
+        return _json_error(str(e), status.HTTP_503_SERVICE_UNAVAILABLE, e.retry_after)
+
+
+@csrf_exempt
+@require_POST
+async def aregister_view(request):
+    try:
+        nuevo_usuario = await UsuarioService.acrear_usuario(_cuerpo_json(request))
+        return respuesta_lectura(proyecciones.a_json(proyecciones.desde_modelo(nuevo_usuario)), status.HTTP_201_CREATED)
+    except ValueError as e:
+        return _json_error(str(e), status.HTTP_400_BAD_REQUEST)
+    except PoolHashSaturado as e:
+        return _json_error(str(e), status.HTTP_503_SERVICE_UNAVAILABLE, e.retry_after)
+
+
+def _lineas_ndjson(stream, max_linea=MAX_LINEA_BULK):
+    # Lee el cuerpo línea a línea sin cargarlo entero en memoria.
+    # Una línea más larga que `max_linea` se corta (y falla al parsear); el resto se descarta.
+    if stream is None:
+        return
+    while True:
+        linea = stream.readline(max_linea + 1)
+        if not linea:
+            return
+        if len(linea) > max_linea and not linea.endswith(b'\n'):
+            resto = linea
+            while resto and not resto.endswith(b'\n'):
+                resto = stream.readline(max_linea)
+        yield linea
+
+
+async def _iterar_en_hilo(iterador):
+    # Bajo ASGI, Django cargaría entero un iterador síncrono antes de enviarlo.
+    # Cada trozo se produce en el hilo de la petición (thread_sensitive), que
+    # es el que tiene abierta la conexión con el cursor del servidor.
+    siguiente = sync_to_async(next, thread_sensitive=True)
+    fin = object()
+    while (trozo := await siguiente(iterador, fin)) is not fin:
+        yield trozo
+
+
+def _cuerpo_streaming(request, trozos):
+    # Cuerpo de un StreamingHttpResponse que se envía trozo a trozo también bajo ASGI
+    if isinstance(request._request, ASGIRequest):
+        return _iterar_en_hilo(iter(trozos))
+    return trozos
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def register_bulk_view(request):
+    # Cuerpo NDJSON (un usuario por línea); la respuesta se emite línea a línea.
+    # Solo staff: el número de líneas (y de hashes) por petición no tiene límite.
+    resultados = UsuarioService.crear_usuarios_bulk(_lineas_ndjson(request.stream))
+    return StreamingHttpResponse(
+        _cuerpo_streaming(request, (json.dumps(resultado, ensure_ascii=False) + '\n' for resultado in resultados)),
+        content_type='application/x-ndjson',
+    )
+
+
+def _entero_opcional(valor, minimo=0, maximo=None):
+    # Parámetros de query: devuelve None si no viene, ValueError si no es válido.
+    if valor in (None, ''):
+        return None
+    numero = int(valor)
+    if numero < minimo or (maximo is not None and numero > maximo):
+        raise ValueError(valor)
+    return numero
+
+
+def _json_array_incremental(usuarios):
+    # Emite un array JSON fila a fila, sin construir la lista completa.
+    yield '['
+    separador = ''
+    for usuario in usuarios:
+        yield separador + proyecciones.a_json(usuario)
+        separador = ','
+    yield ']'
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def usuarios_view(request):
+    # Listado paginado por cursor (?cursor=<id>&limit=n) o completo en streaming (?stream=1).
+    try:
+        cursor = _entero_opcional(request.query_params.get('cursor'))
+        limite = _entero_opcional(request.query_params.get('limit'), minimo=1, maximo=LIMITE_MAXIMO)
+    except ValueError:
+        return Response({'error': 'Parámetros de paginación inválidos'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.query_params.get('stream') in ('1', 'true'):
+        usuarios = UsuarioService.iterar_usuarios_lectura(cursor=cursor)
+        return StreamingHttpResponse(
+            _cuerpo_streaming(request, _json_array_incremental(usuarios)), content_type='application/json'
+        )
+
+    usuarios, siguiente = UsuarioService.listar_usuarios_pagina(cursor, limite or LIMITE_POR_DEFECTO)
+    return respuesta_lectura(proyecciones.pagina_a_json(usuarios, siguiente))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def usuarios_search_view(request):
+    # Búsqueda por prefijo (?q=texto) en email, username y DNI, o solo en ?campo=...,
+    # paginada por cursor igual que el listado.
+    q = (request.query_params.get('q') or '').strip()
+    campo = request.query_params.get('campo')
+    if len(q) < MIN_BUSQUEDA:
+        return Response(
+            {'error': f'El parámetro q debe tener al menos {MIN_BUSQUEDA} caracteres'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if campo and campo not in CAMPOS_BUSQUEDA:
+        return Response(
+            {'error': f"campo debe ser uno de: {', '.join(CAMPOS_BUSQUEDA)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        cursor = _entero_opcional(request.query_params.get('cursor'))
+        limite = _entero_opcional(request.query_params.get('limit'), minimo=1, maximo=LIMITE_MAXIMO)
+    except ValueError:
+        return Response({'error': 'Parámetros de paginación inválidos'}, status=status.HTTP_400_BAD_REQUEST)
+
+    campos = (campo,) if campo else tuple(CAMPOS_BUSQUEDA)
+    usuarios, siguiente = UsuarioService.buscar_usuarios(q, campos, cursor, limite or LIMITE_POR_DEFECTO)
+    return respuesta_lectura(proyecciones.pagina_a_json(usuarios, siguiente))
+
+
+def _etag(id, version):
+    # Fuerte: cambia con cada escritura, porque todas actualizan updated_at
+    return '"%d-%d"' % (id, (version - EPOCA) // timedelta(microseconds=1))
+
+
+def _coincide_etag(if_none_match, etag):
+    # If-None-Match compara en modo débil: W/"x" equivale a "x"
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in (valor.removeprefix('W/') for valor in etags)
+
+
+def _no_modificado(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL_DETALLE
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def usuario_detalle_view(request, id):
+    # Perfil de un usuario con ETag. Con If-None-Match se compara antes con la
+    # versión (caché o SELECT de updated_at): un 304 no carga ni serializa la fila.
+    # Solo el propio usuario o el staff; al resto, 404 sin revelar si el id existe.
+    if not (request.user.is_staff or str(request.user.id) == str(id)):
+        return Response({'error': 'Usuario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        version = UsuarioService.obtener_version_usuario(id)
+        if version is not None and _coincide_etag(if_none_match, _etag(id, version)):
+            return _no_modificado(_etag(id, version))
+
+    usuario = UsuarioService.obtener_usuario(id)
+    if usuario is None:
+        return Response({'error': 'Usuario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    etag = _etag(usuario.id, usuario.updated_at)
+    if if_none_match and _coincide_etag(if_none_match, etag):
+        # La versión cacheada era anterior a la fila recién leída
+        return _no_modificado(etag)
+    response = respuesta_lectura(proyecciones.a_json(proyecciones.desde_modelo(usuario)))
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL_DETALLE
+    return response
+
+
+def _acepta_gzip(accept_encoding):
+    # Negociación de Accept-Encoding con sus q: "gzip;q=0" lo rechaza, x-gzip
+    # equivale a gzip y "*" vale para gzip si no aparece explícitamente.
+    calidades = {}
+    for parte in accept_encoding.split(','):
+        codificacion, _, parametros = parte.partition(';')
+        calidad = 1.0
+        for parametro in parametros.split(';'):
+            nombre, _, valor = parametro.partition('=')
+            if nombre.strip().lower() == 'q':
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        calidades[codificacion.strip().lower()] = calidad
+    explicitas = [calidades[codificacion] for codificacion in ('gzip', 'x-gzip') if codificacion in calidades]
+    if explicitas:
+        return max(explicitas) > 0
+    return calidades.get('*', 0) > 0
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def usuarios_export_view(request):
+    # Volcado completo para analítica (?formato=csv|ndjson&cursor=<id>&since=<fecha>),
+    # en streaming desde un cursor del servidor; gzip si el cliente lo acepta.
+    # No `format`: DRF lo reserva para elegir el renderer.
+    formato = request.query_params.get('formato', 'ndjson')
+    if formato not in exportacion.FORMATOS:
+        return Response(
+            {'error': f"formato debe ser uno de: {', '.join(exportacion.FORMATOS)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        cursor = _entero_opcional(request.query_params.get('cursor'))
+    except ValueError:
+        return Response({'error': 'Parámetros de paginación inválidos'}, status=status.HTTP_400_BAD_REQUEST)
+    since = request.query_params.get('since')
+    try:
+        desde = exportacion.parsear_desde(since) if since else None
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    gzip = _acepta_gzip(request.headers.get('Accept-Encoding', ''))
+    filas = UsuarioService.exportar_usuarios(exportacion.CAMPOS_EXPORTACION, cursor, desde)
+    trozos = exportacion.codificar(filas, formato, gzip)
+    response = StreamingHttpResponse(_cuerpo_streaming(request, trozos), content_type=exportacion.FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="usuarios.{formato}"'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _campos_lote(valor, clave):
+    # `fields`: lista o texto separado por comas. La clave del lote (id o email)
+    # se incluye siempre para poder emparejar resultados; orden de CAMPOS_LECTURA.
+    if valor is None:
+        return proyecciones.CAMPOS_LECTURA
+    pedidos = valor.split(',') if isinstance(valor, str) else valor
+    if not isinstance(pedidos, list) or not set(pedidos) <= set(proyecciones.CAMPOS_LECTURA):
+        raise ValueError(f"fields debe contener solo: {', '.join(proyecciones.CAMPOS_LECTURA)}")
+    return tuple(campo for campo in proyecciones.CAMPOS_LECTURA if campo in pedidos or campo in ('id', clave))
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def usuarios_batch_view(request):
+    # Datos de muchos usuarios en una petición para otros servicios:
+    # {"ids": [...]} o {"emails": [...]}, y opcionalmente "fields". Como el
+    # listado y la exportación, solo para staff (las cuentas de servicio).
+    ids, emails = request.data.get('ids'), request.data.get('emails')
+    if (ids is None) == (emails is None):
+        return Response({'error': 'Indique ids o emails (uno de los dos)'}, status=status.HTTP_400_BAD_REQUEST)
+    claves = ids if ids is not None else emails
+    tipo = int if ids is not None else str
+    if not isinstance(claves, list) or not all(type(clave) is tipo for clave in claves):
+        return Response(
+            {'error': 'ids debe ser una lista de enteros' if ids is not None else 'emails debe ser una lista de textos'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(claves) > LIMITE_LOTE:
+        return Response({'error': f'Máximo {LIMITE_LOTE} por petición'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        campos = _campos_lote(request.data.get('fields'), 'id' if ids is not None else 'email')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    usuarios, faltantes = UsuarioService.obtener_usuarios_lote(ids=ids, emails=emails)
+    return respuesta_lectura(proyecciones.lote_a_json(usuarios, campos, faltantes))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def permisos_bits_view(request):
+    # {'app_label.codename': bit} para que otros servicios lean el claim `perms`
+    return Response(permisos.obtener_mapa())
+
+
+def _scrape_permitido(request):
+    # REMOTE_ADDR y no X-Forwarded-For, que el cliente puede inventarse.
+    token = settings.METRICAS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        ip = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(ip in ipaddress.ip_network(red, strict=False) for red in settings.METRICAS_REDES)
+
+
+def metricas_view(request):
+    # Vista de Django sin DRF: el scrape no pasa por autenticación JWT ni parsers.
+    if not _scrape_permitido(request):
+        return HttpResponse(status=403)
+    cuerpo, content_type = metricas.exportar()
+    return HttpResponse(cuerpo, content_type=content_type)